@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 GNU MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compare image processing with and without jpeg_draft_mode.
+
+Decodes and scales each given JPEG the way process_image does, once
+with a full decode and once with a draft decode, and prints the time
+taken by each and how much the results differ:
+
+    ./bin/python devtools/jpeg_draft_benchmark.py photo1.jpg photo2.jpg
+"""
+
+import argparse
+import math
+import time
+
+import ImageChops
+import ImageStat
+
+from mediagoblin.media_types.image.processing import PIL_FILTERS, \
+    open_image, load_image, resize_image
+from mediagoblin.tools.exif import extract_exif
+
+
+def scale(filename, exif_tags, sizes, resize_filter, draft):
+    """Decode filename once and cascade it down through sizes."""
+    image = open_image(filename)
+    image = load_image(image, exif_tags, sizes if draft else None)
+    results = []
+    for size in sizes:
+        image = resize_image(image, size, resize_filter)
+        results.append(image)
+    return results
+
+
+def timed_scale(runs, *args):
+    best = None
+    for i in range(runs):
+        start = time.time()
+        results = scale(*args)
+        taken = time.time() - start
+        if best is None or taken < best:
+            best = taken
+    return best, results
+
+
+def compare(full, draft):
+    """Return (rms, psnr) of the difference between two images."""
+    if full.size != draft.size:
+        draft = draft.resize(full.size)
+    diff = ImageChops.difference(full.convert('RGB'), draft.convert('RGB'))
+    rms = math.sqrt(
+        sum(band ** 2 for band in ImageStat.Stat(diff).rms) / 3)
+    if rms == 0:
+        return rms, float('inf')
+    return rms, 20 * math.log10(255.0 / rms)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('files', nargs='+', help='JPEG files to process')
+    parser.add_argument(
+        '--size', type=int, nargs='+', default=[640, 180],
+        help='Square max sizes to create, like media:medium and media:thumb')
+    parser.add_argument(
+        '--filter', default='ANTIALIAS', choices=PIL_FILTERS.keys(),
+        help='resize_filter to finish with')
+    parser.add_argument(
+        '--runs', type=int, default=3,
+        help='Number of runs per file, the fastest one is reported')
+    args = parser.parse_args()
+
+    sizes = [(size, size) for size in sorted(args.size, reverse=True)]
+    resize_filter = PIL_FILTERS[args.filter]
+
+    for filename in args.files:
+        exif_tags = extract_exif(filename)
+        full_time, full_results = timed_scale(
+            args.runs, filename, exif_tags, sizes, resize_filter, False)
+        draft_time, draft_results = timed_scale(
+            args.runs, filename, exif_tags, sizes, resize_filter, True)
+
+        print '{0}: full {1:.3f}s, draft {2:.3f}s ({3:.1f}x)'.format(
+            filename, full_time, draft_time, full_time / draft_time)
+        for size, full, draft in zip(sizes, full_results, draft_results):
+            rms, psnr = compare(full, draft)
+            print '  {0}x{1}: rms {2:.2f}, psnr {3:.1f} dB'.format(
+                size[0], size[1], rms, psnr)
+
+
+if __name__ == '__main__':
+    main()
@@ -17,4 +17,7 @@
 admin_routes = [
     ('mediagoblin.admin.panel',
         '/panel',
-        'mediagoblin.admin.views:admin_processing_panel')]
+        'mediagoblin.admin.views:admin_processing_panel'),
+    ('mediagoblin.admin.query_stats',
+        '/queries',
+        'mediagoblin.admin.views:admin_query_stats')]
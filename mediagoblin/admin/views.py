@@ -18,6 +18,8 @@ from werkzeug.exceptions import Forbidden
 
 from mediagoblin.db.models import MediaEntry
 from mediagoblin.decorators import require_active_login
+from mediagoblin.meddleware.querystats import get_endpoint_stats
+from mediagoblin.processing import get_processing_progress
 from mediagoblin.tools.response import render_to_response
 
 @require_active_login
@@ -44,5 +46,22 @@ def admin_processing_panel(request):
         request,
         'mediagoblin/admin/panel.html',
         {'processing_entries': processing_entries,
+         'processing_progress': get_processing_progress(
+             processing_entries),
          'failed_entries': failed_entries,
          'processed_entries': processed_entries})
+
+
+@require_active_login
+def admin_query_stats(request):
+    '''
+    Show the SQL query statistics per endpoint
+    '''
+    if not request.user.is_admin:
+        raise Forbidden()
+
+    return render_to_response(
+        request,
+        'mediagoblin/admin/query_stats.html',
+        {'query_stats_enabled': request.db.query_recorder is not None,
+         'endpoint_stats': get_endpoint_stats()})
@@ -20,7 +20,6 @@ import logging
 from mediagoblin.routing import get_url_map
 from mediagoblin.tools.routing import endpoint_to_controller
 
-from werkzeug.wrappers import Request
 from werkzeug.exceptions import HTTPException, NotFound
 from werkzeug.routing import RequestRedirect
 
@@ -131,7 +130,7 @@ class MediaGoblinApp(object):
                            for m in meddleware.ENABLED_MEDDLEWARE]
 
     def call_backend(self, environ, start_response):
-        request = Request(environ)
+        request = mg_request.Request(environ)
 
         # Compatibility with django, use request.args preferrably
         request.GET = request.args
@@ -187,6 +186,7 @@ class MediaGoblinApp(object):
         try:
             found_rule, url_values = map_adapter.match(return_rule=True)
             request.matchdict = url_values
+            request.endpoint = found_rule.endpoint
         except RequestRedirect as response:
             # Deal with 301 responses eg due to missing final slash
             return response(environ, start_response)
@@ -18,7 +18,7 @@ import datetime
 
 from sqlalchemy import (MetaData, Table, Column, Boolean, SmallInteger,
                         Integer, Unicode, UnicodeText, DateTime,
-                        ForeignKey)
+                        ForeignKey, Index)
 from sqlalchemy.exc import ProgrammingError
 from sqlalchemy.ext.declarative import declarative_base
 from migrate.changeset.constraint import UniqueConstraint
@@ -195,3 +195,22 @@ def add_license_preference(db):
     col = Column('license_preference', Unicode)
     col.create(user_table)
     db.commit()
+
+
+@RegisterMigration(9, MIGRATIONS)
+def add_media_entry_listing_indexes(db):
+    """Add the indexes used by media listings and prev/next links"""
+    metadata = MetaData(bind=db.bind)
+
+    media_entry = inspect_table(metadata, 'core__media_entries')
+
+    Index('ix_core__media_entries_state_created',
+          media_entry.c.state, media_entry.c.created,
+          media_entry.c.id).create(db.bind)
+    Index('ix_core__media_entries_uploader_state_created',
+          media_entry.c.uploader, media_entry.c.state,
+          media_entry.c.created, media_entry.c.id).create(db.bind)
+    Index('ix_core__media_entries_uploader_state_id',
+          media_entry.c.uploader, media_entry.c.state,
+          media_entry.c.id).create(db.bind)
+    db.commit()
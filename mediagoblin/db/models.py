@@ -23,7 +23,7 @@ import datetime
 
 from sqlalchemy import Column, Integer, Unicode, UnicodeText, DateTime, \
         Boolean, ForeignKey, UniqueConstraint, PrimaryKeyConstraint, \
-        SmallInteger
+        SmallInteger, Index
 from sqlalchemy.orm import relationship, backref
 from sqlalchemy.orm.collections import attribute_mapped_collection
 from sqlalchemy.sql.expression import desc
@@ -97,6 +97,12 @@ class User(Base, UserMixin):
         from mediagoblin.db.util import clean_orphan_tags
         clean_orphan_tags(commit=False)
 
+        from mediagoblin.tools.feed import invalidate_feed, \
+            invalidate_collection_feed
+        invalidate_feed(u'user', self.username)
+        for collection in self.collections:
+            invalidate_collection_feed(collection)
+
         # Delete user, pass through commit=False/True in kwargs
         super(User, self).delete(**kwargs)
         _log.info('Deleted user "{0}" account'.format(self.username))
@@ -132,6 +138,15 @@ class MediaEntry(Base, MediaEntryMixin):
 
     __table_args__ = (
         UniqueConstraint('uploader', 'slug'),
+        # Listings filter on state and/or uploader and show the newest
+        # first, see also migration 9
+        Index('ix_core__media_entries_state_created',
+              'state', 'created', 'id'),
+        Index('ix_core__media_entries_uploader_state_created',
+              'uploader', 'state', 'created', 'id'),
+        # url_to_prev and url_to_next
+        Index('ix_core__media_entries_uploader_state_id',
+              'uploader', 'state', 'id'),
         {})
 
     get_uploader = relationship(User)
@@ -236,6 +251,10 @@ class MediaEntry(Base, MediaEntryMixin):
 
         :param del_orphan_tags: True/false if we delete unused Tags too
         :param commit: True/False if this should end the db transaction"""
+        # TODO: Import here due to cyclic imports!!!
+        from mediagoblin.tools.feed import invalidate_media_entry_feeds
+        invalidate_media_entry_feeds(self)
+
         # User's CollectionItems are automatically deleted via "cascade".
         # Delete all the associated comments
         for comment in self.get_comments():
@@ -256,6 +275,11 @@ class MediaEntry(Base, MediaEntryMixin):
             #       This cries for refactoring
             from mediagoblin.db.util import clean_orphan_tags
             clean_orphan_tags(commit=False)
+
+        # The id might get reused, so forget its gallery tile
+        from mediagoblin.tools.template import invalidate_template_fragment
+        invalidate_template_fragment("media_tile", self.id)
+
         # pass through commit=False/True in kwargs
         super(MediaEntry, self).delete(**kwargs)
 
@@ -25,8 +25,9 @@ _log = logging.getLogger(__name__)
 
 
 class DatabaseMaster(object):
-    def __init__(self, engine):
+    def __init__(self, engine, query_recorder=None):
         self.engine = engine
+        self.query_recorder = query_recorder
 
         for k, v in Base._decl_class_registry.iteritems():
             setattr(self, k, v)
@@ -47,6 +48,8 @@ class DatabaseMaster(object):
     def reset_after_request(self):
         Session.rollback()
         Session.remove()
+        if self.query_recorder is not None:
+            self.query_recorder.reset()
 
 
 def load_models(app_config):
@@ -80,9 +83,17 @@ def setup_connection_and_db_from_config(app_config):
 
     # logging.getLogger('sqlalchemy.engine').setLevel(logging.INFO)
 
+    # Count and time the queries of each request
+    query_recorder = None
+    if app_config.get('query_stats'):
+        from mediagoblin.meddleware.querystats import QueryRecorder
+        query_recorder = QueryRecorder(
+            app_config.get('slow_query_ms', 0) / 1000.0)
+        query_recorder.install(engine)
+
     Session.configure(bind=engine)
 
-    return DatabaseMaster(engine)
+    return DatabaseMaster(engine, query_recorder)
 
 
 def check_db_migrations_current(db):
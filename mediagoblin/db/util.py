@@ -14,8 +14,12 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from sqlalchemy.orm import joinedload, subqueryload, subqueryload_all, \
+    joinedload_all
+
 from mediagoblin.db.base import Session
-from mediagoblin.db.models import MediaEntry, Tag, MediaTag, Collection
+from mediagoblin.db.models import MediaEntry, Tag, MediaTag, Collection, \
+    CollectionItem
 
 
 ##########################
@@ -46,6 +50,31 @@ def media_entries_for_tag_slug(dummy_db, tag_slug):
             & (Tag.slug == tag_slug))
 
 
+def media_entries_for_gallery(query):
+    """
+    Eager load what a gallery (or feed) needs of each MediaEntry in query.
+
+    The thumbnail, the uploader (for url_for_self) and the tags would
+    otherwise each get lazy loaded per entry.  This keeps a page of
+    media at a constant number of queries.
+    """
+    return query.options(
+        joinedload(MediaEntry.get_uploader),
+        subqueryload(MediaEntry.media_files_helper),
+        subqueryload_all(MediaEntry.tags_helper, MediaTag.tag_helper))
+
+
+def collection_items_for_gallery(query):
+    """
+    Like media_entries_for_gallery, but for a query of CollectionItems.
+    """
+    return query.options(
+        joinedload_all(CollectionItem.get_media_entry,
+                       MediaEntry.get_uploader),
+        subqueryload_all(CollectionItem.get_media_entry,
+                         MediaEntry.media_files_helper))
+
+
 def clean_orphan_tags(commit=True):
     """Search for unused MediaTags and delete them"""
     q1 = Session.query(Tag).outerjoin(MediaTag).filter(MediaTag.id==None)
@@ -29,7 +29,10 @@ from mediagoblin.edit.lib import may_edit_media
 from mediagoblin.decorators import (require_active_login, active_user_from_url,
      get_media_entry_by_id, 
      get_user_media_entry,  user_may_alter_collection, get_user_collection)
+from mediagoblin.tools.feed import invalidate_media_entry_feeds, \
+    invalidate_collection_feed
 from mediagoblin.tools.response import render_to_response, redirect
+from mediagoblin.tools.template import invalidate_template_fragment
 from mediagoblin.tools.translate import pass_to_ugettext as _
 from mediagoblin.tools.text import (
     convert_to_tag_list_of_dicts, media_tags_as_string)
@@ -66,6 +69,9 @@ def edit_media(request, media):
             form.slug.errors.append(
                 _(u'An entry with that slug already exists for this user.'))
         else:
+            # Both the feeds of the old and the new tags change
+            invalidate_media_entry_feeds(media)
+
             media.title = request.form['title']
             media.description = request.form.get('description')
             media.tags = convert_to_tag_list_of_dicts(
@@ -74,6 +80,8 @@ def edit_media(request, media):
             media.license = unicode(request.form.get('license', '')) or None
             media.slug = slug
             media.save()
+            invalidate_template_fragment("media_tile", media.id)
+            invalidate_media_entry_feeds(media)
 
             return redirect(request,
                             location=media.url_for_self(request.urlgen))
@@ -133,12 +141,10 @@ def edit_attachments(request, media):
                 ['media_entries', unicode(media.id), 'attachment',
                  public_filename])
 
-            attachment_public_file = mg_globals.public_store.get_file(
-                attachment_public_filepath, 'wb')
-
             try:
-                attachment_public_file.write(
-                    request.files['attachment_file'].stream.read())
+                mg_globals.public_store.copy_file_to_storage(
+                    request.files['attachment_file'].stream,
+                    attachment_public_filepath)
             finally:
                 request.files['attachment_file'].stream.close()
 
@@ -326,6 +332,9 @@ def edit_collection(request, collection):
             form.slug.errors.append(
                 _(u'A collection with that slug already exists for this user.'))
         else:
+            # The feed is cached under the old slug
+            invalidate_collection_feed(collection)
+
             collection.title = unicode(request.form['title'])
             collection.description = unicode(request.form.get('description'))
             collection.slug = unicode(request.form['slug'])
@@ -41,6 +41,10 @@ SUBCOMMAND_MAP = {
         'setup': 'mediagoblin.gmg_commands.dbupdate:dbupdate_parse_setup',
         'func': 'mediagoblin.gmg_commands.dbupdate:dbupdate',
         'help': 'Set up or update the SQL database'},
+    'dbexplain': {
+        'setup': 'mediagoblin.gmg_commands.dbexplain:dbexplain_parser_setup',
+        'func': 'mediagoblin.gmg_commands.dbexplain:dbexplain',
+        'help': 'Check the query plans of the main listing queries'},
     'theme': {
         'setup': 'mediagoblin.gmg_commands.theme:theme_parser_setup',
         'func': 'mediagoblin.gmg_commands.theme:theme',
@@ -0,0 +1,159 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+import re
+
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import Executable, ClauseElement, desc
+
+from mediagoblin.db.open import setup_connection_and_db_from_config
+from mediagoblin.db.base import Session
+from mediagoblin.init import setup_global_and_app_config
+from mediagoblin.tools.common import simple_printer
+from mediagoblin.tools.pagination import PAGINATION_DEFAULT_PER_PAGE
+
+
+def dbexplain_parser_setup(subparser):
+    subparser.add_argument(
+        '--allow-seqscan', action='store_true',
+        help=(u"On PostgreSQL, plan the queries like the server would "
+              u"for the current data.  By default sequential scans are "
+              u"discouraged, so small tables still show whether an "
+              u"index could be used."))
+
+
+class Explain(Executable, ClauseElement):
+    """EXPLAIN a select statement"""
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(Explain)
+def _compile_explain(element, compiler, **kw):
+    if compiler.dialect.name == 'sqlite':
+        prefix = 'EXPLAIN QUERY PLAN '
+    else:
+        prefix = 'EXPLAIN '
+    return prefix + compiler.process(element.statement, **kw)
+
+
+def canonical_queries(db):
+    """
+    Return a list of (description, query) for the queries the listing
+    views run on every request.  The values filtered on are just
+    samples; the plans don't depend on them.
+    """
+    MediaEntry = db.MediaEntry
+    uploader = 1
+    entry_id = 1
+    created = datetime.datetime.now()
+    newest_first = (MediaEntry.created.desc(), MediaEntry.id.desc())
+
+    processed = MediaEntry.query.filter_by(state=u'processed')
+    user_processed = MediaEntry.query.filter_by(
+        uploader=uploader, state=u'processed')
+
+    return [
+        ('root_view / tag_listing',
+         processed.order_by(*newest_first).limit(PAGINATION_DEFAULT_PER_PAGE)),
+        ('root_view, keyset page',
+         processed.filter(
+             (MediaEntry.created < created)
+             | ((MediaEntry.created == created) & (MediaEntry.id < entry_id)))
+         .order_by(*newest_first).limit(PAGINATION_DEFAULT_PER_PAGE)),
+        ('user_home / user_gallery / atom_feed',
+         user_processed.order_by(*newest_first).limit(
+             PAGINATION_DEFAULT_PER_PAGE)),
+        ('processing_panel',
+         MediaEntry.query.filter_by(uploader=uploader, state=u'processing')
+         .order_by(MediaEntry.created.desc())),
+        ('admin_processing_panel',
+         MediaEntry.query.filter_by(state=u'processing')
+         .order_by(MediaEntry.created.desc())),
+        ('url_to_prev',
+         user_processed.filter(MediaEntry.id > entry_id)
+         .order_by(MediaEntry.id).limit(1)),
+        ('url_to_next',
+         user_processed.filter(MediaEntry.id < entry_id)
+         .order_by(desc(MediaEntry.id)).limit(1)),
+        ]
+
+
+# A Sort plan node, nested ones printed like "  ->  Sort  (cost=...)",
+# but not its "Sort Key: ..." detail lines
+_SORT_NODE = re.compile(r'\s*(->\s+)?Sort(\s\s|$)')
+
+
+def plan_problems(dialect_name, plan_lines):
+    """
+    Return the lines of a query plan that point to a full table scan or
+    a sort that no index helps with.
+    """
+    problems = []
+    for line in plan_lines:
+        if dialect_name == 'sqlite':
+            if (line.startswith('SCAN') and 'USING' not in line) \
+                    or 'TEMP B-TREE' in line:
+                problems.append(line)
+        elif 'Seq Scan' in line or _SORT_NODE.match(line):
+            problems.append(line)
+    return problems
+
+
+def explain_queries(db, allow_seqscan=False, printer=simple_printer):
+    """
+    EXPLAIN each canonical query, print its plan and flag table scans.
+
+    Returns the number of queries with problems.
+    """
+    dialect_name = db.engine.dialect.name
+    session = Session()
+    if dialect_name == 'postgresql' and not allow_seqscan:
+        session.execute('SET LOCAL enable_seqscan = off')
+
+    flagged = 0
+    try:
+        for description, query in canonical_queries(db):
+            plan = [unicode(tuple(row)[-1]) for row in
+                    session.execute(Explain(query.statement))]
+            problems = plan_problems(dialect_name, plan)
+
+            printer(u'== {0} {1}\n'.format(
+                description, u'[SCAN]' if problems else u'[ok]'))
+            for line in plan:
+                printer(u'{0} {1}\n'.format(
+                    u'!!' if line in problems else u'  ', line))
+            printer(u'\n')
+
+            if problems:
+                flagged += 1
+    finally:
+        session.rollback()
+
+    return flagged
+
+
+def dbexplain(args):
+    global_config, app_config = setup_global_and_app_config(args.conf_file)
+    db = setup_connection_and_db_from_config(app_config)
+
+    flagged = explain_queries(db, args.allow_seqscan)
+    if flagged:
+        print '{0} queries scan or sort whole tables.  Is the database ' \
+            'up to date (gmg dbupdate)?'.format(flagged)
+    else:
+        print 'All queries use indexes.'
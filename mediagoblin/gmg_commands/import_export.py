@@ -17,7 +17,8 @@
 from mediagoblin import mg_globals
 from mediagoblin.db.open import setup_connection_and_db_from_config
 from mediagoblin.storage.filestorage import BasicFileStorage
-from mediagoblin.init import setup_storage, setup_global_and_app_config
+from mediagoblin.init import setup_storage, setup_global_and_app_config, \
+    setup_workbench
 
 import shutil
 import tarfile
@@ -69,9 +70,9 @@ def _import_media(db, args):
                     entry.title.encode('ascii', 'replace'),
                     name))
 
-            media_file = mg_globals.public_store.get_file(path, mode='wb')
-            media_file.write(
-                media_cache.get_file(path, mode='rb').read())
+            with media_cache.get_file(path, mode='rb') as media_file:
+                mg_globals.public_store.copy_file_to_storage(
+                    media_file, path)
 
     _log.info('...Media imported')
 
@@ -204,17 +205,21 @@ def _export_media(db, args):
     # TODO: Add export of queue files
     queue_cache = BasicFileStorage(args._cache_path['queue'])
 
-    for entry in db.MediaEntry.find():
-        for name, path in entry.media_files.items():
-            _log.info(u'Exporting {0} - {1}'.format(
-                    entry.title,
-                    name))
-            try:
-                mc_file = media_cache.get_file(path, mode='wb')
-                mc_file.write(
-                    mg_globals.public_store.get_file(path, mode='rb').read())
-            except Exception as e:
-                _log.error('Failed: {0}'.format(e))
+    with mg_globals.workbench_manager.create() as workbench:
+        for entry in db.MediaEntry.find():
+            for name, path in entry.media_files.items():
+                _log.info(u'Exporting {0} - {1}'.format(
+                        entry.title,
+                        name))
+                try:
+                    # Remote files may be in the workbench cache already
+                    filename = workbench.localized_file(
+                        mg_globals.public_store, path,
+                        u'{0}-{1}'.format(entry.id, name))
+                    media_cache.move_local_to_storage(
+                        filename, path, keep_local=True)
+                except Exception as e:
+                    _log.error('Failed: {0}'.format(e))
 
     _log.info('...Media exported')
 
@@ -242,6 +247,7 @@ def env_export(args):
     globa_config, app_config = setup_global_and_app_config(args.conf_file)
 
     setup_storage()
+    setup_workbench()
 
     db = setup_connection_and_db_from_config(app_config)
 
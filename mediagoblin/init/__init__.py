@@ -143,7 +143,9 @@ def setup_storage():
 def setup_workbench():
     app_config = mg_globals.app_config
 
-    workbench_manager = WorkbenchManager(app_config['workbench_path'])
+    workbench_manager = WorkbenchManager(
+        app_config['workbench_path'],
+        app_config['workbench_cache_size'] * 1024 * 1024)
 
     setup_globals(workbench_manager=workbench_manager)
 
@@ -15,8 +15,10 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from mediagoblin.db.models import MediaEntry
-from mediagoblin.db.util import media_entries_for_tag_slug
-from mediagoblin.tools.pagination import Pagination
+from mediagoblin.db.util import media_entries_for_tag_slug, \
+    media_entries_for_gallery
+from mediagoblin.tools.feed import cached_feed_response
+from mediagoblin.tools.pagination import get_listing_pagination
 from mediagoblin.tools.response import render_to_response
 from mediagoblin.decorators import uses_pagination
 
@@ -46,8 +48,9 @@ def tag_listing(request, page):
 
     cursor = media_entries_for_tag_slug(request.db, tag_slug)
     cursor = cursor.order_by(MediaEntry.created.desc())
+    cursor = media_entries_for_gallery(cursor)
 
-    pagination = Pagination(page, cursor)
+    pagination = get_listing_pagination(request, page, cursor)
     media_entries = pagination()
 
     tag_name = _get_tag_name_from_entries(media_entries, tag_slug)
@@ -68,11 +71,18 @@ def tag_atom_feed(request):
     """
     generates the atom feed with the tag images
     """
+    return cached_feed_response(
+        request, (u'tag', request.matchdict[u'tag']),
+        lambda: _build_tag_atom_feed(request))
+
+
+def _build_tag_atom_feed(request):
     tag_slug = request.matchdict[u'tag']
 
     cursor = media_entries_for_tag_slug(request.db, tag_slug)
     cursor = cursor.order_by(MediaEntry.created.desc())
     cursor = cursor.limit(ATOM_DEFAULT_NR_OF_UPDATED_ITEMS)
+    cursor = media_entries_for_gallery(cursor)
 
     """
     ATOM feed id is a tag URI (see http://en.wikipedia.org/wiki/Tag_URI)
@@ -86,7 +96,11 @@ def tag_atom_feed(request):
                  qualified=True, tag=tag_slug ),
             'rel': 'alternate',
             'type': 'text/html'}])
+
+    last_modified = None
     for entry in cursor:
+        if last_modified is None:
+            last_modified = entry.created
         feed.add(entry.get('title'),
             entry.description_html,
             id=entry.url_for_self(request.urlgen,qualified=True),
@@ -103,4 +117,4 @@ def tag_atom_feed(request):
                 'rel': 'alternate',
                 'type': 'text/html'}])
 
-    return feed.get_response()
+    return feed, last_modified
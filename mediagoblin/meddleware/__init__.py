@@ -15,6 +15,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 ENABLED_MEDDLEWARE = [
+    'mediagoblin.meddleware.querystats:QueryStatsMeddleware',
     'mediagoblin.meddleware.csrf:CsrfMeddleware',
     ]
 
@@ -0,0 +1,178 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import threading
+import time
+from collections import deque
+
+from sqlalchemy import event
+
+from mediagoblin import mg_globals
+from mediagoblin.meddleware import BaseMeddleware
+
+_log = logging.getLogger(__name__)
+
+
+class QueryStats(object):
+    """The SQL queries run while handling one request"""
+
+    # How many of the slowest statements to remember
+    KEEP_SLOWEST = 3
+
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.slowest = []
+
+    def add(self, statement, duration):
+        self.count += 1
+        self.total_time += duration
+        if (len(self.slowest) < self.KEEP_SLOWEST
+                or duration > self.slowest[-1][0]):
+            self.slowest.append((duration, statement))
+            self.slowest.sort(reverse=True)
+            del self.slowest[self.KEEP_SLOWEST:]
+
+
+class QueryRecorder(object):
+    """
+    Hooks into an engine and keeps a QueryStats per thread.
+
+    The stats are collected from the first query of a request until
+    reset() is called when the database session is reset after it.
+    Statements slower than slow_query_time (in seconds) are logged.
+    """
+    def __init__(self, slow_query_time=None):
+        self.slow_query_time = slow_query_time
+        self._local = threading.local()
+
+    def install(self, engine):
+        event.listen(engine, 'before_cursor_execute', self._before_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_execute)
+
+    def _before_execute(self, conn, cursor, statement, parameters,
+                        context, executemany):
+        self._local.start = time.time()
+
+    def _after_execute(self, conn, cursor, statement, parameters,
+                       context, executemany):
+        duration = time.time() - self._local.start
+        self.current().add(statement, duration)
+
+        if self.slow_query_time and duration >= self.slow_query_time:
+            _log.warning('Slow query (%.1f ms): %s',
+                         duration * 1000, ' '.join(statement.split()))
+
+    def current(self):
+        """Return the QueryStats of the request in this thread"""
+        stats = getattr(self._local, 'stats', None)
+        if stats is None:
+            stats = self._local.stats = QueryStats()
+        return stats
+
+    def reset(self):
+        self._local.stats = None
+
+
+class EndpointStats(object):
+    """Rolling query statistics over the last requests to an endpoint"""
+
+    WINDOW = 100
+
+    def __init__(self):
+        self.requests = 0
+        self.recent = deque(maxlen=self.WINDOW)
+        self.slowest = []
+
+    def add(self, stats):
+        self.requests += 1
+        self.recent.append((stats.count, stats.total_time))
+        self.slowest = sorted(self.slowest + stats.slowest,
+                              reverse=True)[:QueryStats.KEEP_SLOWEST]
+
+    @property
+    def avg_queries(self):
+        return float(sum(c for c, t in self.recent)) / len(self.recent)
+
+    @property
+    def max_queries(self):
+        return max(c for c, t in self.recent)
+
+    @property
+    def avg_time(self):
+        return sum(t for c, t in self.recent) / len(self.recent)
+
+    @property
+    def max_time(self):
+        return max(t for c, t in self.recent)
+
+
+_endpoint_stats = {}
+_endpoint_stats_lock = threading.Lock()
+
+
+def record_endpoint_stats(endpoint, stats):
+    with _endpoint_stats_lock:
+        if endpoint not in _endpoint_stats:
+            _endpoint_stats[endpoint] = EndpointStats()
+        _endpoint_stats[endpoint].add(stats)
+
+
+def get_endpoint_stats():
+    """
+    Return a list of (endpoint, EndpointStats), the most expensive
+    endpoints first.
+    """
+    with _endpoint_stats_lock:
+        items = _endpoint_stats.items()
+    return sorted(items, key=lambda item: item[1].avg_time, reverse=True)
+
+
+def clear_endpoint_stats():
+    with _endpoint_stats_lock:
+        _endpoint_stats.clear()
+
+
+class QueryStatsMeddleware(BaseMeddleware):
+    """Report the SQL queries of each request
+
+    Logs the number of queries and the time spent on them for each
+    request, adds them up per endpoint for the admin query panel and,
+    if query_stats_headers is set, adds them to the response headers.
+    """
+
+    def process_response(self, request, response):
+        recorder = request.db.query_recorder
+        if recorder is None:
+            return
+
+        stats = recorder.current()
+        endpoint = getattr(request, 'endpoint', None)
+        record_endpoint_stats(endpoint, stats)
+
+        _log.info(
+            'endpoint=%s method=%s status=%s queries=%d db_ms=%.1f',
+            endpoint, request.method, response.status_code,
+            stats.count, stats.total_time * 1000)
+
+        if mg_globals.app_config['query_stats_headers']:
+            response.headers['X-Query-Count'] = str(stats.count)
+            response.headers['X-Query-Time'] = \
+                '%.1f' % (stats.total_time * 1000)
+            for i, (duration, statement) in enumerate(stats.slowest):
+                response.headers['X-Slow-Query-%d' % (i + 1)] = '%.1fms %s' % (
+                    duration * 1000, ' '.join(statement.split()))
@@ -20,6 +20,7 @@ import logging
 import tempfile
 
 from mediagoblin import mg_globals
+from mediagoblin.tools.files import COPY_BUFFER_SIZE
 from mediagoblin.tools.translate import lazy_pass_to_ugettext as _
 
 _log = logging.getLogger(__name__)
@@ -41,25 +42,44 @@ def sniff_media(media):
         return get_media_type_and_manager(media.filename)
     except FileTypeNotSupported:
         _log.info('No media handler found by file extension. Doing it the expensive way...')
-        # Create a temporary file for sniffers suchs as GStreamer-based
-        # Audio video
-        media_file = tempfile.NamedTemporaryFile()
-        media_file.write(media.stream.read())
-        media.stream.seek(0)
-
-        for media_type, manager in get_media_managers():
-            _log.info('Sniffing {0}'.format(media_type))
-            if manager['sniff_handler'](media_file, media=media):
-                _log.info('{0} accepts the file'.format(media_type))
-                return media_type, manager
-            else:
-                _log.debug('{0} did not accept the file'.format(media_type))
+        media_file = _sniffable_file(media)
+        try:
+            for media_type, manager in get_media_managers():
+                _log.info('Sniffing {0}'.format(media_type))
+                if manager['sniff_handler'](media_file, media=media):
+                    _log.info('{0} accepts the file'.format(media_type))
+                    return media_type, manager
+                else:
+                    _log.debug('{0} did not accept the file'.format(media_type))
+        finally:
+            media.stream.seek(0)
 
     raise FileTypeNotSupported(
         # TODO: Provide information on which file types are supported
         _(u'Sorry, I don\'t support that file type :('))
 
 
+def _sniffable_file(media):
+    """
+    Get a named file with the contents of the upload media, for
+    sniffers such as GStreamer-based audio and video.
+
+    Big uploads are already spooled to a named temporary file (see
+    mediagoblin.tools.request.Request), which is shared as is.  Others
+    get copied to one, a chunk at a time.
+    """
+    stream = media.stream
+    name = getattr(stream, 'name', None)
+    if isinstance(name, basestring) and os.path.isfile(name):
+        stream.flush()
+        return stream
+
+    media_file = tempfile.NamedTemporaryFile()
+    media.save(media_file, COPY_BUFFER_SIZE)
+    media_file.flush()
+    return media_file
+
+
 def get_media_types():
     """
     Generator, yields the available media types
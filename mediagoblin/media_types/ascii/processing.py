@@ -19,7 +19,7 @@ import Image
 import logging
 
 from mediagoblin import mg_globals as mgg
-from mediagoblin.processing import create_pub_filepath
+from mediagoblin.processing import create_pub_filepaths
 from mediagoblin.media_types.ascii import asciitoimage
 
 _log = logging.getLogger(__name__)
@@ -75,8 +75,9 @@ def process_ascii(proc_state):
 
         queued_file.seek(0)  # Rewind the queued file
 
-        thumb_filepath = create_pub_filepath(
-            entry, 'thumbnail.png')
+        thumb_filepath, original_filepath, unicode_filepath = \
+            create_pub_filepaths(entry, [
+                'thumbnail.png', queued_filepath[-1], 'ascii-portable.txt'])
 
         tmp_thumb_filename = os.path.join(
             conversions_subdir, thumb_filepath[-1])
@@ -106,16 +107,11 @@ def process_ascii(proc_state):
 
         queued_file.seek(0)
 
-        original_filepath = create_pub_filepath(entry, queued_filepath[-1])
-
-        with mgg.public_store.get_file(original_filepath, 'wb') \
-            as original_file:
-            original_file.write(queued_file.read())
+        mgg.public_store.copy_file_to_storage(
+            queued_file, original_filepath)
 
         queued_file.seek(0)  # Rewind *again*
 
-        unicode_filepath = create_pub_filepath(entry, 'ascii-portable.txt')
-
         with mgg.public_store.get_file(unicode_filepath, 'wb') \
                 as unicode_file:
             # Decode the original file from its detected charset (or UTF8)
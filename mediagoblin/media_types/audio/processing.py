@@ -19,22 +19,29 @@ from tempfile import NamedTemporaryFile
 import os
 
 from mediagoblin import mg_globals as mgg
-from mediagoblin.processing import (create_pub_filepath, BadMediaFail,
-    FilenameBuilder, ProgressCallback)
+from mediagoblin.processing import (create_pub_filepaths, BadMediaFail,
+    FilenameBuilder, ProgressCallback, ProcessingGraph)
 
 from mediagoblin.media_types.audio.transcoders import (AudioTranscoder,
     AudioThumbnailer)
+from mediagoblin.media_types.media_engine import (media_engine,
+    MediaEngineTimeout)
 
 _log = logging.getLogger(__name__)
 
 
 def sniff_handler(media_file, **kw):
     try:
-        transcoder = AudioTranscoder()
-        data = transcoder.discover(media_file.name)
+        data = media_engine().run(
+            AudioTranscoder().discover, media_file.name,
+            timeout=mgg.app_config['sniff_timeout'])
     except BadMediaFail:
         _log.debug('Audio discovery raised BadMediaFail')
         return False
+    except MediaEngineTimeout:
+        _log.error('Audio discovery of {0} timed out'.format(
+                kw.get('media')))
+        return False
 
     if data.is_audio == True and data.is_video == False:
         return True
@@ -58,92 +65,123 @@ def process_audio(proc_state):
         'source')
     name_builder = FilenameBuilder(queued_filename)
 
-    webm_audio_filepath = create_pub_filepath(
-        entry,
-        '{original}.webm'.format(
-            original=os.path.splitext(
-                queued_filepath[-1])[0]))
+    original_basename = os.path.splitext(queued_filepath[-1])[0]
+    (webm_audio_filepath, original_filepath, spectrogram_filepath,
+     thumb_filepath) = create_pub_filepaths(entry, [
+        '{original}.webm'.format(original=original_basename),
+        name_builder.fill('{basename}{ext}'),
+        '{original}-spectrogram.jpg'.format(original=original_basename),
+        '{original}-thumbnail.jpg'.format(original=original_basename)])
+
+    # The webm transcode and the original only read the source, so they
+    # can run side by side
+    graph = ProcessingGraph(proc_state)
 
     if audio_config['keep_original']:
-        with open(queued_filename, 'rb') as queued_file:
-            original_filepath = create_pub_filepath(
-                entry, name_builder.fill('{basename}{ext}'))
+        def save_original(workdir):
+            _log.debug('Saving original...')
+            mgg.public_store.copy_local_to_storage(
+                queued_filename, original_filepath)
 
-            with mgg.public_store.get_file(original_filepath, 'wb') as \
-                    original_file:
-                _log.debug('Saving original...')
-                original_file.write(queued_file.read())
+        graph.add_step('original', save_original)
 
-            entry.media_files['original'] = original_filepath
+    spectrogram_width = mgg.global_config['media:medium']['max_width']
 
-    transcoder = AudioTranscoder()
+    def transcode_webm(workdir):
+        transcoder = AudioTranscoder()
+        data = transcoder.discover(queued_filename)
 
-    with NamedTemporaryFile(dir=workbench.dir) as webm_audio_tmp:
-        progress_callback = ProgressCallback(entry)
+        # The spectrogram is made of the audio decoded for the webm
+        spectrogram = None
+        if audio_config['create_spectrogram']:
+            spectrogram = AudioThumbnailer().spectrogram_accumulator(
+                data,
+                width=spectrogram_width,
+                fft_size=audio_config['spectrogram_fft_size'])
 
-        transcoder.transcode(
-            queued_filename,
-            webm_audio_tmp.name,
-            quality=audio_config['quality'],
-            progress_callback=progress_callback)
+        with NamedTemporaryFile(dir=workdir) as webm_audio_tmp:
+            progress_callback = ProgressCallback(entry)
 
-        transcoder.discover(webm_audio_tmp.name)
+            transcoder.transcode(
+                queued_filename,
+                webm_audio_tmp.name,
+                data=data,
+                quality=audio_config['quality'],
+                progress_callback=progress_callback,
+                pcm_callback=spectrogram.feed if spectrogram else None)
 
-        _log.debug('Saving medium...')
-        mgg.public_store.get_file(webm_audio_filepath, 'wb').write(
-            webm_audio_tmp.read())
+            transcoder.discover(webm_audio_tmp.name)
 
-        entry.media_files['webm_audio'] = webm_audio_filepath
+            _log.debug('Saving medium...')
+            mgg.public_store.copy_local_to_storage(
+                webm_audio_tmp.name, webm_audio_filepath)
 
-        # entry.media_data_init(length=int(data.audiolength))
+            # entry.media_data_init(length=int(data.audiolength))
+
+        return spectrogram
+
+    graph.add_step('webm_audio', transcode_webm)
 
     if audio_config['create_spectrogram']:
-        spectrogram_filepath = create_pub_filepath(
-            entry,
-            '{original}-spectrogram.jpg'.format(
-                original=os.path.splitext(
-                    queued_filepath[-1])[0]))
-
-        with NamedTemporaryFile(dir=workbench.dir, suffix='.ogg') as wav_tmp:
-            _log.info('Creating OGG source for spectrogram')
-            transcoder.transcode(
-                queued_filename,
-                wav_tmp.name,
-                mux_string='vorbisenc quality={0} ! oggmux'.format(
-                    audio_config['quality']))
+        def spectrogram_from_file(workdir, dst):
+            transcoder = AudioTranscoder()
 
-            thumbnailer = AudioThumbnailer()
+            with NamedTemporaryFile(dir=workdir, suffix='.ogg') as wav_tmp:
+                _log.info('Creating OGG source for spectrogram')
+                transcoder.transcode(
+                    queued_filename,
+                    wav_tmp.name,
+                    mux_string='vorbisenc quality={0} ! oggmux'.format(
+                        audio_config['quality']))
 
-            with NamedTemporaryFile(dir=workbench.dir, suffix='.jpg') as spectrogram_tmp:
-                thumbnailer.spectrogram(
+                AudioThumbnailer().spectrogram(
                     wav_tmp.name,
-                    spectrogram_tmp.name,
-                    width=mgg.global_config['media:medium']['max_width'],
+                    dst,
+                    width=spectrogram_width,
                     fft_size=audio_config['spectrogram_fft_size'])
 
-                _log.debug('Saving spectrogram...')
-                mgg.public_store.get_file(spectrogram_filepath, 'wb').write(
-                    spectrogram_tmp.read())
+        def create_spectrogram(workdir, spectrogram):
+            thumbnailer = AudioThumbnailer()
 
-                entry.media_files['spectrogram'] = spectrogram_filepath
+            with NamedTemporaryFile(dir=workdir, suffix='.jpg') as \
+                    spectrogram_tmp:
+                if spectrogram is not None:
+                    thumbnailer.save_spectrogram(
+                        spectrogram, spectrogram_tmp.name)
+                else:
+                    # Without knowing how long the audio is, it can't be
+                    # done while decoding it for the webm
+                    spectrogram_from_file(
+                        workdir, spectrogram_tmp.name)
+
+                _log.debug('Saving spectrogram...')
+                mgg.public_store.copy_local_to_storage(
+                    spectrogram_tmp.name, spectrogram_filepath)
 
-                with NamedTemporaryFile(dir=workbench.dir, suffix='.jpg') as thumb_tmp:
+                with NamedTemporaryFile(dir=workdir, suffix='.jpg') as \
+                        thumb_tmp:
                     thumbnailer.thumbnail_spectrogram(
                         spectrogram_tmp.name,
                         thumb_tmp.name,
                         (mgg.global_config['media:thumb']['max_width'],
                          mgg.global_config['media:thumb']['max_height']))
 
-                    thumb_filepath = create_pub_filepath(
-                        entry,
-                        '{original}-thumbnail.jpg'.format(
-                            original=os.path.splitext(
-                                queued_filepath[-1])[0]))
+                    mgg.public_store.copy_local_to_storage(
+                        thumb_tmp.name, thumb_filepath)
 
-                    mgg.public_store.get_file(thumb_filepath, 'wb').write(
-                        thumb_tmp.read())
+        graph.add_step('spectrogram', create_spectrogram,
+                       requires=('webm_audio',))
 
-                    entry.media_files['thumb'] = thumb_filepath
+    graph.run()
+
+    if audio_config['keep_original']:
+        entry.media_files['original'] = original_filepath
+
+    entry.media_files['webm_audio'] = webm_audio_filepath
+
+    if audio_config['create_spectrogram']:
+        entry.media_files['spectrogram'] = spectrogram_filepath
+        entry.media_files['thumb'] = thumb_filepath
     else:
         entry.media_files['thumb'] = ['fake', 'thumb', 'path.jpg']
 
@@ -22,6 +22,7 @@
 from PIL import Image
 import math
 import numpy
+from numpy.lib.stride_tricks import as_strided
 
 try:
     import scikits.audiolab as audiolab
@@ -29,6 +30,10 @@ except ImportError:
     print "WARNING: audiolab is not installed so wav2png will not work"
 
 
+# Samples read from the audio file at a time
+BLOCK_SIZE = 2 ** 18
+
+
 class AudioProcessingException(Exception):
     pass
 
@@ -48,53 +53,53 @@ class SpectrogramImage(object):
             (255, 255, 255, 255)
          ]
 
-        self.palette = interpolate_colors(colors)
-
-        # Generate lookup table for y-coordinate from fft-bin
-        self.y_to_bin = []
+        # Some colors come out of interpolate_colors a bit over 255
+        self.palette = numpy.array(
+            interpolate_colors(colors)).clip(0, 255).astype(numpy.uint8)
 
+        # Generate lookup arrays for y-coordinate from fft-bin: row y
+        # blends bins y_bins[y] and y_bins[y] + 1 by y_alphas[y] / 255
         fft_min = 100.0
         fft_max = 22050.0  # kHz?
 
         y_min = math.log10(fft_min)
         y_max = math.log10(fft_max)
 
-        for y in range(self.image_height):
-            freq = math.pow(
-                    10.0,
-                    y_min + y / (self.image_height - 1.0)
-                    * (y_max - y_min))
-
-            fft_bin = freq / fft_max * (self.fft_size / 2 + 1)
-
-            if fft_bin < self.fft_size / 2:
-                alpha = fft_bin - int(fft_bin)
-
-                self.y_to_bin.append((int(fft_bin), alpha * 255))
-
-        # this is a bit strange, but using image.load()[x,y] = ... is
-        # a lot slower than using image.putadata and then rotating the image
-        # so we store all the pixels in an array and then create the image when saving
-        self.pixels = []
+        freqs = numpy.power(
+                10.0,
+                y_min + numpy.arange(self.image_height)
+                / (self.image_height - 1.0) * (y_max - y_min))
+
+        fft_bins = freqs / fft_max * (self.fft_size / 2 + 1)
+        fft_bins = fft_bins[fft_bins < self.fft_size / 2]
+
+        self.y_bins = fft_bins.astype(int)
+        self.y_alphas = (fft_bins - self.y_bins) * 255
+
+        # Rows from the bottom up, so row y of the spectrum is row y of
+        # this.  If the FFT is too small to fill up the image, the top
+        # stays black.
+        self.pixels = numpy.empty(
+            (self.image_height, self.image_width, 3), numpy.uint8)
+        self.pixels[:] = self.palette[0]
+        self.rows = self.pixels[::-1][:len(self.y_bins)]
+
+    def draw_spectra(self, x, spectra):
+        """
+        Draw the spectra (one per row) in the columns from x on, all at
+        once.
+        """
+        levels = ((255.0 - self.y_alphas) * spectra[:, self.y_bins]
+                  + self.y_alphas * spectra[:, self.y_bins + 1])
+        self.rows[:, x:x + len(spectra)] = \
+            self.palette[levels.astype(int).T]
 
     def draw_spectrum(self, x, spectrum):
-        # for all frequencies, draw the pixels
-        for index, alpha in self.y_to_bin:
-            self.pixels.append(
-                    self.palette[int((255.0 - alpha) * spectrum[index]
-                        + alpha * spectrum[index + 1])])
-
-        # if the FFT is too small to fill up the image, fill with black to the top
-        for y in range(len(self.y_to_bin), self.image_height):
-            self.pixels.append(self.palette[0])
+        self.draw_spectra(x, spectrum[numpy.newaxis])
 
     def save(self, filename, quality=90):
-        self.image = Image.new(
-                'RGBA',
-                (self.image_height, self.image_width))
-
-        self.image.putdata(self.pixels)
-        self.image.transpose(Image.ROTATE_90).save(
+        self.image = Image.fromarray(self.pixels, 'RGB')
+        self.image.save(
                 filename,
                 quality=quality)
 
@@ -173,6 +178,52 @@ class AudioProcessor(object):
 
         return samples
 
+    def read_block(self, start, size):
+        """ read size samples starting at start, as with resize_if_less,
+        but in one go and with zeros wherever that is out of the file """
+        block = numpy.zeros(size)
+
+        begin = max(start, 0)
+        end = min(start + size, self.audio_file.nframes)
+        if end <= begin:
+            return block
+
+        self.audio_file.seek(begin)
+        try:
+            samples = self.audio_file.read_frames(end - begin)
+        except RuntimeError:
+            # this can happen for wave files with broken headers...
+            return block
+
+        # convert to mono by selecting left channel only
+        if self.audio_file.channels > 1:
+            samples = samples[:,0]
+
+        block[begin - start:begin - start + len(samples)] = samples
+        return block
+
+    def db_spectra(self, seek_points, spec_range=110.0):
+        """ the db spectra, as in spectral_centroid, around all of
+        seek_points (in ascending order), one per row, with all FFTs
+        done at once. """
+        first = seek_points[0]
+        span = seek_points[-1] - first + self.fft_size
+
+        if span > 2 * self.fft_size * len(seek_points):
+            # the frames are far apart, don't read what's between them
+            frames = numpy.array([
+                self.read_block(seek_point - self.fft_size / 2,
+                                self.fft_size)
+                for seek_point in seek_points])
+        else:
+            block = self.read_block(first - self.fft_size / 2, span)
+            frames = frames_at(block, seek_points - first, self.fft_size)
+
+        frames = frames * self.window
+
+        spectra = self.scale * numpy.abs(numpy.fft.rfft(frames, axis=1))
+        return db_spectra(spectra, spec_range)
+
     def spectral_centroid(self, seek_point, spec_range=110.0):
         """ starting at seek_point read fft_size samples, and calculate the spectral centroid """
 
@@ -251,29 +302,152 @@ class AudioProcessor(object):
         return (min_value, max_value) if min_index < max_index else (max_value, min_value)
 
 
+class SpectrogramAccumulator(object):
+    """
+    Builds a spectrogram out of audio that is handed to it block by block,
+    like while it is being decoded for something else, instead of reading
+    a file.
+
+    The columns are placed by nframes, the expected length of the audio.
+    Levels are scaled to the peak of all samples, once all are in.
+
+    Use:
+      accumulator = SpectrogramAccumulator(nframes, (640, 192), 2048)
+      for samples in blocks_of_audio:
+          accumulator.feed(samples)
+      accumulator.save('spectrogram.jpg')
+    """
+    def __init__(self, nframes, image_size, fft_size,
+                 window_function=numpy.hanning):
+        self.image_size = image_size
+        self.fft_size = fft_size
+        self.window = window_function(fft_size)
+
+        samples_per_pixel = nframes / float(image_size[0])
+        self.seek_points = (
+            numpy.arange(image_size[0]) * samples_per_pixel).astype(int)
+        self.spectra = numpy.zeros((image_size[0], fft_size / 2 + 1))
+        # The columns in spectra that are done
+        self.columns = 0
+        self.max_level = 0.0
+
+        # The samples fed so far, of which buffer holds those from offset
+        # on that frames still need.  The first frame starts before the
+        # audio does, in zeros.
+        self.received = 0
+        self.offset = - (fft_size / 2)
+        self.buffer = numpy.zeros(fft_size / 2)
+
+    def feed(self, samples):
+        """
+        Add the next block of samples.  Of several channels (one per
+        column), only the left one is used.
+        """
+        if samples.ndim > 1:
+            samples = samples[:, 0]
+        if not len(samples):
+            return
+
+        self.max_level = max(self.max_level, numpy.abs(samples).max())
+
+        start = self.received
+        self.received += len(samples)
+        if start < self.offset:
+            # No frame needs these
+            samples = samples[self.offset - start:]
+        self.buffer = numpy.concatenate((self.buffer, samples))
+
+        self._compute(numpy.searchsorted(
+            self.seek_points,
+            self.offset + len(self.buffer) - self.fft_size / 2,
+            'right'))
+
+    def _compute(self, stop):
+        """Compute the columns up to stop, all at once"""
+        seek_points = self.seek_points[self.columns:stop]
+        if len(seek_points):
+            frames = frames_at(
+                self.buffer,
+                seek_points - self.fft_size / 2 - self.offset,
+                self.fft_size)
+            self.spectra[self.columns:stop] = numpy.abs(
+                numpy.fft.rfft(frames * self.window, axis=1))
+            self.columns = stop
+
+        # Let go of the samples before the next frame
+        if self.columns < len(self.seek_points):
+            done = (self.seek_points[self.columns] - self.fft_size / 2
+                    - self.offset)
+        else:
+            done = len(self.buffer)
+        if done > 0:
+            self.buffer = self.buffer[done:]
+            self.offset += done
+
+    def save(self, filename, quality=90):
+        # The audio may have ended before the last frames; the rest of
+        # them is silence
+        missing = (self.seek_points[-1] + self.fft_size / 2
+                   - self.offset - len(self.buffer))
+        if missing > 0:
+            self.buffer = numpy.concatenate(
+                (self.buffer, numpy.zeros(missing)))
+        self._compute(len(self.seek_points))
+
+        # figure out what the maximum value is for an FFT doing the FFT of a DC signal
+        max_fft = numpy.abs(
+            numpy.fft.rfft(numpy.ones(self.fft_size) * self.window)).max()
+        scale = 1.0 / self.max_level / max_fft if self.max_level > 0 else 1
+
+        spectrogram = SpectrogramImage(self.image_size, self.fft_size)
+        spectrogram.draw_spectra(0, db_spectra(scale * self.spectra))
+        spectrogram.save(filename, quality)
+
+
+def frames_at(samples, starts, fft_size):
+    """
+    The fft_size samples from each of starts on, one frame per row.
+
+    samples gets a row for every sample in it to start a frame at,
+    without copying, of which those at starts are picked.
+    """
+    frames = as_strided(
+        samples,
+        shape=(len(samples) - fft_size + 1, fft_size),
+        strides=(samples.strides[0], samples.strides[0]))
+    return frames[starts]
+
+
+def db_spectra(spectra, spec_range=110.0):
+    """ scale normalized spectra from [- spec_range db ... 0 db] > [0..1] """
+    return ((20*(numpy.log10(spectra + 1e-60))).clip(-spec_range, 0.0) + spec_range)/spec_range
+
+
 def create_spectrogram_image(source_filename, output_filename,
-        image_size, fft_size, progress_callback=None):
+        image_size, fft_size, progress_callback=None,
+        window_function=numpy.hamming, quality=90):
 
-    processor = AudioProcessor(source_filename, fft_size, numpy.hamming)
+    processor = AudioProcessor(source_filename, fft_size, window_function)
     samples_per_pixel = processor.audio_file.nframes / float(image_size[0])
+    seek_points = (
+        numpy.arange(image_size[0]) * samples_per_pixel).astype(int)
 
     spectrogram = SpectrogramImage(image_size, fft_size)
 
-    for x in range(image_size[0]):
-        if progress_callback and x % (image_size[0] / 10) == 0:
-            progress_callback((x * 100) / image_size[0])
+    # Draw as many columns at once as there are in BLOCK_SIZE samples
+    columns = max(1, int(BLOCK_SIZE / max(samples_per_pixel, 1)))
 
-        seek_point = int(x * samples_per_pixel)
-        next_seek_point = int((x + 1) * samples_per_pixel)
-
-        (spectral_centroid, db_spectrum) = processor.spectral_centroid(seek_point)
+    for x in range(0, image_size[0], columns):
+        if progress_callback:
+            progress_callback((x * 100) / image_size[0])
 
-        spectrogram.draw_spectrum(x, db_spectrum)
+        spectrogram.draw_spectra(
+            x, processor.db_spectra(seek_points[x:x + columns]))
 
     if progress_callback:
         progress_callback(100)
 
-    spectrogram.save(output_filename)
+    spectrogram.save(output_filename, quality)
 
 
 def interpolate_colors(colors, flat=False, num_colors=256):
@@ -324,7 +498,7 @@ def interpolate_colors(colors, flat=False, num_colors=256):
 
 def get_max_level(filename):
     max_value = 0
-    buffer_size = 4096
+    buffer_size = BLOCK_SIZE
     audio_file = audiolab.Sndfile(filename, 'r')
     n_samples_left = audio_file.nframes
 
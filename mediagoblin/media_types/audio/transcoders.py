@@ -19,7 +19,8 @@ import logging
 import Image
 
 from mediagoblin.processing import BadMediaFail
-from mediagoblin.media_types.audio import audioprocessing
+from mediagoblin.media_types.audio import spectrogram
+from mediagoblin.media_types.media_engine import media_engine
 
 
 _log = logging.getLogger(__name__)
@@ -71,30 +72,39 @@ class AudioThumbnailer(object):
         fft_size = kw.get('fft_size', 2048)
         callback = kw.get('progress_callback')
 
-        processor = audioprocessing.AudioProcessor(
+        spectrogram.create_spectrogram_image(
             src,
+            dst,
+            (width, height),
             fft_size,
-            numpy.hanning)
-
-        samples_per_pixel = processor.audio_file.nframes / float(width)
-
-        spectrogram = audioprocessing.SpectrogramImage(width, height, fft_size)
-
-        for x in range(width):
-            if callback and x % (width / 10) == 0:
-                callback((x * 100) / width)
-
-            seek_point = int(x * samples_per_pixel)
-
-            (spectral_centroid, db_spectrum) = processor.spectral_centroid(
-                seek_point)
+            progress_callback=callback,
+            window_function=numpy.hanning,
+            quality=80)
+
+    def spectrogram_accumulator(self, data, **kw):
+        """
+        Return a SpectrogramAccumulator for the audio discovered as data,
+        to be fed with AudioTranscoder.transcode's pcm_callback, or None
+        if the length of the audio is unknown.
+
+        Takes the same keyword arguments as spectrogram().
+        """
+        width = kw['width']
+        height = int(kw.get('height', float(width) * 0.3))
+        fft_size = kw.get('fft_size', 2048)
 
-            spectrogram.draw_spectrum(x, db_spectrum)
+        nframes = data.audiolength * data.audiorate / gst.SECOND
+        if nframes <= 0:
+            return None
 
-        if callback:
-            callback(100)
+        return spectrogram.SpectrogramAccumulator(
+            nframes,
+            (width, height),
+            fft_size,
+            window_function=numpy.hanning)
 
-        spectrogram.save(dst)
+    def save_spectrogram(self, accumulator, dst):
+        accumulator.save(dst, quality=80)
 
     def thumbnail_spectrogram(self, src, dst, thumb_size):
         '''
@@ -130,8 +140,7 @@ class AudioTranscoder(object):
     def __init__(self):
         _log.info('Initializing {0}'.format(self.__class__.__name__))
 
-        # Instantiate MainLoop
-        self._loop = gobject.MainLoop()
+        self._loop = media_engine().loop()
         self._failed = None
 
     def discover(self, src):
@@ -141,6 +150,7 @@ class AudioTranscoder(object):
 
         self._discoverer = gst.extend.discoverer.Discoverer(
             self._discovery_path)
+        self._loop.watch(self._discoverer)
         self._discoverer.connect('discovered', self.__on_discovered)
         self._discoverer.discover()
 
@@ -166,10 +176,19 @@ class AudioTranscoder(object):
         self.halt()
 
     def transcode(self, src, dst, **kw):
+        """
+        Transcode src into dst.
+
+        If pcm_callback is given, it is also called with every block of
+        the decoded audio, as an array of float samples with a column
+        per channel, so other things can be made of it without decoding
+        src again.
+        """
         _log.info('Transcoding {0} into {1}'.format(src, dst))
-        self._discovery_data = kw.get('data', self.discover(src))
+        self._discovery_data = kw.get('data') or self.discover(src)
 
         self.__on_progress = kw.get('progress_callback')
+        self.__on_pcm = kw.get('pcm_callback')
 
         quality = kw.get('quality', 0.3)
 
@@ -177,18 +196,36 @@ class AudioTranscoder(object):
             'mux_string',
             'vorbisenc quality={0} ! webmmux'.format(quality))
 
+        encode_string = (
+            '{mux_string} ! '
+            'progressreport silent=true ! '
+            'filesink location="{dst}"'.format(
+                mux_string=mux_string,
+                dst=dst))
+
+        if self.__on_pcm:
+            # Split the decoded audio between the encoder and us
+            encode_string = (
+                'tee name=decoded ! queue ! {encode_string} '
+                'decoded. ! queue ! audioconvert ! '
+                'audio/x-raw-float,width=64,endianness=1234 ! '
+                'appsink name=pcm emit-signals=true sync=false'.format(
+                    encode_string=encode_string))
+
         # Set up pipeline
         self.pipeline = gst.parse_launch(
             'filesrc location="{src}" ! '
             'decodebin2 ! queue ! audiorate tolerance={tolerance} ! '
             'audioconvert ! audio/x-raw-float,channels=2 ! '
-            '{mux_string} ! '
-            'progressreport silent=true ! '
-            'filesink location="{dst}"'.format(
+            '{encode_string}'.format(
                 src=src,
                 tolerance=80000000,
-                mux_string=mux_string,
-                dst=dst))
+                encode_string=encode_string))
+        self._loop.watch(self.pipeline)
+
+        if self.__on_pcm:
+            self.pipeline.get_by_name('pcm').connect(
+                'new-buffer', self.__on_pcm_buffer)
 
         self.bus = self.pipeline.get_bus()
         self.bus.add_signal_watch()
@@ -198,6 +235,13 @@ class AudioTranscoder(object):
 
         self._loop.run()
 
+    def __on_pcm_buffer(self, appsink):
+        buf = appsink.emit('pull-buffer')
+        # little endian doubles, interleaved
+        samples = numpy.frombuffer(buf.data, '<f8')
+        self.__on_pcm(samples.reshape(
+            -1, buf.caps[0]['channels']))
+
     def __on_bus_message(self, bus, message):
         _log.debug(message)
 
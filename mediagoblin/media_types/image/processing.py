@@ -20,7 +20,7 @@ import logging
 
 from mediagoblin import mg_globals as mgg
 from mediagoblin.processing import BadMediaFail, \
-    create_pub_filepath, FilenameBuilder
+    create_pub_filepaths, FilenameBuilder
 from mediagoblin.tools.exif import exif_fix_image_orientation, \
     extract_exif, clean_exif, get_gps_data, get_useful, \
     exif_image_needs_rotation
@@ -34,45 +34,132 @@ PIL_FILTERS = {
     'ANTIALIAS': Image.ANTIALIAS}
 
 
-def resize_image(entry, filename, new_path, exif_tags, workdir, new_size,
-                 size_limits=(0, 0)):
+def get_resize_filter():
     """
-    Store a resized version of an image and return its pathname.
-
-    Arguments:
-    entry -- the entry for the image to resize
-    filename -- the filename of the original image being resized
-    new_path -- public file path for the new resized image
-    exif_tags -- EXIF data for the original image
-    workdir -- directory path for storing converted image files
-    new_size -- 2-tuple size for the resized image
+    Return the PIL filter configured by the image media type's
+    resize_filter option.
     """
-    try:
-        resized = Image.open(filename)
-    except IOError:
-        raise BadMediaFail()
-    resized = exif_fix_image_orientation(resized, exif_tags)  # Fix orientation
-
     filter_config = \
             mgg.global_config['media_type:mediagoblin.media_types.image']\
                 ['resize_filter']
 
     try:
-        resize_filter = PIL_FILTERS[filter_config.upper()]
+        return PIL_FILTERS[filter_config.upper()]
     except KeyError:
         raise Exception('Filter "{0}" not found, choose one of {1}'.format(
             unicode(filter_config),
             u', '.join(PIL_FILTERS.keys())))
 
-    resized.thumbnail(new_size, resize_filter)
 
+def open_image(filename):
+    """
+    Open the image at filename.  Only the header is read at this point,
+    so the size and format are known but nothing has been decoded yet.
+    """
+    try:
+        return Image.open(filename)
+    except IOError:
+        raise BadMediaFail()
+
+
+def load_image(image, exif_tags, draft_sizes=None):
+    """
+    Decode image and return it with any EXIF orientation already applied.
+
+    This is the only place the original should be decoded; every
+    derivative is then scaled from the returned image.
+
+    If draft_sizes is a list of max sizes and the image is a JPEG, the
+    decoder is asked to scale down by the largest power of two that still
+    leaves the image big enough for all of them (see Image.draft).
+    """
+    if draft_sizes and image.format == 'JPEG':
+        # Use a square box so the draft stays big enough whichever way
+        # the EXIF orientation is going to turn the image.
+        box = max(max(size) for size in draft_sizes)
+        image.draft(image.mode, fit_size(image.size, (box, box)))
+
+    try:
+        image.load()
+    except IOError:
+        raise BadMediaFail()
+
+    return exif_fix_image_orientation(image, exif_tags)  # Fix orientation
+
+
+def fit_size(size, max_size):
+    """
+    Return size scaled down to fit within max_size, keeping the aspect
+    ratio.  This mirrors the arithmetic of PIL's Image.thumbnail.
+    """
+    x, y = size
+    if x > max_size[0]:
+        y = int(max(y * max_size[0] / x, 1))
+        x = int(max_size[0])
+    if y > max_size[1]:
+        x = int(max(x * max_size[1] / y, 1))
+        y = int(max_size[1])
+    return x, y
+
+
+def resize_image(image, new_size, resize_filter):
+    """
+    Return a version of image that fits within new_size.
+
+    The image passed in is never modified; if it already fits it is
+    returned as is.
+    """
+    target_size = fit_size(image.size, new_size)
+    if target_size == image.size:
+        return image
+    return image.resize(target_size, resize_filter)
+
+
+def save_scaled_image(image, new_path, workdir):
+    """
+    Store a scaled image in the public store under new_path.
+
+    Arguments:
+    image -- the PIL image to store
+    new_path -- public file path for the new resized image
+    workdir -- directory path for storing converted image files
+    """
     # Copy the new file to the conversion subdir, then remotely.
     tmp_resized_filename = os.path.join(workdir, new_path[-1])
     with file(tmp_resized_filename, 'w') as resized_file:
-        resized.save(resized_file)
+        image.save(resized_file)
     mgg.public_store.copy_local_to_storage(tmp_resized_filename, new_path)
 
 
+def create_scaled_images(image, workdir, sizes, filepaths):
+    """
+    Create and store every scaled version of image listed in sizes.
+
+    sizes is a list of (keyname, filename format, max size) tuples, and
+    filepaths has the public file path for each keyname.  The
+    versions are made largest first and each one is scaled from the
+    previous result, as long as that result is still big enough, so the
+    full size original is only resampled once.
+
+    Returns a dict of keyname -> public file path.
+    """
+    resize_filter = get_resize_filter()
+    sizes = sorted(sizes, key=lambda s: s[2][0] * s[2][1], reverse=True)
+
+    previous = image
+    for keyname, filename_format, max_size in sizes:
+        target_size = fit_size(image.size, max_size)
+        if previous.size[0] < target_size[0] \
+                or previous.size[1] < target_size[1]:
+            previous = image
+
+        previous = resize_image(previous, max_size, resize_filter)
+
+        save_scaled_image(previous, filepaths[keyname], workdir)
+
+    return filepaths
+
+
 SUPPORTED_FILETYPES = ['png', 'gif', 'jpg', 'jpeg']
 
 
@@ -115,42 +202,52 @@ def process_image(proc_state):
     exif_tags = extract_exif(queued_filename)
     gps_data = get_gps_data(exif_tags)
 
+    image = open_image(queued_filename)
+
     # Always create a small thumbnail
-    thumb_filepath = create_pub_filepath(
-        entry, name_builder.fill('{basename}.thumbnail{ext}'))
-    resize_image(entry, queued_filename, thumb_filepath,
-                exif_tags, conversions_subdir,
-                (mgg.global_config['media:thumb']['max_width'],
-                 mgg.global_config['media:thumb']['max_height']))
+    sizes = [
+        (u'thumb', '{basename}.thumbnail{ext}',
+         (mgg.global_config['media:thumb']['max_width'],
+          mgg.global_config['media:thumb']['max_height']))]
 
     # If the size of the original file exceeds the specified size of a `medium`
     # file, a `.medium.jpg` files is created and later associated with the media
     # entry.
-    medium = Image.open(queued_filename)
-    if medium.size[0] > mgg.global_config['media:medium']['max_width'] \
-        or medium.size[1] > mgg.global_config['media:medium']['max_height'] \
+    if image.size[0] > mgg.global_config['media:medium']['max_width'] \
+        or image.size[1] > mgg.global_config['media:medium']['max_height'] \
         or exif_image_needs_rotation(exif_tags):
-        medium_filepath = create_pub_filepath(
-            entry, name_builder.fill('{basename}.medium{ext}'))
-        resize_image(
-            entry, queued_filename, medium_filepath,
-            exif_tags, conversions_subdir,
-            (mgg.global_config['media:medium']['max_width'],
-             mgg.global_config['media:medium']['max_height']))
+        sizes.append(
+            (u'medium', '{basename}.medium{ext}',
+             (mgg.global_config['media:medium']['max_width'],
+              mgg.global_config['media:medium']['max_height'])))
+
+    # Decode the original only once, every size is made from this
+    if mgg.global_config['media_type:mediagoblin.media_types.image']\
+            ['jpeg_draft_mode']:
+        draft_sizes = [size for keyname, filename_format, size in sizes]
     else:
-        medium_filepath = None
+        draft_sizes = None
+    image = load_image(image, exif_tags, draft_sizes)
+
+    # Pick unique public names for all files at once
+    original_name = name_builder.fill('{basename}{ext}')
+    filenames = [name_builder.fill(filename_format)
+                 for keyname, filename_format, size in sizes]
+    pub_filepaths = create_pub_filepaths(entry, filenames + [original_name])
+    scaled_filepaths = create_scaled_images(
+        image, conversions_subdir, sizes,
+        dict(zip([keyname for keyname, filename_format, size in sizes],
+                 pub_filepaths)))
 
     # Copy our queued local workbench to its final destination
-    proc_state.copy_original(name_builder.fill('{basename}{ext}'))
+    proc_state.copy_original(original_name, target_filepath=pub_filepaths[-1])
 
     # Remove queued media file from storage and database
     proc_state.delete_queue_file()
 
     # Insert media file information into database
     media_files_dict = entry.setdefault('media_files', {})
-    media_files_dict[u'thumb'] = thumb_filepath
-    if medium_filepath:
-        media_files_dict[u'medium'] = medium_filepath
+    media_files_dict.update(scaled_filepaths)
 
     # Insert exif data into database
     exif_all = clean_exif(exif_tags)
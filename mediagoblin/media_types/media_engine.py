@@ -0,0 +1,197 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import threading
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
+import gobject
+import pygst
+pygst.require('0.10')
+import gst
+
+_log = logging.getLogger(__name__)
+
+gobject.threads_init()
+
+# The _Job running on the current thread, if any
+_current = threading.local()
+
+
+class MediaEngineTimeout(Exception):
+    pass
+
+
+class JobLoop(object):
+    """
+    Stands in for the gobject.MainLoop of one GStreamer job.
+
+    run() blocks until quit() is called, while the media engine's main
+    loop dispatches the job's bus messages and other callbacks.  quit()
+    may come first, from a callback that ran before run() was called.
+
+    A job that is cancelled has the pipelines given to watch() stopped,
+    and run() returns at once from then on.
+    """
+    def __init__(self):
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._pipelines = []
+        self.cancelled = False
+
+    def watch(self, pipeline):
+        """Have pipeline stopped if the job is cancelled"""
+        with self._lock:
+            self._pipelines.append(pipeline)
+            cancelled = self.cancelled
+        if cancelled:
+            pipeline.set_state(gst.STATE_NULL)
+
+    def run(self):
+        media_engine()
+        job = getattr(_current, 'job', None)
+        if job is not None:
+            job.add_loop(self)
+
+        self._done.wait()
+        if not self.cancelled:
+            # Ready to be run again, like a gobject.MainLoop
+            self._done.clear()
+
+    def quit(self):
+        self._done.set()
+
+    def is_running(self):
+        return not self._done.is_set()
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            pipelines = list(self._pipelines)
+        for pipeline in pipelines:
+            pipeline.set_state(gst.STATE_NULL)
+        self.quit()
+
+
+class _Job(object):
+    """
+    A function run on a job thread, which may be cancelled along with
+    the JobLoops run on that thread for it
+    """
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.cancelled = False
+        self._loops = []
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        if self.cancelled:
+            return None
+
+        _current.job = self
+        try:
+            return self.func(*self.args, **self.kwargs)
+        finally:
+            _current.job = None
+
+    def add_loop(self, loop):
+        with self._lock:
+            self._loops.append(loop)
+            cancelled = self.cancelled
+        if cancelled:
+            loop.cancel()
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            loops = list(self._loops)
+        for loop in loops:
+            loop.cancel()
+
+
+class MediaEngine(object):
+    """
+    The one GLib main loop of the process, in a thread of its own, and
+    a pool of threads running GStreamer jobs that use it.
+
+    Jobs (discovering, transcoding, thumbnailing) wait on a JobLoop from
+    loop() instead of running a main loop each.  Main loops of their own
+    would all iterate the same default main context, so concurrent jobs
+    took turns owning it.
+
+    Only sniffing, which a web request has to give up on after a
+    timeout, is put on the pool, with submit() or run().  Processing
+    steps are not: they run on the threads of their processing graph
+    and block on their JobLoops there, with no timeout or cancelling.
+
+    Either way, the callbacks of every job (bus messages, and with them
+    ProgressCallback's atomic_update of the entry) run one at a time on
+    the engine's thread, so they must not block for long.
+    """
+    def __init__(self, threads=None):
+        self._loop = gobject.MainLoop()
+        self._thread = threading.Thread(
+            target=self._loop.run, name='MediaEngine')
+        self._thread.daemon = True
+        self._thread.start()
+
+        self._pool = ThreadPool(threads or cpu_count())
+
+    def loop(self):
+        """Return a JobLoop for a job to wait on"""
+        return JobLoop()
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Queue func(*args, **kwargs) to run on a job thread, and return
+        its multiprocessing.pool.AsyncResult
+        """
+        return self._pool.apply_async(_Job(func, args, kwargs))
+
+    def run(self, func, *args, **kwargs):
+        """
+        Run func(*args, **kwargs) on a job thread and return what it
+        returns, raising MediaEngineTimeout if that takes longer than
+        the timeout keyword argument (in seconds), if given.  The job
+        is then cancelled.
+        """
+        timeout = kwargs.pop('timeout', None)
+        job = _Job(func, args, kwargs)
+        result = self._pool.apply_async(job)
+        result.wait(timeout)
+        if not result.ready():
+            # Stop its pipelines, so the thread is free for the next job
+            job.cancel()
+            raise MediaEngineTimeout(
+                '{0} took longer than {1}s'.format(func.__name__, timeout))
+        return result.get()
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def media_engine():
+    """Return the MediaEngine of this process, starting it if need be"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _log.debug('Starting the media engine')
+            _engine = MediaEngine()
+    return _engine
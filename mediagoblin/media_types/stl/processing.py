@@ -21,7 +21,7 @@ import subprocess
 import pkg_resources
 
 from mediagoblin import mg_globals as mgg
-from mediagoblin.processing import create_pub_filepath, \
+from mediagoblin.processing import create_pub_filepaths, \
     FilenameBuilder
 
 from mediagoblin.media_types.stl import model_loader
@@ -105,6 +105,14 @@ def process_stl(proc_state):
     greatest.sort()
     greatest = greatest[-1]
 
+    # Pick unique public names for all files at once
+    public_names = [
+        "{basename}.thumb.jpg", "{basename}.perspective.jpg",
+        "{basename}.top.jpg", "{basename}.front.jpg", "{basename}.side.jpg",
+        "{basename}{ext}"]
+    public_paths = dict(zip(public_names, create_pub_filepaths(
+        entry, [name_builder.fill(name) for name in public_names])))
+
     def snap(name, camera, width=640, height=640, project="ORTHO"):
         filename = name_builder.fill(name)
         workbench_path = workbench.joinpath(filename)
@@ -126,11 +134,8 @@ def process_stl(proc_state):
         assert os.path.exists(workbench_path)
 
         # copy it up!
-        with open(workbench_path, 'rb') as rendered_file:
-            public_path = create_pub_filepath(entry, filename)
-
-            with mgg.public_store.get_file(public_path, "wb") as public_file:
-                public_file.write(rendered_file.read())
+        public_path = public_paths[name]
+        mgg.public_store.copy_local_to_storage(workbench_path, public_path)
 
         return public_path
 
@@ -158,12 +163,9 @@ def process_stl(proc_state):
         [greatest*-2, model.average[1], model.average[2]])
 
     ## Save the public file stuffs
-    model_filepath = create_pub_filepath(
-        entry, name_builder.fill('{basename}{ext}'))
+    model_filepath = public_paths["{basename}{ext}"]
 
-    with mgg.public_store.get_file(model_filepath, 'wb') as model_file:
-        with open(queued_filename, 'rb') as queued_file:
-            model_file.write(queued_file.read())
+    mgg.public_store.copy_local_to_storage(queued_filename, model_filepath)
 
     # Remove queued media file from storage and database
     mgg.queue_store.delete_file(queued_filepath)
@@ -14,15 +14,19 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from tempfile import NamedTemporaryFile
+import os
+import re
 import logging
 
 from mediagoblin import mg_globals as mgg
 from mediagoblin.processing import \
-    create_pub_filepath, FilenameBuilder, BaseProcessingFail, ProgressCallback
+    create_pub_filepaths, FilenameBuilder, BaseProcessingFail, \
+    ProgressCallback, ProcessingGraph
+from mediagoblin.media_types.media_engine import media_engine, \
+    MediaEngineTimeout
 from mediagoblin.tools.translate import lazy_pass_to_ugettext as _
 
-from . import transcoders
+from . import transcoders, segments, storyboard
 
 _log = logging.getLogger(__name__)
 _log.setLevel(logging.DEBUG)
@@ -36,8 +40,13 @@ class VideoTranscodingFail(BaseProcessingFail):
 
 
 def sniff_handler(media_file, **kw):
-    transcoder = transcoders.VideoTranscoder()
-    data = transcoder.discover(media_file.name)
+    try:
+        data = media_engine().run(
+            transcoders.VideoTranscoder().discover, media_file.name,
+            timeout=mgg.app_config['sniff_timeout'])
+    except MediaEngineTimeout:
+        _log.error('Discovery of {0} timed out'.format(kw.get('media')))
+        return False
 
     _log.debug('Discovered: {0}'.format(data))
 
@@ -52,6 +61,67 @@ def sniff_handler(media_file, **kw):
     return False
 
 
+# Rendition names go into media file keys and filenames
+RENDITION_NAME = re.compile(r'^[A-Za-z0-9]+$')
+# Those of the 640p WebM, "webm_640" and "<basename>-640p.webm"
+RESERVED_RENDITION_NAMES = ('640', '640p')
+
+
+def parse_renditions(renditions):
+    """
+    Parse the renditions config option into a list of (name, (max width,
+    max height), bitrate in bit/s)
+    """
+    parsed = []
+    for rendition in renditions:
+        try:
+            name, size, kbps = rendition.split(':')
+            width, height = size.split('x')
+            parsed.append((name, (int(width), int(height)), int(kbps) * 1000))
+        except ValueError:
+            raise ValueError(
+                'Invalid video rendition {0!r}, should be like '
+                '720p:1280x720:2000'.format(rendition))
+
+        if not RENDITION_NAME.match(name):
+            raise ValueError(
+                'Invalid video rendition name {0!r}, should be letters '
+                'and digits only'.format(name))
+        if name in RESERVED_RENDITION_NAMES:
+            raise ValueError(
+                'Video rendition name {0!r} is taken by the 640p '
+                'WebM'.format(name))
+        if name in [other for other, size, bitrate in parsed[:-1]]:
+            raise ValueError(
+                'Video rendition name {0!r} is used twice'.format(name))
+    return parsed
+
+
+def is_web_compatible(data, filename, max_kbps, dimensions=(640, 640)):
+    """
+    Whether the video discovered as data can be served as it is: a WebM
+    with VP8 video and vorbis audio (if any), fitting in dimensions and
+    with no more than max_kbps kbit/s
+    """
+    if not data or not data['is_video'] or not data['videolength'] \
+            or data['mimetype'] != 'video/webm':
+        return False
+
+    if data['videocaps'][0].get_name() != 'video/x-vp8':
+        return False
+    if data['is_audio'] and \
+            data['audiocaps'][0].get_name() != 'audio/x-vorbis':
+        return False
+
+    if data['videowidth'] > dimensions[0] or \
+            data['videoheight'] > dimensions[1]:
+        return False
+
+    # videolength is in nanoseconds
+    kbps = os.path.getsize(filename) * 8 * 1000000 / data['videolength']
+    return kbps <= max_kbps
+
+
 def process_video(proc_state):
     """
     Process a video entry, transcode the queued media files (originals) and
@@ -61,62 +131,154 @@ def process_video(proc_state):
     cleaned up when this function exits.
     """
     entry = proc_state.entry
-    workbench = proc_state.workbench
     video_config = mgg.global_config['media_type:mediagoblin.media_types.video']
 
     queued_filepath = entry.queued_media_file
     queued_filename = proc_state.get_queued_filename()
     name_builder = FilenameBuilder(queued_filename)
 
-    medium_filepath = create_pub_filepath(
-        entry, name_builder.fill('{basename}-640p.webm'))
+    renditions = parse_renditions(video_config['renditions'])
+
+    filepaths = create_pub_filepaths(entry, [
+            name_builder.fill('{basename}-640p.webm'),
+            name_builder.fill('{basename}.thumbnail.jpg'),
+            queued_filepath[-1],
+            name_builder.fill('{basename}.storyboard.jpg'),
+            name_builder.fill('{basename}.storyboard.vtt')] + [
+            name_builder.fill('{basename}-%s.webm' % name)
+            for name, size, bitrate in renditions])
+    medium_filepath, thumbnail_filepath, original_filepath, \
+        sprite_filepath, vtt_filepath = filepaths[:5]
+    rendition_filepaths = filepaths[5:]
+
+    data = None
+    passthrough = False
+    if video_config['passthrough_max_kbps']:
+        data = transcoders.VideoTranscoder().discover(queued_filename)
+        # Renditions smaller than the upload would still need encoding
+        passthrough = is_web_compatible(
+            data, queued_filename, video_config['passthrough_max_kbps']) \
+            and not transcoders.fit_renditions(
+                renditions, data['videowidth'], data['videoheight'])
 
-    thumbnail_filepath = create_pub_filepath(
-        entry, name_builder.fill('{basename}.thumbnail.jpg'))
+    def transcode_webm(workdir):
+        if passthrough:
+            _log.info('Publishing {0} as it is, it is web compatible'.format(
+                    queued_filename))
+            mgg.public_store.copy_local_to_storage(
+                queued_filename, medium_filepath)
+            return data['videowidth'], data['videoheight'], []
 
-    # Create a temporary file for the video destination (cleaned up with workbench)
-    tmp_dst = NamedTemporaryFile(dir=workbench.dir, delete=False)
-    with tmp_dst:
-        # Transcode queued file to a VP8/vorbis file that fits in a 640x640 square
-        progress_callback = ProgressCallback(entry)
-        transcoder = transcoders.VideoTranscoder()
-        transcoder.transcode(queued_filename, tmp_dst.name,
+        # Transcode queued file to a VP8/vorbis file that fits in a 640x640
+        # square, and to the renditions along the way
+        tmp_dst = os.path.join(workdir, 'medium.webm')
+        rendition_tmps = [
+            (name, os.path.join(workdir, 'rendition-{0}.webm'.format(i)),
+             size, bitrate)
+            for i, (name, size, bitrate) in enumerate(renditions)]
+
+        options = dict(
                 vp8_quality=video_config['vp8_quality'],
                 vp8_threads=video_config['vp8_threads'],
                 vorbis_quality=video_config['vorbis_quality'],
-                progress_callback=progress_callback)
+                progress_callback=ProgressCallback(entry),
+                renditions=[(path, size, bitrate)
+                            for name, path, size, bitrate in rendition_tmps],
+                discovered=data)
 
-    # Push transcoded video to public storage
-    _log.debug('Saving medium...')
-    mgg.public_store.copy_local_to_storage(tmp_dst.name, medium_filepath)
-    _log.debug('Saved medium')
+        if video_config['segment_length']:
+            width, height, made_paths = segments.transcode_segmented(
+                queued_filename, tmp_dst, workdir,
+                video_config['segment_length'],
+                video_config['segment_processes'],
+                **options)
+        else:
+            transcoder = transcoders.VideoTranscoder()
+            transcoder.transcode(queued_filename, tmp_dst, **options)
+            width = transcoder.dst_data.videowidth
+            height = transcoder.dst_data.videoheight
+            made_paths = list(transcoder.rendition_dimensions)
 
-    entry.media_files['webm_640'] = medium_filepath
+        # Push transcoded video to public storage
+        _log.debug('Saving medium...')
+        mgg.public_store.copy_local_to_storage(tmp_dst, medium_filepath)
+        _log.debug('Saved medium')
 
-    # Save the width and height of the transcoded video
-    entry.media_data_init(
-        width=transcoder.dst_data.videowidth,
-        height=transcoder.dst_data.videoheight)
+        made_renditions = []
+        for (name, path, size, bitrate), filepath in zip(
+                rendition_tmps, rendition_filepaths):
+            if path in made_paths:
+                _log.debug('Saving {0} rendition...'.format(name))
+                mgg.public_store.copy_local_to_storage(path, filepath)
+                made_renditions.append((name, filepath))
 
-    # Temporary file for the video thumbnail (cleaned up with workbench)
-    tmp_thumb = NamedTemporaryFile(dir=workbench.dir, suffix='.jpg', delete=False)
+        return width, height, made_renditions
 
-    with tmp_thumb:
+    def create_thumbnail(workdir):
         # Create a thumbnail.jpg that fits in a 180x180 square
+        tmp_thumb = os.path.join(workdir, 'thumbnail.jpg')
         transcoders.VideoThumbnailerMarkII(
                 queued_filename,
-                tmp_thumb.name,
+                tmp_thumb,
                 180)
 
-    # Push the thumbnail to public storage
-    _log.debug('Saving thumbnail...')
-    mgg.public_store.copy_local_to_storage(tmp_thumb.name, thumbnail_filepath)
+        # Push the thumbnail to public storage
+        _log.debug('Saving thumbnail...')
+        mgg.public_store.copy_local_to_storage(tmp_thumb, thumbnail_filepath)
+
+    def create_storyboard(workdir):
+        # Create a sprite of frames for seek previews, with a WebVTT index
+        # referring to it by its name, next to it in public storage
+        tmp_sprite = os.path.join(workdir, 'storyboard.jpg')
+        tmp_vtt = os.path.join(workdir, 'storyboard.vtt')
+        try:
+            storyboard.create_storyboard(
+                queued_filename, tmp_sprite, tmp_vtt, sprite_filepath[-1],
+                frames=video_config['storyboard_frames'],
+                columns=video_config['storyboard_columns'])
+        except storyboard.StoryboardError as exc:
+            # The video is fine without it
+            _log.warn('Could not create storyboard: {0}'.format(exc))
+            return False
+        except Exception:
+            _log.exception('Could not create storyboard')
+            return False
+
+        _log.debug('Saving storyboard...')
+        mgg.public_store.copy_local_to_storage(tmp_sprite, sprite_filepath)
+        mgg.public_store.copy_local_to_storage(tmp_vtt, vtt_filepath)
+        return True
+
+    # The transcode, the thumbnail and the storyboard only share the
+    # source, so they can run side by side
+    graph = ProcessingGraph(proc_state)
+    graph.add_step('webm_640', transcode_webm)
+    graph.add_step('thumb', create_thumbnail)
+    if video_config['storyboard_frames']:
+        graph.add_step('storyboard', create_storyboard)
+    results = graph.run()
+
+    entry.media_files['webm_640'] = medium_filepath
     entry.media_files['thumb'] = thumbnail_filepath
+    if results.get('storyboard'):
+        entry.media_files['storyboard'] = sprite_filepath
+        entry.media_files['storyboard_vtt'] = vtt_filepath
+
+    # Save the width and height of the transcoded video
+    width, height, made_renditions = results['webm_640']
+    entry.media_data_init(width=width, height=height)
+
+    for name, filepath in made_renditions:
+        entry.media_files['webm_' + name] = filepath
 
-    if video_config['keep_original']:
+    if video_config['keep_original'] and passthrough:
+        # The WebM is the original already
+        entry.media_files['original'] = medium_filepath
+    elif video_config['keep_original']:
         # Push original file to public storage
         _log.debug('Saving original...')
-        proc_state.copy_original(queued_filepath[-1])
+        proc_state.copy_original(
+            queued_filepath[-1], target_filepath=original_filepath)
 
     # Remove queued media file from storage and database
     proc_state.delete_queue_file()
@@ -0,0 +1,576 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Segmented video transcoding
+
+A long video is split at keyframes into time ranges, which are
+transcoded by separate processes at the same time.  The audio is
+encoded once, on its own, and the transcoded segments and the audio are
+then remuxed, without decoding them again, into the final WebM file.
+'''
+
+from __future__ import division
+
+import os
+import re
+import sys
+import json
+import logging
+import subprocess
+import threading
+from multiprocessing.pool import ThreadPool
+
+from mediagoblin.media_types.video.transcoders import \
+    VideoTranscoder, gst, CPU_COUNT
+
+_log = logging.getLogger(__name__)
+
+# decodebin2's GstAutoplugSelectResult
+_AUTOPLUG_TRY = 0
+_AUTOPLUG_EXPOSE = 1
+
+
+# What the child processes report on their stdout
+_PROGRESS_LINE = re.compile(r'^progress (\d+)$')
+_RENDITIONS_LINE = re.compile(r'^renditions (\[[\d, ]*\])$')
+
+
+class SegmentError(Exception):
+    pass
+
+
+class _SegmentProcesses(object):
+    '''
+    The child processes transcoding the segments of one video, so that
+    the first one to fail stops all of them
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._processes = set()
+        # The first failure, once there is one
+        self.error = None
+
+    def start(self, args, **kwargs):
+        with self._lock:
+            if self.error is not None:
+                raise SegmentError('Not transcoding, another segment failed')
+            process = subprocess.Popen(args, **kwargs)
+            self._processes.add(process)
+            return process
+
+    def finished(self, process):
+        with self._lock:
+            self._processes.discard(process)
+
+    def fail(self, error):
+        '''
+        Record error, unless there was one already, and terminate the
+        processes still running
+        '''
+        with self._lock:
+            if self.error is None:
+                self.error = error
+            processes = list(self._processes)
+
+        for process in processes:
+            try:
+                process.terminate()
+            except OSError:
+                # It has exited already
+                pass
+
+
+def _expose_decoders(klass):
+    '''
+    Return an autoplug-select callback making decodebin2 expose the
+    encoded streams its decoders of klass ('Video' or '') would decode
+    '''
+    def autoplug_select(dbin, pad, caps, factory):
+        factory_klass = factory.get_klass()
+        if 'Decoder' in factory_klass and klass in factory_klass:
+            return _AUTOPLUG_EXPOSE
+        return _AUTOPLUG_TRY
+    return autoplug_select
+
+
+def _add_fakesink(pipeline, pad):
+    fakesink = gst.element_factory_make('fakesink')
+    fakesink.set_property('sync', False)
+    fakesink.set_property('async', False)
+    pipeline.add(fakesink)
+    fakesink.sync_state_with_parent()
+    pad.link(fakesink.get_pad('sink'))
+
+
+def _run_to_eos(pipeline, description):
+    '''
+    Play pipeline until it's done, without a main loop
+    '''
+    pipeline.set_state(gst.STATE_PLAYING)
+    message = pipeline.get_bus().timed_pop_filtered(
+        gst.CLOCK_TIME_NONE, gst.MESSAGE_EOS | gst.MESSAGE_ERROR)
+    pipeline.set_state(gst.STATE_NULL)
+
+    if message.type == gst.MESSAGE_ERROR:
+        error, debug = message.parse_error()
+        raise SegmentError('{0} failed: {1}'.format(
+                description, error.message))
+
+
+def find_keyframes(src):
+    '''
+    Return the timestamps of the keyframes in the video of src, in ns
+
+    Only demuxes (and parses) the video, it isn't decoded.
+    '''
+    keyframes = []
+    pipeline = gst.Pipeline('KeyframePipeline')
+
+    filesrc = gst.element_factory_make('filesrc', 'filesrc')
+    filesrc.set_property('location', src)
+    pipeline.add(filesrc)
+
+    decoder = gst.element_factory_make('decodebin2', 'decoder')
+    decoder.connect('autoplug-select', _expose_decoders('Video'))
+    pipeline.add(decoder)
+    filesrc.link(decoder)
+
+    def on_buffer(pad, buf):
+        if buf.timestamp != gst.CLOCK_TIME_NONE and \
+                not buf.flag_is_set(gst.BUFFER_FLAG_DELTA_UNIT):
+            keyframes.append(buf.timestamp)
+        return True
+
+    def on_pad(dbin, pad, islast):
+        is_video = pad.get_caps()[0].get_name().startswith('video/')
+        if is_video and not getattr(on_pad, 'found_video', False):
+            on_pad.found_video = True
+            pad.add_buffer_probe(on_buffer)
+        _add_fakesink(pipeline, pad)
+
+    decoder.connect('new-decoded-pad', on_pad)
+
+    _run_to_eos(pipeline, 'Finding keyframes in {0}'.format(src))
+
+    return sorted(set(keyframes))
+
+
+def split_ranges(keyframes, duration, segment_length):
+    '''
+    Split 0..duration into (start, stop) ranges of at least
+    segment_length, each starting at a keyframe
+
+    The last range has a stop of None, meaning the end, and is at least
+    half a segment_length long.  Without keyframes the ranges are evenly
+    spaced.
+    '''
+    if not keyframes:
+        keyframes = range(0, duration, segment_length)
+
+    starts = [0]
+    for keyframe in keyframes:
+        if keyframe - starts[-1] >= segment_length and \
+                duration - keyframe >= segment_length // 2:
+            starts.append(keyframe)
+
+    return zip(starts, starts[1:] + [None])
+
+
+def encode_audio(src, dst, vorbis_quality):
+    '''
+    Encode the audio of src to a vorbis WebM file at dst
+    '''
+    pipeline = gst.Pipeline('AudioPipeline')
+
+    filesrc = gst.element_factory_make('filesrc', 'filesrc')
+    filesrc.set_property('location', src)
+
+    decoder = gst.element_factory_make('decodebin2', 'decoder')
+    # Don't bother decoding the video
+    decoder.connect('autoplug-select', _expose_decoders('Video'))
+
+    audioqueue = gst.element_factory_make('queue', 'audioqueue')
+
+    audiorate = gst.element_factory_make('audiorate', 'audiorate')
+    audiorate.set_property('tolerance', 80000000)
+
+    audioconvert = gst.element_factory_make('audioconvert', 'audioconvert')
+
+    audiocapsfilter = gst.element_factory_make(
+        'capsfilter', 'audiocapsfilter')
+    audiocapsfilter.set_property(
+        'caps', gst.caps_from_string('audio/x-raw-float'))
+
+    vorbisenc = gst.element_factory_make('vorbisenc', 'vorbisenc')
+    vorbisenc.set_property('quality', vorbis_quality)
+
+    webmmux = gst.element_factory_make('webmmux', 'webmmux')
+
+    filesink = gst.element_factory_make('filesink', 'filesink')
+    filesink.set_property('location', dst)
+
+    elements = [filesrc, decoder, audioqueue, audiorate, audioconvert,
+                audiocapsfilter, vorbisenc, webmmux, filesink]
+    pipeline.add(*elements)
+    filesrc.link(decoder)
+    gst.element_link_many(*elements[2:])
+
+    def on_pad(dbin, pad, islast):
+        is_audio = pad.get_caps()[0].get_name().startswith('audio/x-raw')
+        audio_pad = audioqueue.get_pad('sink')
+        if is_audio and not audio_pad.is_linked():
+            pad.link(audio_pad)
+        else:
+            _add_fakesink(pipeline, pad)
+
+    decoder.connect('new-decoded-pad', on_pad)
+
+    _run_to_eos(pipeline, 'Encoding the audio of {0}'.format(src))
+
+
+def _read_webm(path):
+    '''
+    Yield the buffers of the only stream in the WebM file at path
+    '''
+    pipeline = gst.Pipeline('WebmReader')
+
+    filesrc = gst.element_factory_make('filesrc', 'filesrc')
+    filesrc.set_property('location', path)
+
+    demuxer = gst.element_factory_make('matroskademux', 'demuxer')
+
+    appsink = gst.element_factory_make('appsink', 'appsink')
+    appsink.set_property('sync', False)
+    appsink.set_property('max-buffers', 100)
+
+    pipeline.add(filesrc, demuxer, appsink)
+    filesrc.link(demuxer)
+    demuxer.connect(
+        'pad-added', lambda demuxer, pad: pad.link(appsink.get_pad('sink')))
+
+    pipeline.set_state(gst.STATE_PLAYING)
+    try:
+        while True:
+            # None once the stream has ended
+            buf = appsink.emit('pull-buffer')
+            if buf is None:
+                break
+            yield buf
+
+        message = pipeline.get_bus().pop_filtered(gst.MESSAGE_ERROR)
+        if message is not None:
+            error, debug = message.parse_error()
+            raise SegmentError('Reading {0} failed: {1}'.format(
+                    path, error.message))
+    finally:
+        pipeline.set_state(gst.STATE_NULL)
+
+
+def _restamped(files):
+    '''
+    Yield the buffers of the (path, start) WebM files one after the
+    other, each file's timestamps moved to begin at its start
+    '''
+    for path, start in files:
+        first = None
+        for buf in _read_webm(path):
+            if buf.timestamp != gst.CLOCK_TIME_NONE:
+                if first is None:
+                    first = buf.timestamp
+                buf = buf.make_metadata_writable()
+                buf.timestamp = start + buf.timestamp - first
+            yield buf
+
+
+def concatenate_webm(video_files, audio_path, dst):
+    '''
+    Remux the video of the (path, start) WebM files in video_files and
+    the audio in the WebM file at audio_path (if any) into one WebM file
+    at dst
+    '''
+    pipeline = gst.Pipeline('WebmConcatenator')
+
+    webmmux = gst.element_factory_make('webmmux', 'webmmux')
+
+    filesink = gst.element_factory_make('filesink', 'filesink')
+    filesink.set_property('location', dst)
+
+    pipeline.add(webmmux, filesink)
+    webmmux.link(filesink)
+
+    streams = [('video_%d', _restamped(video_files))]
+    if audio_path is not None:
+        streams.append(('audio_%d', _restamped([(audio_path, 0)])))
+
+    # [next buffer, stream, appsrc] of the streams left to push
+    heads = []
+    for pad_template, stream in streams:
+        buf = next(stream, None)
+        if buf is None:
+            continue
+
+        appsrc = gst.element_factory_make('appsrc')
+        appsrc.set_property('caps', buf.caps)
+        appsrc.set_property('format', gst.FORMAT_TIME)
+        appsrc.set_property('block', True)
+        pipeline.add(appsrc)
+        appsrc.get_pad('src').link(webmmux.get_request_pad(pad_template))
+
+        heads.append([buf, stream, appsrc])
+
+    if not heads:
+        raise SegmentError('Nothing to concatenate into {0}'.format(dst))
+
+    pipeline.set_state(gst.STATE_PLAYING)
+
+    try:
+        # Interleave the streams
+        while heads:
+            head = min(heads, key=lambda head: head[0].timestamp)
+            buf, stream, appsrc = head
+            if appsrc.emit('push-buffer', buf) != gst.FLOW_OK:
+                break
+
+            head[0] = next(stream, None)
+            if head[0] is None:
+                appsrc.emit('end-of-stream')
+                heads.remove(head)
+    finally:
+        for buf, stream, appsrc in heads:
+            appsrc.emit('end-of-stream')
+
+    _run_to_eos(pipeline, 'Concatenating {0}'.format(dst))
+
+
+def _segment_command(spec):
+    '''
+    The command line of a child process transcoding spec, see __main__
+    below
+    '''
+    return [sys.executable, '-m', __name__, json.dumps(spec)]
+
+
+def _transcode_segment(spec, progress_callback, processes):
+    '''
+    Transcode a segment in a child process
+
+    Returns the indices of the renditions it made.  If it fails, the
+    other segments of processes are stopped.
+    '''
+    try:
+        process = processes.start(
+            _segment_command(spec),
+            stdout=subprocess.PIPE,
+            env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)))
+        try:
+            made_renditions = None
+            for line in iter(process.stdout.readline, ''):
+                progress = _PROGRESS_LINE.match(line)
+                renditions = _RENDITIONS_LINE.match(line)
+                if progress:
+                    progress_callback(int(progress.group(1)))
+                elif renditions:
+                    made_renditions = json.loads(renditions.group(1))
+                else:
+                    # Something in the child printed to stdout
+                    _log.debug('Ignoring output of segment {0}: {1!r}'.format(
+                            spec['dst'], line))
+
+            if process.wait() != 0 or made_renditions is None:
+                raise SegmentError('Transcoding {0} failed'.format(
+                        spec['dst']))
+        finally:
+            processes.finished(process)
+    except Exception as exc:
+        processes.fail(exc)
+        raise
+
+    return made_renditions
+
+
+def transcode_segments(specs, progress_callbacks, processes):
+    '''
+    Transcode the segments of specs in child processes, processes of
+    them at the same time, each reporting its progress to its callback
+    in progress_callbacks
+
+    Returns the indices of the renditions each made.  The first segment
+    to fail stops the others, and its error is raised.
+    '''
+    segment_processes = _SegmentProcesses()
+    pool = ThreadPool(processes)
+    try:
+        results = [
+            pool.apply_async(
+                _transcode_segment,
+                (spec, progress_callback, segment_processes))
+            for spec, progress_callback in zip(specs, progress_callbacks)]
+        return [result.get() for result in results]
+    except Exception as exc:
+        # Don't wait for the segments still being transcoded, and tell
+        # of the failure that stopped them rather than of their ends
+        segment_processes.fail(exc)
+        if segment_processes.error is exc:
+            raise
+        raise segment_processes.error
+    finally:
+        pool.close()
+        pool.join()
+
+
+def segment_progress_callbacks(lengths, progress_callback=None):
+    '''
+    Return a progress callback for each segment of lengths, reporting
+    the percentage done of all of them to progress_callback, each
+    segment weighed by its length
+    '''
+    percents = [0] * len(lengths)
+    total_length = sum(lengths)
+    lock = threading.Lock()
+
+    def segment_progress(i):
+        def callback(percent):
+            with lock:
+                percents[i] = percent
+                total = sum(p * l for p, l in zip(percents, lengths))
+                if progress_callback:
+                    progress_callback(int(total / total_length))
+        return callback
+
+    return [segment_progress(i) for i in range(len(lengths))]
+
+
+def transcode_segmented(src, dst, workdir, segment_length, processes=0,
+                        renditions=(), progress_callback=None,
+                        discovered=None, **options):
+    '''
+    Transcode src to dst like VideoTranscoder.transcode, in segments of
+    at least segment_length seconds, up to processes (0 means the number
+    of CPUs) of them at the same time.  Temporary files go in workdir.
+    discovered is what VideoTranscoder.discover() returned for src, if
+    it was called already.
+
+    Returns (width, height, paths of the renditions that were made).
+    '''
+    data = discovered or VideoTranscoder().discover(src)
+    if not data:
+        raise SegmentError('Could not discover {0}'.format(src))
+
+    duration = data['videolength']
+    ranges = []
+    if duration:
+        ranges = split_ranges(
+            find_keyframes(src), duration, segment_length * gst.SECOND)
+
+    if len(ranges) < 2:
+        _log.debug('Not splitting {0}, it is too short'.format(src))
+        transcoder = VideoTranscoder()
+        transcoder.transcode(src, dst, renditions=renditions,
+                             progress_callback=progress_callback,
+                             discovered=data, **options)
+        return (transcoder.dst_data.videowidth,
+                transcoder.dst_data.videoheight,
+                list(transcoder.rendition_dimensions))
+
+    processes = min(processes or CPU_COUNT, len(ranges))
+    # Divide the cores between the segments running at the same time
+    if not options.get('vp8_threads'):
+        options['vp8_threads'] = max(1, CPU_COUNT // processes)
+    vorbis_quality = options.pop('vorbis_quality', 0.3)
+
+    _log.info('Transcoding {0} in {1} segments, {2} at a time'.format(
+            src, len(ranges), processes))
+
+    progress_callbacks = segment_progress_callbacks(
+        [(stop or duration) - start for start, stop in ranges],
+        progress_callback)
+
+    specs = []
+    for i, (start, stop) in enumerate(ranges):
+        specs.append({
+            'src': src,
+            'dst': os.path.join(workdir, 'segment-{0}.webm'.format(i)),
+            'segment': [start, stop],
+            'renditions': [
+                [os.path.join(workdir, 'segment-{0}-{1}.webm'.format(i, j)),
+                 size, bitrate]
+                for j, (path, size, bitrate) in enumerate(renditions)],
+            'options': options})
+
+    audio_path = None
+    audio_pool = ThreadPool(1)
+    try:
+        if data['is_audio']:
+            audio_path = os.path.join(workdir, 'audio.webm')
+            audio_result = audio_pool.apply_async(
+                encode_audio, (src, audio_path, vorbis_quality))
+
+        # Renditions are left out based on the source's size alone, so
+        # every segment made the same ones
+        made_renditions = transcode_segments(
+            specs, progress_callbacks, processes)[0]
+
+        if audio_path is not None:
+            audio_result.get()
+    finally:
+        audio_pool.close()
+        audio_pool.join()
+
+    concatenate_webm(
+        [(spec['dst'], start) for spec, (start, stop) in zip(specs, ranges)],
+        audio_path, dst)
+
+    made_paths = []
+    for j in made_renditions:
+        concatenate_webm(
+            [(spec['renditions'][j][0], start)
+             for spec, (start, stop) in zip(specs, ranges)],
+            audio_path, renditions[j][0])
+        made_paths.append(renditions[j][0])
+
+    dst_data = VideoTranscoder().discover(dst)
+    return dst_data['videowidth'], dst_data['videoheight'], made_paths
+
+
+if __name__ == '__main__':
+    # A child process of _transcode_segment, which reads the progress and
+    # the renditions that were made from its stdout
+    logging.basicConfig()
+    spec = json.loads(sys.argv[1])
+
+    def report_progress(percent):
+        print 'progress {0}'.format(percent)
+        sys.stdout.flush()
+
+    renditions = [(path, tuple(size), bitrate)
+                  for path, size, bitrate in spec['renditions']]
+    options = dict((str(name), value)
+                   for name, value in spec['options'].items())
+
+    transcoder = VideoTranscoder()
+    transcoder.transcode(spec['src'], spec['dst'],
+                         segment=tuple(spec['segment']),
+                         renditions=renditions,
+                         progress_callback=report_progress,
+                         **options)
+
+    if not hasattr(transcoder, 'dst_data'):
+        sys.exit(1)
+
+    print 'renditions {0}'.format(json.dumps(
+            [j for j, (path, size, bitrate) in enumerate(renditions)
+             if path in transcoder.rendition_dimensions]))
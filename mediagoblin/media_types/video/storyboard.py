@@ -0,0 +1,199 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Storyboards for seek previews
+
+A storyboard is a sprite sheet of frames from all through a video, and a
+WebVTT file telling which part of the sprite shows which time range, as
+players like video.js's thumbnail plugins read them.
+'''
+
+import logging
+
+import gobject
+import Image
+
+from mediagoblin.media_types.video.transcoders import gst
+
+_log = logging.getLogger(__name__)
+
+# How long to wait for the pipeline to preroll after each seek
+PREROLL_TIMEOUT = 10 * gst.SECOND
+
+
+class StoryboardError(Exception):
+    pass
+
+
+def _wait_for_preroll(pipeline, src):
+    result, state, pending = pipeline.get_state(PREROLL_TIMEOUT)
+    if result != gst.STATE_CHANGE_SUCCESS:
+        raise StoryboardError('Could not get frames from {0}'.format(src))
+
+
+def _pull_frame(appsink, src):
+    buf = appsink.emit('pull-preroll')
+    # None if the sink went to EOS or was flushed instead
+    if buf is None:
+        raise StoryboardError('Could not get a frame from {0}'.format(src))
+    return buf
+
+
+def format_vtt_time(position):
+    '''
+    Format position (in ns) as a WebVTT timestamp, like 00:01:02.500
+    '''
+    ms = position // gst.MSECOND
+    return '{0:02d}:{1:02d}:{2:02d}.{3:03d}'.format(
+        ms // 3600000, ms // 60000 % 60, ms // 1000 % 60, ms % 1000)
+
+
+def storyboard_cues(timestamps, duration, columns, tile_size):
+    '''
+    Return the (start, stop, (x, y, width, height)) cues of the frames
+    at timestamps (ascending, in ns) in a sprite of tile_size tiles,
+    columns of them in a row.
+
+    Each frame is shown from its timestamp until the next frame's, the
+    first one from the beginning and the last one until duration.
+    '''
+    width, height = tile_size
+    cues = []
+    for i, timestamp in enumerate(timestamps):
+        start = timestamp if i else 0
+        stop = timestamps[i + 1] if i + 1 < len(timestamps) else duration
+        cues.append((start, stop,
+                     (i % columns * width, i // columns * height,
+                      width, height)))
+    return cues
+
+
+def write_vtt(vtt, cues, sprite_url):
+    '''
+    Write the WebVTT index of cues to the file vtt, referring to the
+    sprite as sprite_url
+    '''
+    vtt.write('WEBVTT\n')
+    for start, stop, geometry in cues:
+        vtt.write('\n{0} --> {1}\n{2}#xywh={3}\n'.format(
+                format_vtt_time(start),
+                format_vtt_time(stop),
+                sprite_url,
+                ','.join(str(value) for value in geometry)))
+
+
+def create_storyboard(src, sprite_dst, vtt_dst, sprite_url, frames=100,
+                      columns=10, tile_width=160, quality=80):
+    '''
+    Make a storyboard of src: a JPEG sprite of up to frames frames at
+    sprite_dst, tile_width wide each and columns of them in a row, and
+    a WebVTT index at vtt_dst referring to the sprite as sprite_url.
+
+    The frames are the keyframes nearest to evenly spaced positions, got
+    with one pipeline seeking forward through the video.  Positions
+    whose nearest keyframe is one there is a frame of already are left
+    out, so videos with few keyframes get fewer frames.
+    '''
+    try:
+        return _create_storyboard(src, sprite_dst, vtt_dst, sprite_url,
+                                  frames, columns, tile_width, quality)
+    except (gobject.GError, gst.QueryError, gst.LinkError, IOError) as exc:
+        # The elements missing, the video or the sprite not to be
+        # decoded or saved, and the like
+        raise StoryboardError('Could not make a storyboard of {0}: '
+                              '{1}'.format(src, exc))
+
+
+def _create_storyboard(src, sprite_dst, vtt_dst, sprite_url, frames,
+                       columns, tile_width, quality):
+    pipeline = gst.parse_launch(' ! '.join([
+        'filesrc name=filesrc',
+        'decodebin2',
+        'ffmpegcolorspace',
+        'videoscale',
+        ','.join([
+            'video/x-raw-rgb',
+            'bpp=24',
+            'depth=24',
+            'endianness=4321',
+            'red_mask=0xff0000',
+            'green_mask=0xff00',
+            'blue_mask=0xff',
+            'pixel-aspect-ratio=1/1',
+            'width={0}'.format(tile_width)]),
+        'appsink name=appsink sync=false']))
+    pipeline.get_by_name('filesrc').set_property('location', src)
+    appsink = pipeline.get_by_name('appsink')
+
+    images = []
+    timestamps = []
+
+    try:
+        pipeline.set_state(gst.STATE_PAUSED)
+        _wait_for_preroll(pipeline, src)
+
+        try:
+            duration = pipeline.query_duration(gst.FORMAT_TIME)[0]
+        except gst.QueryError:
+            raise StoryboardError('Could not get the duration of {0}'.format(
+                    src))
+
+        for i in range(frames):
+            position = duration * (2 * i + 1) // (2 * frames)
+            if timestamps and position <= timestamps[-1]:
+                # Within the frame got last already
+                continue
+
+            # Keyframes only, so nothing but them needs decoding
+            pipeline.seek_simple(
+                gst.FORMAT_TIME,
+                gst.SEEK_FLAG_FLUSH | gst.SEEK_FLAG_KEY_UNIT,
+                position)
+            _wait_for_preroll(pipeline, src)
+
+            buf = _pull_frame(appsink, src)
+            timestamp = buf.timestamp
+            if timestamp == gst.CLOCK_TIME_NONE:
+                timestamp = position
+            if timestamps and timestamp <= timestamps[-1]:
+                # Back at the keyframe there is a frame of already
+                continue
+
+            width = buf.caps[0]['width']
+            height = buf.caps[0]['height']
+            # Rows of the frame are padded to 4 bytes
+            images.append(Image.frombuffer(
+                'RGB', (width, height), buf.data,
+                'raw', 'RGB', (width * 3 + 3) // 4 * 4, 1))
+            timestamps.append(timestamp)
+    finally:
+        pipeline.set_state(gst.STATE_NULL)
+
+    width, height = images[0].size
+    cues = storyboard_cues(timestamps, duration, columns, (width, height))
+
+    rows = (len(images) + columns - 1) // columns
+    sprite = Image.new(
+        'RGB', (width * min(len(images), columns), height * rows))
+    for image, (start, stop, (x, y, w, h)) in zip(images, cues):
+        sprite.paste(image, (x, y))
+
+    _log.debug('Saving storyboard of {0} frames'.format(len(images)))
+    sprite.save(sprite_dst, 'JPEG', quality=quality)
+
+    with open(vtt_dst, 'w') as vtt:
+        write_vtt(vtt, cues, sprite_url)
@@ -30,6 +30,8 @@ import Image
 
 from gst.extend import discoverer
 
+from mediagoblin.media_types.media_engine import media_engine
+
 _log = logging.getLogger(__name__)
 
 gobject.threads_init()
@@ -65,7 +67,7 @@ class VideoThumbnailer:
         '''
         Set up playbin pipeline in order to get video properties.
 
-        Initializes and runs the gobject.MainLoop()
+        Initializes and runs the media engine's loop
 
         Abstract
         - Set up a playbin with a fake audio sink and video sink. Load the video
@@ -81,11 +83,12 @@ class VideoThumbnailer:
         self.source_path = source_path
         self.dest_path = dest_path
 
-        self.loop = gobject.MainLoop()
+        self.loop = media_engine().loop()
 
         # Set up the playbin. It will be used to discover certain
         # properties of the input file
         self.playbin = gst.element_factory_make('playbin')
+        self.loop.watch(self.playbin)
 
         self.videosink = gst.element_factory_make('fakesink', 'videosink')
         self.playbin.set_property('video-sink', self.videosink)
@@ -145,6 +148,7 @@ class VideoThumbnailer:
             'ffmpegcolorspace ! videoscale ! '
             'video/x-raw-rgb,depth=24,bpp=24,pixel-aspect-ratio=1/1,width=180 ! '
             'fakesink signal-handoffs=True'.format(self.source_path))
+        self.loop.watch(self.thumbnail_pipeline)
 
         self.thumbnail_bus = self.thumbnail_pipeline.get_bus()
         self.thumbnail_bus.add_signal_watch()
@@ -370,9 +374,10 @@ class VideoThumbnailerMarkII(object):
         self.position_callback = position_callback \
                 or self.wadsworth_position_callback
 
-        self.mainloop = gobject.MainLoop()
+        self.mainloop = media_engine().loop()
 
         self.playbin = gst.element_factory_make('playbin')
+        self.mainloop.watch(self.playbin)
 
         self.videosink = gst.element_factory_make('fakesink', 'videosink')
         self.audiosink = gst.element_factory_make('fakesink', 'audiosink')
@@ -461,6 +466,7 @@ from playbin')
         _log.debug('thumbnail_pipeline: {0}'.format(pipeline))
 
         self.thumbnail_pipeline = gst.parse_launch(pipeline)
+        self.mainloop.watch(self.thumbnail_pipeline)
         self.thumbnail_message_bus = self.thumbnail_pipeline.get_bus()
         self.thumbnail_message_bus.add_signal_watch()
         self.thumbnail_bus_watch_id = self.thumbnail_message_bus.connect(
@@ -622,6 +628,44 @@ pending: {2}'.format(
             return self.get_duration(pipeline, attempt + 1)
 
 
+def fit_renditions(renditions, source_width, source_height):
+    '''
+    Return the (path, (max width, max height), bitrate) renditions scaled
+    down to fit a source_width x source_height source, as (path, (width,
+    height), bitrate), leaving out those bigger than it.
+
+    Portrait videos are fit into the rendition's size turned on its
+    side, so 720p is 720 pixels wide for them.
+    '''
+    fitted = []
+
+    for path, (max_width, max_height), bitrate in renditions:
+        if source_height > source_width:
+            max_width, max_height = max_height, max_width
+
+        scale = min(float(max_width) / source_width,
+                    float(max_height) / source_height)
+        if scale > 1:
+            _log.info('Not making {0}, the source is smaller'.format(path))
+            continue
+
+        # vp8enc wants even dimensions
+        dimensions = (int(source_width * scale) // 2 * 2,
+                      int(source_height * scale) // 2 * 2)
+        fitted.append((path, dimensions, bitrate))
+
+    return fitted
+
+
+class _DiscoveredData(object):
+    '''
+    What VideoTranscoder.discover() returned, as the attributes the
+    discoverer had
+    '''
+    def __init__(self, data):
+        self.__dict__.update(data)
+
+
 class VideoTranscoder:
     '''
     Video transcoder
@@ -637,7 +681,7 @@ class VideoTranscoder:
     def __init__(self):
         _log.info('Initializing VideoTranscoder...')
         self.progress_percentage = None
-        self.loop = gobject.MainLoop()
+        self.loop = media_engine().loop()
 
     def transcode(self, src, dst, **kwargs):
         '''
@@ -667,6 +711,23 @@ class VideoTranscoder:
 
         self._progress_callback = kwargs.get('progress_callback') or None
 
+        # Extra renditions, as (path, (max width, max height), bitrate in
+        # bit/s), encoded from the same decode
+        self.renditions = kwargs.get('renditions', [])
+        # The path -> (width, height) of those that were made
+        self.rendition_dimensions = {}
+
+        # Only the video (no audio) from segment[0] to segment[1] ns, or
+        # to the end if that is None, for segmented transcoding
+        self.segment = kwargs.get('segment')
+        self._segment_started = False
+        self._segment_ended = False
+
+        # What discover() returned for src, if it was called already, so
+        # that src isn't discovered again
+        discovered = kwargs.get('discovered')
+        self.data = _DiscoveredData(discovered) if discovered else None
+
         if not type(self.destination_dimensions) == tuple:
             raise Exception('dimensions must be tuple: (width, height)')
 
@@ -702,13 +763,17 @@ class VideoTranscoder:
         self.__stop_mainloop()
 
     def _setup(self):
-        self._setup_discover()
+        if self.data is None:
+            self._setup_discover()
         self._setup_pipeline()
 
     def _run(self):
-        _log.info('Discovering...')
-        self.discoverer.discover()
-        _log.info('Done')
+        if self.data is None:
+            _log.info('Discovering...')
+            self.discoverer.discover()
+            _log.info('Done')
+        else:
+            self.__discovered(self.data, True)
 
         _log.debug('Initializing MainLoop()')
         self.loop.run()
@@ -716,6 +781,7 @@ class VideoTranscoder:
     def _setup_discover(self, **kw):
         _log.debug('Setting up discoverer')
         self.discoverer = discoverer.Discoverer(self.source_path)
+        self.loop.watch(self.discoverer)
 
         # Connect self.__discovered to the 'discovered' event
         self.discoverer.connect(
@@ -746,6 +812,7 @@ class VideoTranscoder:
         _log.debug('Setting up transcoding pipeline')
         # Create the pipeline bin.
         self.pipeline = gst.Pipeline('VideoTranscoderPipeline')
+        self.loop.watch(self.pipeline)
 
         # Create all GStreamer elements, starting with
         # filesrc & decoder
@@ -834,25 +901,47 @@ class VideoTranscoder:
         # or audio sink
         self.filesrc.link(self.decoder)
 
-        # Link all the video elements in a row to webmmux
-        gst.element_link_many(
+        renditions = fit_renditions(
+            self.renditions, self.data.videowidth, self.data.videoheight)
+        self._with_audio = self.data.is_audio and self.segment is None
+
+        video_elements = [
             self.videoqueue,
             self.videorate,
-            self.ffmpegcolorspace,
+            self.ffmpegcolorspace]
+        audio_elements = [
+            self.audioqueue,
+            self.audiorate,
+            self.audioconvert,
+            self.audiocapsfilter,
+            self.vorbisenc]
+
+        if renditions:
+            # Decode (and encode the audio) once, and tee it to every
+            # rendition
+            self.videotee = self._add_element('tee', 'videotee')
+            video_elements += [
+                self.videotee,
+                self._add_element('queue', 'videotee_queue')]
+            if self._with_audio:
+                self.audiotee = self._add_element('tee', 'audiotee')
+                audio_elements += [
+                    self.audiotee,
+                    self._add_element('queue', 'audiotee_queue')]
+
+        # Link all the video elements in a row to webmmux
+        gst.element_link_many(*video_elements + [
             self.videoscale,
             self.capsfilter,
             self.vp8enc,
-            self.webmmux)
+            self.webmmux])
 
-        if self.data.is_audio:
+        if self._with_audio:
             # Link all the audio elements in a row to webmux
-            gst.element_link_many(
-                self.audioqueue,
-                self.audiorate,
-                self.audioconvert,
-                self.audiocapsfilter,
-                self.vorbisenc,
-                self.webmmux)
+            gst.element_link_many(*audio_elements + [self.webmmux])
+
+        for i, (path, dimensions, bitrate) in enumerate(renditions):
+            self._link_rendition(i, path, dimensions, bitrate)
 
         gst.element_link_many(
             self.webmmux,
@@ -862,6 +951,57 @@ class VideoTranscoder:
         # Setup the message bus and connect _on_message to the pipeline
         self._setup_bus()
 
+    def _add_element(self, factory, name):
+        element = gst.element_factory_make(factory, name)
+        self.pipeline.add(element)
+        return element
+
+    def _link_rendition(self, i, path, dimensions, bitrate):
+        '''
+        Add a scale and encode branch writing the rendition to path,
+        from the video and audio tees
+        '''
+        name = 'rendition{0}_'.format(i)
+
+        queue = self._add_element('queue', name + 'videoqueue')
+
+        videoscale = self._add_element('ffvideoscale', name + 'videoscale')
+
+        capsfilter = self._add_element('capsfilter', name + 'capsfilter')
+        capsfilter.set_property('caps', gst.caps_from_string(','.join([
+                'video/x-raw-yuv',
+                'pixel-aspect-ratio=1/1',
+                'framerate=30/1',
+                'width={0}'.format(dimensions[0]),
+                'height={0}'.format(dimensions[1])])))
+
+        vp8enc = self._add_element('vp8enc', name + 'vp8enc')
+        vp8enc.set_property('bitrate', bitrate)
+        vp8enc.set_property('threads', self.vp8_threads)
+        vp8enc.set_property('max-latency', 25)
+
+        webmmux = self._add_element('webmmux', name + 'webmmux')
+
+        filesink = self._add_element('filesink', name + 'filesink')
+        filesink.set_property('location', path)
+
+        gst.element_link_many(
+            self.videotee,
+            queue,
+            videoscale,
+            capsfilter,
+            vp8enc,
+            webmmux,
+            filesink)
+
+        if self._with_audio:
+            gst.element_link_many(
+                self.audiotee,
+                self._add_element('queue', name + 'audioqueue'),
+                webmmux)
+
+        self.rendition_dimensions[path] = dimensions
+
     def _on_dynamic_pad(self, dbin, pad, islast):
         '''
         Callback called when ``decodebin2`` has a pad that we can connect to
@@ -871,10 +1011,73 @@ class VideoTranscoder:
         if self.ffmpegcolorspace.get_pad_template('sink')\
                 .get_caps().intersect(pad.get_caps()).is_empty():
             # It is NOT a video src pad.
-            pad.link(self.audioqueue.get_pad('sink'))
+            if self.segment is None:
+                pad.link(self.audioqueue.get_pad('sink'))
+            else:
+                self.audiosink = self._add_element('fakesink', 'audiosink')
+                self.audiosink.set_property('sync', False)
+                self.audiosink.set_property('async', False)
+                self.audiosink.sync_state_with_parent()
+                pad.link(self.audiosink.get_pad('sink'))
         else:
             # It IS a video src pad.
             pad.link(self.videoqueue.get_pad('sink'))
+            if self.segment is not None:
+                self.videoqueue.get_pad('sink').add_buffer_probe(
+                    self._on_segment_buffer)
+
+    def _on_segment_buffer(self, pad, buf):
+        '''
+        Buffer probe letting through only the decoded video of the
+        segment, seeking to it first
+        '''
+        start, stop = self.segment
+
+        if not self._segment_started:
+            self._segment_started = True
+            if start > 0:
+                # Seeking from this streaming thread would deadlock
+                gobject.idle_add(self._seek_segment, pad, start)
+
+        timestamp = buf.timestamp
+        if timestamp == gst.CLOCK_TIME_NONE:
+            return True
+
+        # Until the seek is done, there are buffers from before it
+        if timestamp < start or self._segment_ended:
+            return False
+
+        if stop is not None and timestamp >= stop:
+            self._segment_ended = True
+            gobject.idle_add(self._end_segment)
+            return False
+
+        percent = int((timestamp - start) * 100
+                      / ((stop or self.data.videolength) - start))
+        if percent != self.progress_percentage:
+            self.progress_percentage = percent
+            if self._progress_callback:
+                self._progress_callback(percent)
+
+        return True
+
+    def _seek_segment(self, pad, start):
+        _log.debug('Seeking to segment start {0}'.format(start))
+        # Sent upstream from the video queue, straight to the demuxer
+        pad.push_event(gst.event_new_seek(
+                1.0, gst.FORMAT_TIME,
+                gst.SEEK_FLAG_FLUSH | gst.SEEK_FLAG_ACCURATE,
+                gst.SEEK_TYPE_SET, start,
+                gst.SEEK_TYPE_NONE, -1))
+        return False
+
+    def _end_segment(self):
+        _log.debug('Segment done')
+        # All sinks need EOS for the pipeline to be done
+        self.videoqueue.get_pad('sink').send_event(gst.event_new_eos())
+        if hasattr(self, 'audiosink'):
+            self.audiosink.get_pad('sink').send_event(gst.event_new_eos())
+        return False
 
     def _setup_bus(self):
         self.bus = self.pipeline.get_bus()
@@ -911,7 +1114,9 @@ class VideoTranscoder:
             _log.info('Done')
 
         elif message.type == gst.MESSAGE_ELEMENT:
-            if message.structure.get_name() == 'progress':
+            # Segments report progress from _on_segment_buffer
+            if (message.structure.get_name() == 'progress'
+                    and self.segment is None):
                 data = dict(message.structure)
                 # Update progress state if it has changed
                 if self.progress_percentage != data.get('percent'):
@@ -929,6 +1134,7 @@ class VideoTranscoder:
 
     def _discover_dst_and_stop(self):
         self.dst_discoverer = discoverer.Discoverer(self.destination_path)
+        self.loop.watch(self.dst_discoverer)
 
         self.dst_discoverer.connect('discovered', self.__dst_discovered)
 
@@ -951,7 +1157,7 @@ class VideoTranscoder:
 
     def __stop_mainloop(self):
         '''
-        Wrapper for gobject.MainLoop.quit()
+        Wrapper for self.loop.quit()
 
         This wrapper makes us able to see if self.loop.quit has been called
         '''
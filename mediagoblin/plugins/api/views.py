@@ -22,12 +22,14 @@ from werkzeug.datastructures import FileStorage
 from werkzeug.exceptions import BadRequest, Forbidden
 from werkzeug.wrappers import Response
 
+from mediagoblin.db.util import media_entries_for_gallery
 from mediagoblin.decorators import require_active_login
 from mediagoblin.meddleware.csrf import csrf_exempt
 from mediagoblin.media_types import sniff_media
 from mediagoblin.plugins.api.tools import api_auth, get_entry_serializable, \
         json_response
 from mediagoblin.submit.lib import prepare_queue_task, run_process_media
+from mediagoblin.tools.files import COPY_BUFFER_SIZE
 
 _log = logging.getLogger(__name__)
 
@@ -71,7 +73,7 @@ def post_entry(request):
     queue_file = prepare_queue_task(request.app, entry, media_file.filename)
 
     with queue_file:
-        queue_file.write(request.files['file'].stream.read())
+        media_file.save(queue_file, COPY_BUFFER_SIZE)
 
     # Save now so we have this data before kicking off processing
     entry.save()
@@ -118,6 +120,8 @@ def get_entries(request):
     # TODO: Fetch default and upper limit from config
     entries = entries.limit(int(request.GET.get('limit') or 10))
 
+    entries = media_entries_for_gallery(entries)
+
     entries_serializable = []
 
     for entry in entries:
@@ -16,6 +16,12 @@
 
 import logging
 import os
+import sys
+import threading
+import time
+import Queue
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 
 from mediagoblin.db.util import atomic_update
 from mediagoblin import mg_globals as mgg
@@ -25,14 +31,86 @@ from mediagoblin.tools.translate import lazy_pass_to_ugettext as _
 _log = logging.getLogger(__name__)
 
 
+PROGRESS_CACHE_NAME = 'processing_progress'
+
+# Live progress older than this is stale
+PROGRESS_CACHE_EXPIRE = 24 * 60 * 60
+
+
+def _progress_cache():
+    if mgg.cache is None:
+        return None
+    return mgg.cache.get_cache(
+        PROGRESS_CACHE_NAME, expire=PROGRESS_CACHE_EXPIRE)
+
+
 class ProgressCallback(object):
-    def __init__(self, entry):
-        self.entry = entry
+    """
+    Record the progress of processing an entry.
+
+    Every change is put in the beaker cache, which the processing
+    panels read (see get_processing_progress).  The database is only
+    written once progress has moved on by progress_step percent or
+    progress_interval seconds have passed, and then with an UPDATE of
+    transcoding_progress alone.
+    """
+    def __init__(self, entry, step=None, interval=None):
+        self.entry_id = entry.id
+        if step is None:
+            step = mgg.app_config['progress_step']
+        if interval is None:
+            interval = mgg.app_config['progress_interval']
+        self.step = step
+        self.interval = interval
+
+        self.progress = None
+        self.saved_progress = entry.transcoding_progress or 0
+        self.saved_at = time.time()
+        self._lock = threading.Lock()
 
     def __call__(self, progress):
-        if progress:
-            self.entry.transcoding_progress = progress
-            self.entry.save()
+        if not progress:
+            return
+        progress = int(progress)
+
+        with self._lock:
+            if progress == self.progress:
+                return
+            self.progress = progress
+
+            cache = _progress_cache()
+            if cache is not None:
+                cache.put(unicode(self.entry_id), progress)
+
+            now = time.time()
+            if progress == self.saved_progress or (
+                    progress < 100
+                    and abs(progress - self.saved_progress) < self.step
+                    and now - self.saved_at < self.interval):
+                return
+            self.saved_progress = progress
+            self.saved_at = now
+
+        atomic_update(mgg.database.MediaEntry,
+            {'id': self.entry_id},
+            {u'transcoding_progress': progress})
+
+
+def get_processing_progress(entries):
+    """
+    Return a dict of entry id -> progress percentage (or None) of the
+    entries, live from the cache where available.
+    """
+    cache = _progress_cache()
+    progress = {}
+    for entry in entries:
+        progress[entry.id] = entry.transcoding_progress
+        if cache is not None:
+            try:
+                progress[entry.id] = cache.get(unicode(entry.id))
+            except KeyError:
+                pass
+    return progress
 
 
 def create_pub_filepath(entry, filename):
@@ -42,6 +120,17 @@ def create_pub_filepath(entry, filename):
              filename])
 
 
+def create_pub_filepaths(entry, filenames):
+    """
+    Like create_pub_filepath, for all the files processing an entry
+    writes, with one lookup in the public store.
+    """
+    return mgg.public_store.get_unique_filepaths(
+            ['media_entries',
+             unicode(entry.id)],
+            filenames)
+
+
 class FilenameBuilder(object):
     """Easily slice and dice filenames.
 
@@ -96,10 +185,17 @@ class ProcessingState(object):
         self.queued_filename = queued_filename
         return queued_filename
 
-    def copy_original(self, target_name, keyname=u"original"):
-        target_filepath = create_pub_filepath(self.entry, target_name)
-        mgg.public_store.copy_local_to_storage(self.get_queued_filename(),
-            target_filepath)
+    def copy_original(self, target_name, keyname=u"original",
+                      target_filepath=None):
+        if target_filepath is None:
+            target_filepath = create_pub_filepath(self.entry, target_name)
+        # A queued file in local storage is still deleted by
+        # delete_queue_file, but a copy in the workbench can be moved.
+        keep_local = mgg.queue_store.local_storage
+        mgg.public_store.move_local_to_storage(self.get_queued_filename(),
+            target_filepath, keep_local)
+        if not keep_local:
+            self.queued_filename = None
         self.entry.media_files[keyname] = target_filepath
 
     def delete_queue_file(self):
@@ -108,6 +204,100 @@ class ProcessingState(object):
         self.entry.queued_media_file = []
 
 
+class ProcessingGraph(object):
+    """
+    A set of processing steps for one media entry, some of which need the
+    results of others.
+
+    Steps whose required steps are done run at the same time on a bounded
+    pool of threads.  Each step gets a directory of its own in the
+    workbench to write its output to, and whatever it returns is handed
+    to the steps requiring it.
+
+    Steps should leave the database alone (progress callbacks aside);
+    store their results on the entry once run() has returned.
+    """
+    def __init__(self, proc_state, max_threads=None):
+        self.proc_state = proc_state
+        if max_threads is None:
+            max_threads = mgg.app_config['processing_threads']
+        self.max_threads = max_threads or cpu_count()
+        self.steps = []
+
+    def add_step(self, name, func, requires=()):
+        """
+        Add a step called name, run as func(workdir, *results) where
+        results are the results of the steps in requires, in order.
+
+        Required steps have to be added first, so there are no cycles.
+        """
+        known_steps = [step[0] for step in self.steps]
+        if name in known_steps:
+            raise ValueError('Step {0} added twice'.format(name))
+        for required in requires:
+            if required not in known_steps:
+                raise ValueError('Step {0} requires unknown step {1}'.format(
+                    name, required))
+        self.steps.append((name, func, tuple(requires)))
+
+    def run(self):
+        """
+        Run all steps and return a dict of step name -> result.
+
+        If a step raises, no new steps are started and the exception is
+        re-raised here once the running steps are done.
+        """
+        results = {}
+        pending = list(self.steps)
+        running = 0
+        failure = None
+        done = Queue.Queue()
+        pool = ThreadPool(min(self.max_threads, len(pending) or 1))
+
+        try:
+            while pending or running:
+                if failure is None:
+                    for step in list(pending):
+                        name, func, requires = step
+                        if not all(r in results for r in requires):
+                            continue
+                        pending.remove(step)
+                        workdir = self.proc_state.workbench.joinpath(
+                            'step-' + name)
+                        os.mkdir(workdir)
+                        args = [workdir] + [results[r] for r in requires]
+                        pool.apply_async(
+                            self._run_step, (done, name, func, args))
+                        running += 1
+
+                if not running:
+                    break
+
+                name, result, exc_info = done.get()
+                running -= 1
+                if exc_info is not None:
+                    _log.error('Processing step {0} failed'.format(name))
+                    failure = failure or exc_info
+                else:
+                    _log.debug('Processing step {0} done'.format(name))
+                    results[name] = result
+        finally:
+            pool.close()
+            pool.join()
+
+        if failure is not None:
+            raise failure[0], failure[1], failure[2]
+
+        return results
+
+    @staticmethod
+    def _run_step(done, name, func, args):
+        try:
+            done.put((name, func(*args), None))
+        except:
+            done.put((name, None, sys.exc_info()))
+
+
 def mark_entry_failed(entry_id, exc):
     """
     Mark a media entry as having failed in its conversion.
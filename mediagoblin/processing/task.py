@@ -15,50 +15,29 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
-import urllib
-import urllib2
 
 from celery import registry, task
 
 from mediagoblin import mg_globals as mgg
 from mediagoblin.db.models import MediaEntry
 from . import mark_entry_failed, BaseProcessingFail, ProcessingState
-from mediagoblin.tools.processing import json_processing_callback
+from mediagoblin.tools.feed import invalidate_media_entry_feeds
+from mediagoblin.tools.processing import json_processing_callback, \
+    notification_dispatcher
+from mediagoblin.tools.template import invalidate_template_fragment
 
 _log = logging.getLogger(__name__)
 logging.basicConfig()
 _log.setLevel(logging.DEBUG)
 
 
-@task.task(default_retry_delay=2 * 60)
+@task.task()
 def handle_push_urls(feed_url):
     """Subtask, notifying the PuSH servers of new content
 
-    Retry 3 times every 2 minutes if run in separate process before failing."""
-    if not mgg.app_config["push_urls"]:
-        return # Nothing to do
-    _log.debug('Notifying Push servers for feed {0}'.format(feed_url))
-    hubparameters = {
-        'hub.mode': 'publish',
-        'hub.url': feed_url}
-    hubdata = urllib.urlencode(hubparameters)
-    hubheaders = {
-        "Content-type": "application/x-www-form-urlencoded",
-        "Connection": "close"}
-    for huburl in mgg.app_config["push_urls"]:
-        hubrequest = urllib2.Request(huburl, hubdata, hubheaders)
-        try:
-            hubresponse = urllib2.urlopen(hubrequest)
-        except (urllib2.HTTPError, urllib2.URLError) as exc:
-            # We retry by default 3 times before failing
-            _log.info("PuSH url %r gave error %r", huburl, exc)
-            try:
-                return handle_push_urls.retry(exc=exc, throw=False)
-            except Exception as e:
-                # All retries failed, Failure is no tragedy here, probably.
-                _log.warn('Failed to notify PuSH server for feed {0}. '
-                          'Giving up.'.format(feed_url))
-                return False
+    Kept for tasks queued before the notification dispatcher took this
+    over; the dispatcher retries failed pings itself."""
+    notification_dispatcher().publish_feed(feed_url)
 
 ################################
 # Media processing initial steps
@@ -96,9 +75,13 @@ class ProcessMedia(task.Task):
             entry.state = u'processed'
             entry.save()
 
-            # Notify the PuSH servers as async task
-            if mgg.app_config["push_urls"] and feed_url:
-                handle_push_urls.subtask().delay(feed_url)
+            # Reprocessing may have changed the thumbnail
+            invalidate_template_fragment("media_tile", entry.id)
+            invalidate_media_entry_feeds(entry)
+
+            # Notify the PuSH servers in the background
+            if feed_url:
+                notification_dispatcher().publish_feed(feed_url)
 
             json_processing_callback(entry)
         except BaseProcessingFail as exc:
@@ -15,7 +15,9 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
+import urlparse
 
+from mediagoblin import mg_globals
 from mediagoblin.tools.routing import add_route, mount, url_map
 from mediagoblin.tools.pluginapi import PluginManager
 from mediagoblin.admin.routing import admin_routes
@@ -36,6 +38,16 @@ def get_url_map():
     import mediagoblin.webfinger.routing
     import mediagoblin.listings.routing
 
+    if mg_globals.app_config['media_sendfile']:
+        public_store = mg_globals.public_store
+        if public_store.local_storage:
+            add_route('mediagoblin.serve_media',
+                      urlparse.urlsplit(public_store.base_url).path.rstrip('/')
+                      + '/<path:filepath>',
+                      'mediagoblin.views:serve_media')
+        else:
+            _log.warning('media_sendfile needs a local public store')
+
     for route in PluginManager().get_routes():
         add_route(*route)
 
@@ -14,12 +14,14 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
 import shutil
 import uuid
 
 from werkzeug.utils import secure_filename
 
 from mediagoblin.tools import common
+from mediagoblin.tools.files import COPY_BUFFER_SIZE
 
 ########
 # Errors
@@ -117,6 +119,16 @@ class StorageInterface(object):
         # Subclasses should override this method.
         self.__raise_not_implemented()
 
+    def file_version(self, filepath):
+        """
+        Return a string that changes whenever the file at filepath
+        changes, like its ETag, or None if that can't be told.
+
+        Remote storage systems should provide this, so local copies of
+        their files can be cached.
+        """
+        return None
+
     def get_unique_filepath(self, filepath):
         """
         If a filename at filepath already exists, generate a new name.
@@ -138,6 +150,40 @@ class StorageInterface(object):
         else:
             return filepath
 
+    def get_unique_filepaths(self, dirpath, filenames):
+        """
+        Like get_unique_filepath, for several files in one directory,
+        with a single existing_files lookup.  The same name given twice
+        gets two different paths.
+
+        >>> storage_handler.get_unique_filepaths(
+        ...     ['dir1'], ['fname.jpg', 'fname.thumbnail.jpg'])
+        [[u'dir1', u'fname.jpg'], [u'dir1', u'fname.thumbnail.jpg']]
+        """
+        dirpath = clean_listy_filepath(dirpath)
+        filenames = clean_listy_filepath(filenames)
+        existing = set(self.existing_files(dirpath, filenames))
+
+        filepaths = []
+        for filename in filenames:
+            if filename in existing:
+                filename = "%s-%s" % (uuid.uuid4(), filename)
+            # Names handed out are taken for the rest of the batch too
+            existing.add(filename)
+            filepaths.append(dirpath + [filename])
+        return filepaths
+
+    def existing_files(self, dirpath, filenames):
+        """
+        Return the set of those filenames that exist in dirpath.
+
+        This checks every file on its own.  Storage systems that can
+        look at a whole directory at once (like by listing a prefix)
+        should override this.
+        """
+        return set(filename for filename in filenames
+                   if self.file_exists(dirpath + [filename]))
+
     def get_local_path(self, filepath):
         """
         If this is a local_storage implementation, give us a link to
@@ -160,12 +206,11 @@ class StorageInterface(object):
         appropriate.
         """
         if self.local_storage:
-            shutil.copy(
-                self.get_local_path(filepath), dest_path)
+            copy_file(self.get_local_path(filepath), dest_path)
         else:
             with self.get_file(filepath, 'rb') as source_file:
                 with file(dest_path, 'wb') as dest_file:
-                    dest_file.write(source_file.read())
+                    copy_file_object(source_file, dest_file)
 
     def copy_local_to_storage(self, filename, filepath):
         """
@@ -177,13 +222,56 @@ class StorageInterface(object):
         """
         with self.get_file(filepath, 'wb') as dest_file:
             with file(filename, 'rb') as source_file:
-                dest_file.write(source_file.read())
+                copy_file_object(source_file, dest_file)
+
+    def copy_file_to_storage(self, source_file, filepath):
+        """
+        Copy the contents of an open file object, from its current
+        position on, to filepath in the storage system.
+
+        Never holds more than COPY_BUFFER_SIZE of it in memory.
+        """
+        with self.get_file(filepath, 'wb') as dest_file:
+            copy_file_object(source_file, dest_file)
+
+    def move_local_to_storage(self, filename, filepath, keep_local=False):
+        """
+        Move this file from locally to the storage system.
+
+        Unless keep_local is set, filename is gone afterwards.  Storage
+        systems that can publish a local file without copying it (by
+        renaming or linking it) should override this; the stored file
+        may then share its data with filename, so neither of them
+        should be modified in place afterwards.
+        """
+        self.copy_local_to_storage(filename, filepath)
+        if not keep_local:
+            os.remove(filename)
 
 
 ###########
 # Utilities
 ###########
 
+def copy_file_object(source_file, dest_file, buffer_size=COPY_BUFFER_SIZE):
+    """
+    Copy source_file from its current position to dest_file in chunks
+    of buffer_size, so big files never end up in memory as a whole.
+    """
+    shutil.copyfileobj(source_file, dest_file, buffer_size)
+
+
+def copy_file(source_path, dest_path, buffer_size=COPY_BUFFER_SIZE):
+    """
+    Copy the file at source_path to dest_path using copy_file_object,
+    and its permission bits like shutil.copy
+    """
+    with open(source_path, 'rb') as source_file:
+        with open(dest_path, 'wb') as dest_file:
+            copy_file_object(source_file, dest_file, buffer_size)
+    shutil.copymode(source_path, dest_path)
+
+
 def clean_listy_filepath(listy_filepath):
     """
     Take a listy filepath (like ['dir1', 'dir2', 'filename.jpg']) and
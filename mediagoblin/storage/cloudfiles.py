@@ -88,6 +88,16 @@ class CloudFilesStorage(StorageInterface):
         except cloudfiles.errors.NoSuchObject:
             return False
 
+    def file_version(self, filepath):
+        obj = self.container.get_object(self._resolve_filepath(filepath))
+        return u'{0}:{1}'.format(obj.size, obj.last_modified)
+
+    def existing_files(self, dirpath, filenames):
+        prefix = self._resolve_filepath(dirpath) + u'/'
+        names = set(name[len(prefix):] for name in
+                    self.container.list_objects(prefix=prefix, delimiter='/'))
+        return set(filenames).intersection(names)
+
     def get_file(self, filepath, *args, **kwargs):
         """
         - Doesn't care about the "mode" argument.
@@ -130,6 +140,27 @@ class CloudFilesStorage(StorageInterface):
                 self.container_uri,
                 self._resolve_filepath(filepath)])
 
+    def copy_locally(self, filepath, dest_path):
+        """
+        Let python-cloudfiles stream the object to dest_path.
+        """
+        self.container.get_object(
+            self._resolve_filepath(filepath)).save_to_filename(dest_path)
+
+    def copy_local_to_storage(self, filename, filepath):
+        """
+        Let python-cloudfiles stream filename to the object.
+
+        The wrapper's write() would read back what was written so far
+        for every chunk.
+        """
+        with self.get_file(filepath, 'wb') as dest_file:
+            dest_file.storage_object.load_from_filename(filename)
+
+    def copy_file_to_storage(self, source_file, filepath):
+        with self.get_file(filepath, 'wb') as dest_file:
+            dest_file.storage_object.write(source_file)
+
 
 class CloudFilesStorageObjectWrapper():
     """
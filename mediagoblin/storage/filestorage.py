@@ -17,11 +17,22 @@
 from mediagoblin.storage import (
     StorageInterface,
     clean_listy_filepath,
+    copy_file,
     NoWebServing)
 
+import errno
 import os
-import shutil
 import urlparse
+import uuid
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# The Linux ioctl to make a file share (copy on write) the data of
+# another file, on filesystems like btrfs or XFS
+FICLONE = 0x40049409
 
 
 class BasicFileStorage(StorageInterface):
@@ -51,6 +62,13 @@ class BasicFileStorage(StorageInterface):
     def file_exists(self, filepath):
         return os.path.exists(self._resolve_filepath(filepath))
 
+    def existing_files(self, dirpath, filenames):
+        try:
+            listing = os.listdir(self._resolve_filepath(dirpath))
+        except OSError:
+            return set()
+        return set(filenames).intersection(listing)
+
     def get_file(self, filepath, mode='r'):
         # Make directories if necessary
         if len(filepath) > 1:
@@ -88,5 +106,69 @@ class BasicFileStorage(StorageInterface):
             if not os.path.exists(directory):
                 os.makedirs(directory)
 
-        shutil.copy(
-            filename, self.get_local_path(filepath))
+        copy_file(filename, self.get_local_path(filepath))
+
+    def move_local_to_storage(self, filename, filepath, keep_local=False):
+        """
+        Move this file from locally to the storage system.
+
+        On the same filesystem the file is renamed, or hardlinked or
+        reflinked if keep_local is set, so its data is not copied.
+        Otherwise it is copied.
+        """
+        if len(filepath) > 1:
+            directory = self._resolve_filepath(filepath[:-1])
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+        else:
+            directory = self.base_dir
+
+        dest_path = self.get_local_path(filepath)
+        if os.stat(filename).st_dev == os.stat(directory).st_dev:
+            if not keep_local:
+                try:
+                    os.rename(filename, dest_path)
+                    return
+                except OSError:
+                    pass
+
+            for link in (os.link, _reflink):
+                try:
+                    _replace_with(link, filename, dest_path)
+                    return
+                except (OSError, IOError):
+                    pass
+
+        copy_file(filename, dest_path)
+        if not keep_local:
+            os.remove(filename)
+
+
+def _reflink(source_path, dest_path):
+    """Create dest_path as a copy on write clone of source_path"""
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, 'reflinks are not supported')
+
+    with open(source_path, 'rb') as source_file:
+        with open(dest_path, 'wb') as dest_file:
+            try:
+                fcntl.ioctl(dest_file.fileno(), FICLONE, source_file.fileno())
+            except (IOError, OSError):
+                dest_file.close()
+                os.remove(dest_path)
+                raise
+
+
+def _replace_with(link, source_path, dest_path):
+    """
+    Link source_path to a temporary name next to dest_path, then
+    rename it over dest_path, so an existing dest_path is replaced
+    atomically.
+    """
+    tmp_path = '{0}.{1}.tmp'.format(dest_path, uuid.uuid4().hex)
+    link(source_path, tmp_path)
+    try:
+        os.rename(tmp_path, dest_path)
+    except OSError:
+        os.remove(tmp_path)
+        raise
@@ -135,6 +135,14 @@ class MountStorage(StorageInterface):
         backend, filepath = self.resolve_to_backend(filepath)
         return backend.file_exists(filepath)
 
+    def existing_files(self, dirpath, filenames):
+        backend, dirpath = self.resolve_to_backend(dirpath)
+        return backend.existing_files(dirpath, filenames)
+
+    def file_version(self, filepath):
+        backend, filepath = self.resolve_to_backend(filepath)
+        return backend.file_version(filepath)
+
     def get_file(self, filepath, mode='r'):
         backend, filepath = self.resolve_to_backend(filepath)
         return backend.get_file(filepath, mode)
@@ -158,3 +166,15 @@ class MountStorage(StorageInterface):
         """
         backend, filepath = self.resolve_to_backend(filepath)
         backend.copy_locally(filepath, dest_path)
+
+    def copy_local_to_storage(self, filename, filepath):
+        backend, filepath = self.resolve_to_backend(filepath)
+        backend.copy_local_to_storage(filename, filepath)
+
+    def move_local_to_storage(self, filename, filepath, keep_local=False):
+        backend, filepath = self.resolve_to_backend(filepath)
+        backend.move_local_to_storage(filename, filepath, keep_local)
+
+    def copy_file_to_storage(self, source_file, filepath):
+        backend, filepath = self.resolve_to_backend(filepath)
+        backend.copy_file_to_storage(source_file, filepath)
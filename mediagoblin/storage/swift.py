@@ -0,0 +1,538 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Storage in an OpenStack Swift (or compatible) object store, spoken to
+over plain HTTP, without python-cloudfiles.
+
+Configure it like this::
+
+    [storage:publicstore]
+    storage_class = mediagoblin.storage.swift:SwiftStorage
+    swift_auth_url = https://swift.example.org/auth/v1.0
+    swift_user = account:user
+    swift_key = secret
+    swift_container = mediagoblin
+
+Instead of swift_auth_url, swift_user and swift_key, the storage url
+(like https://swift.example.org/v1/AUTH_account) and a token may be
+given as swift_storage_url and swift_auth_token.  Files are served from
+base_url if set, otherwise straight from the (public) container.
+
+Up to swift_pool_size connections are kept open and shared between
+threads.  Files larger than swift_segment_size bytes are uploaded as
+segments, swift_upload_threads of them at a time, and tied together
+by a manifest object.
+'''
+
+import httplib
+import logging
+import mimetypes
+import socket
+import threading
+import urllib
+import urlparse
+import uuid
+from multiprocessing.pool import ThreadPool
+
+from mediagoblin.storage import StorageInterface, Error, clean_listy_filepath
+from mediagoblin.tools.http import ConnectionPool
+
+_log = logging.getLogger(__name__)
+
+SEGMENT_PREFIX = u'.segments'
+
+
+class SwiftError(Error):
+    def __init__(self, method, path, status, reason):
+        Error.__init__(self, u'{0} {1} failed: {2} {3}'.format(
+            method, path, status, reason))
+        self.status = status
+
+
+class SwiftStorage(StorageInterface):
+    '''
+    OpenStack Swift support, with a connection pool and segmented
+    uploads
+    '''
+
+    local_storage = False
+
+    def __init__(self, **kwargs):
+        self.container = kwargs.get('swift_container', 'mediagoblin')
+        self.base_url = kwargs.get('base_url')
+        self.auth_url = kwargs.get('swift_auth_url')
+        self.user = kwargs.get('swift_user')
+        self.key = kwargs.get('swift_key')
+        self.storage_url = kwargs.get('swift_storage_url')
+        self.auth_token = kwargs.get('swift_auth_token')
+        self.pool_size = int(kwargs.get('swift_pool_size', 8))
+        self.segment_size = int(
+            kwargs.get('swift_segment_size', 64 * 1024 * 1024))
+        self.upload_threads = int(kwargs.get('swift_upload_threads', 4))
+        self.timeout = float(kwargs.get('swift_timeout', 60))
+
+        # the Mime Type webm doesn't exists, let's add it
+        mimetypes.add_type("video/webm", "webm")
+
+        self._auth_lock = threading.Lock()
+        self._upload_pool_lock = threading.Lock()
+        self._upload_pool = None
+        # The segment prefixes of the manifests written through this
+        # storage, to drop the old segments when overwriting them
+        self._manifests = {}
+        self._manifests_lock = threading.Lock()
+        self.pool = None
+        if not self.storage_url:
+            self._authenticate()
+        else:
+            self._setup_pool()
+
+        # Make sure the container exists and can be read by everyone,
+        # like files on a web server
+        self._request('PUT', u'', headers={'X-Container-Read': '.r:*'},
+                      expect=(201, 202))
+
+    def _setup_pool(self):
+        self.pool = ConnectionPool(
+            self.storage_url, self.pool_size, self.timeout)
+        self.container_path = '{0}/{1}'.format(
+            urlparse.urlsplit(self.storage_url).path.rstrip('/'),
+            urllib.quote(self.container.encode('utf-8')))
+
+    def _authenticate(self):
+        """Get a storage url and token with TempAuth style v1 auth"""
+        if not self.auth_url:
+            raise Error('swift_auth_url or swift_storage_url must be set')
+
+        auth_pool = ConnectionPool(self.auth_url, 1, self.timeout)
+        with auth_pool.connection() as connection:
+            connection.request(
+                'GET', urlparse.urlsplit(self.auth_url).path,
+                headers={'X-Auth-User': self.user, 'X-Auth-Key': self.key})
+            response = connection.getresponse()
+            response.read()
+
+        if response.status not in (200, 204):
+            raise SwiftError('GET', self.auth_url,
+                             response.status, response.reason)
+
+        storage_url = response.getheader('X-Storage-Url')
+        self.auth_token = response.getheader('X-Auth-Token')
+        if storage_url != self.storage_url:
+            self.storage_url = storage_url
+            self._setup_pool()
+
+    def _object_path(self, name, query=None):
+        path = self.container_path
+        if name:
+            path += '/' + urllib.quote(name.encode('utf-8'))
+        if query:
+            path += '?' + urllib.urlencode(query)
+        return path
+
+    def _headers(self, headers=None):
+        headers = dict(headers or {})
+        if self.auth_token:
+            headers['X-Auth-Token'] = self.auth_token
+        return headers
+
+    def _send(self, connection, method, path, body=None, headers=None):
+        """
+        Send a request and return the response, retrying once on a
+        kept-alive connection the server has closed meanwhile.
+        """
+        for attempt in (1, 2):
+            try:
+                connection.request(method, path, body, self._headers(headers))
+                return connection.getresponse()
+            except (httplib.HTTPException, socket.error):
+                connection.close()
+                if attempt == 2 or hasattr(body, 'read'):
+                    raise
+
+    def _request(self, method, name, body=None, headers=None, query=None,
+                 expect=(200,), reauthenticate=True):
+        """
+        Run a request on the object name (or the container, if name
+        is empty) and return the response, with its body read.
+        """
+        path = self._object_path(name, query)
+        with self.pool.connection() as connection:
+            response = self._send(connection, method, path, body, headers)
+            response.body = response.read()
+
+        if response.status == 401 and self.auth_url and reauthenticate:
+            # The token expired
+            with self._auth_lock:
+                self._authenticate()
+            return self._request(method, name, body, headers, query, expect,
+                                 reauthenticate=False)
+
+        if response.status not in expect:
+            raise SwiftError(method, path, response.status, response.reason)
+        return response
+
+    def _resolve_filepath(self, filepath):
+        return u'/'.join(clean_listy_filepath(filepath))
+
+    def _content_type(self, name):
+        # Detect the mimetype ourselves, since some extensions (webm)
+        # may not be universally accepted as video/webm
+        return mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+    def _put_object(self, name, data, headers=None):
+        headers = dict(headers or {})
+        headers.setdefault('Content-Type', self._content_type(name))
+        self._request('PUT', name, data, headers, expect=(201,))
+
+    def _upload_segments(self, jobs):
+        """Run (function, args) jobs on the upload threads"""
+        if self._upload_pool is None:
+            with self._upload_pool_lock:
+                if self._upload_pool is None:
+                    self._upload_pool = ThreadPool(self.upload_threads)
+        return [self._upload_pool.apply_async(function, args)
+                for function, args in jobs]
+
+    def _replace_manifest(self, name, prefix):
+        """
+        Record that name is now a manifest of prefix (or a plain object
+        if that is None), and return what it was one of before, as far
+        as this storage knows
+        """
+        with self._manifests_lock:
+            old_prefix = self._manifests.pop(name, None)
+            if prefix is not None:
+                self._manifests[name] = prefix
+        return old_prefix
+
+    def _manifest_prefix(self, name):
+        """Return the segment prefix name is a manifest of, or None"""
+        try:
+            response = self._request('HEAD', name, expect=(200, 204))
+        except SwiftError as exc:
+            if exc.status == 404:
+                return None
+            raise
+        manifest = response.getheader('X-Object-Manifest')
+        if not manifest:
+            return None
+        return urllib.unquote(manifest).decode('utf-8').split(u'/', 1)[1]
+
+    def _delete_segments(self, prefix):
+        listing = self._request(
+            'GET', u'', query={'prefix': prefix.encode('utf-8')},
+            expect=(200, 204)).body
+        for segment in listing.splitlines():
+            try:
+                self._request('DELETE', segment.decode('utf-8'),
+                              expect=(204,))
+            except SwiftError as exc:
+                if exc.status != 404:
+                    raise
+
+    def file_exists(self, filepath):
+        try:
+            self._request('HEAD', self._resolve_filepath(filepath),
+                          expect=(200, 204))
+        except SwiftError as exc:
+            if exc.status == 404:
+                return False
+            raise
+        return True
+
+    def file_version(self, filepath):
+        response = self._request(
+            'HEAD', self._resolve_filepath(filepath), expect=(200, 204))
+        return u'{0}:{1}'.format(
+            response.getheader('Content-Length'),
+            response.getheader('ETag') or
+            response.getheader('Last-Modified'))
+
+    def existing_files(self, dirpath, filenames):
+        prefix = self._resolve_filepath(dirpath) + u'/'
+        listing = self._request(
+            'GET', u'',
+            query={'prefix': prefix.encode('utf-8'), 'delimiter': '/'},
+            expect=(200, 204)).body
+        names = set(name.decode('utf-8')[len(prefix):]
+                    for name in listing.splitlines())
+        return set(filenames).intersection(names)
+
+    def get_file(self, filepath, mode='r'):
+        """
+        Return a file for reading, with range requests when seeking,
+        or for writing the whole object.  Appending is not supported.
+        """
+        name = self._resolve_filepath(filepath)
+        if 'w' in mode:
+            return SwiftObjectWriter(self, name)
+        elif 'a' in mode or '+' in mode:
+            raise Error('Unsupported file mode {0}'.format(mode))
+        return SwiftObjectReader(self, name)
+
+    def delete_file(self, filepath):
+        # TODO: Also delete unused directories if empty (safely, with
+        # checks to avoid race conditions).
+        name = self._resolve_filepath(filepath)
+        prefix = self._manifest_prefix(name)
+        self._request('DELETE', name, expect=(204,))
+        self._replace_manifest(name, None)
+        if prefix:
+            self._delete_segments(prefix)
+
+    def file_url(self, filepath):
+        if self.base_url:
+            return urlparse.urljoin(
+                self.base_url,
+                '/'.join(clean_listy_filepath(filepath)))
+        return '{0}/{1}'.format(
+            self.storage_url.rstrip('/') + '/' +
+            urllib.quote(self.container.encode('utf-8')),
+            urllib.quote(self._resolve_filepath(filepath).encode('utf-8')))
+
+    def close(self):
+        """Stop the upload threads and close the idle connections"""
+        with self._upload_pool_lock:
+            if self._upload_pool is not None:
+                self._upload_pool.close()
+                self._upload_pool.join()
+                self._upload_pool = None
+        if self.pool is not None:
+            self.pool.close()
+
+
+class SwiftObjectWriter(object):
+    """
+    A write-only file for a Swift object.
+
+    Data is kept in memory until there is a segment's worth of it.
+    Small files are uploaded with a single PUT on close().  Larger
+    files are uploaded segment by segment while being written, on the
+    storage's upload threads, and a manifest is put when closing.  At
+    most upload_threads segments are held in memory.
+
+    Leaving a with block with an exception discards what was written.
+    """
+    def __init__(self, storage, name):
+        self.storage = storage
+        self.name = name
+        self.closed = False
+        self._buffer = []
+        self._buffered = 0
+        self._prefix = None
+        self._segment_count = 0
+        self._uploads = []
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError('I/O operation on closed file')
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered >= self.storage.segment_size:
+            data = ''.join(self._buffer)
+            segment_size = self.storage.segment_size
+            while len(data) >= segment_size:
+                self._upload_segment(data[:segment_size])
+                data = data[segment_size:]
+            self._buffer = [data]
+            self._buffered = len(data)
+
+    def _upload_segment(self, data):
+        if self._prefix is None:
+            self._prefix = u'{0}/{1}/{2}/'.format(
+                SEGMENT_PREFIX, self.name, uuid.uuid4().hex)
+
+        # Wait for the oldest upload, so only so many segments are
+        # held in memory
+        pending = [upload for upload in self._uploads if not upload.ready()]
+        if len(pending) >= self.storage.upload_threads:
+            pending[0].wait()
+
+        segment_name = u'{0}{1:08d}'.format(
+            self._prefix, self._segment_count)
+        self._segment_count += 1
+        self._uploads.extend(self.storage._upload_segments([
+            (self.storage._put_object,
+             (segment_name, data, {'Content-Type': 'application/octet-stream'}))
+            ]))
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+
+        data = ''.join(self._buffer)
+        self._buffer = []
+
+        if self._prefix is None:
+            self.storage._put_object(self.name, data)
+        else:
+            if data:
+                self._upload_segment(data)
+            try:
+                for upload in self._uploads:
+                    upload.get()
+            except:
+                self._discard_segments()
+                raise
+
+            self.storage._put_object(self.name, '', {
+                'X-Object-Manifest': urllib.quote(
+                    u'{0}/{1}'.format(
+                        self.storage.container, self._prefix).encode('utf-8'))
+                })
+
+        # Without a HEAD request for every write, only the segments of
+        # manifests written through this storage are found here; others
+        # are still dropped by delete_file
+        old_prefix = self.storage._replace_manifest(self.name, self._prefix)
+        if old_prefix and old_prefix != self._prefix:
+            self.storage._delete_segments(old_prefix)
+
+    def _discard_segments(self):
+        for upload in self._uploads:
+            upload.wait()
+        if self._prefix is not None:
+            self.storage._delete_segments(self._prefix)
+
+    def abort(self):
+        """Throw away what was written, without putting the object"""
+        if not self.closed:
+            self.closed = True
+            self._buffer = []
+            self._discard_segments()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class SwiftObjectReader(object):
+    """
+    A read-only file for a Swift object.
+
+    The object is streamed from one GET request as it is read.
+    Seeking drops that request, and reading then goes on with a range
+    request starting at the new position.
+    """
+    def __init__(self, storage, name):
+        self.storage = storage
+        self.name = name
+        self.closed = False
+        self.position = 0
+        self.size = None
+        self._connection = None
+        self._response = None
+
+    def _open(self):
+        headers = {}
+        if self.position:
+            headers['Range'] = 'bytes={0}-'.format(self.position)
+
+        path = self.storage._object_path(self.name)
+        self._connection = self.storage.pool.get()
+        try:
+            response = self.storage._send(
+                self._connection, 'GET', path, headers=headers)
+        except:
+            self._release(reuse=False)
+            raise
+
+        if response.status == 416:
+            # Reading from past the end
+            response.read()
+            self._release()
+            return None
+        if response.status not in (200, 206):
+            response.read()
+            self._release()
+            if response.status == 404:
+                raise IOError(2, 'No such object', self.name)
+            raise SwiftError('GET', path, response.status, response.reason)
+
+        if response.status == 200:
+            self.size = int(response.getheader('Content-Length'))
+        else:
+            self.size = int(
+                response.getheader('Content-Range').rsplit('/', 1)[1])
+        self._response = response
+        return response
+
+    def _release(self, reuse=True):
+        if self._connection is None:
+            return
+        if self._response is not None and not self._response.isclosed():
+            # Half read, the connection can't be used for anything else
+            reuse = False
+        if not reuse:
+            self._connection.close()
+        self.storage.pool.put(self._connection)
+        self._connection = None
+        self._response = None
+
+    def read(self, size=-1):
+        if self.closed:
+            raise ValueError('I/O operation on closed file')
+        response = self._response
+        if response is None:
+            if self.size is not None and self.position >= self.size:
+                return ''
+            response = self._open()
+            if response is None:
+                return ''
+
+        if size is None or size < 0:
+            data = response.read()
+        else:
+            data = response.read(size)
+        self.position += len(data)
+        if response.isclosed():
+            self._release()
+        return data
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.position
+        elif whence == 2:
+            if self.size is None:
+                response = self.storage._request(
+                    'HEAD', self.name, expect=(200, 204))
+                self.size = int(response.getheader('Content-Length'))
+            offset += self.size
+
+        if offset != self.position:
+            self._release()
+            self.position = offset
+
+    def tell(self):
+        return self.position
+
+    def close(self):
+        self._release()
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -24,6 +24,7 @@ _log = logging.getLogger(__name__)
 
 from werkzeug.datastructures import FileStorage
 
+from mediagoblin.tools.files import COPY_BUFFER_SIZE
 from mediagoblin.tools.text import convert_to_tag_list_of_dicts
 from mediagoblin.tools.translate import pass_to_ugettext as _
 from mediagoblin.tools.response import render_to_response, redirect
@@ -81,7 +82,7 @@ def submit_start(request):
                 queue_file = prepare_queue_task(request.app, entry, filename)
 
                 with queue_file:
-                    queue_file.write(request.files['file'].stream.read())
+                    request.files['file'].save(queue_file, COPY_BUFFER_SIZE)
 
                 # Save now so we have this data before kicking off processing
                 entry.save()
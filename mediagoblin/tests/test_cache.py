@@ -15,8 +15,11 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-from mediagoblin.tests.tools import setup_fresh_app
+from mediagoblin.tests.tools import setup_fresh_app, fixture_add_user, \
+    fixture_media_entry
 from mediagoblin import mg_globals
+from mediagoblin.tools.template import get_jinja_env, \
+    invalidate_template_fragment
 
 
 DATA_TO_CACHE = {
@@ -50,3 +53,63 @@ def test_cache_working(test_app):
     # version
     some_data_cache.put('herp', 'pred')
     assert _get_some_data('herp') == 'pred'
+
+
+@setup_fresh_app
+def test_fragment_cache(test_app):
+    template_env = get_jinja_env(mg_globals.app.template_loader, 'en')
+    template = template_env.from_string(
+        u'{% cache "test_fragment", key %}{{ value }}{% endcache %}')
+
+    assert template.render(key=1, value=u'<first>') == u'&lt;first&gt;'
+    # Cached, so no change
+    assert template.render(key=1, value=u'second') == u'&lt;first&gt;'
+    assert template.render(key=2, value=u'second') == u'second'
+
+    invalidate_template_fragment("test_fragment", 1)
+    assert template.render(key=1, value=u'second') == u'second'
+
+
+@setup_fresh_app
+def test_fragment_invalidated_while_rendering(test_app):
+    template_env = get_jinja_env(mg_globals.app.template_loader, 'en')
+    template = template_env.from_string(
+        u'{% cache "test_fragment", 1 %}{{ edit() }}{{ value }}{% endcache %}')
+
+    def edit():
+        # Like an edit committing after the fragment read its data
+        invalidate_template_fragment("test_fragment", 1)
+        return u''
+
+    assert template.render(edit=edit, value=u'old') == u'old'
+    # That rendering was out of date before it was stored
+    assert template.render(edit=lambda: u'', value=u'new') == u'new'
+    assert template.render(edit=lambda: u'', value=u'newer') == u'new'
+
+
+@setup_fresh_app
+def test_media_tile_invalidated_on_edit(test_app):
+    user = fixture_add_user(u'tileuser')
+    entry = fixture_media_entry(
+        title=u'Old title', uploader=user.id, save=False)
+    entry.state = u'processed'
+    entry.media_type = u'mediagoblin.media_types.image'
+    entry.save()
+    entry_id = entry.id
+
+    assert 'Old title' in test_app.get('/').body
+
+    test_app.post(
+        '/auth/login/', {
+            'username': u'tileuser',
+            'password': 'toast'})
+    test_app.post(
+        '/u/tileuser/m/%d/edit/' % entry_id, {
+            'title': u'New title',
+            'slug': u'new-title',
+            'tags': u'',
+            'description': u''})
+
+    response = test_app.get('/')
+    assert 'New title' in response.body
+    assert 'Old title' not in response.body
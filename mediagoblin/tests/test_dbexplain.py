@@ -0,0 +1,53 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from nose.tools import assert_equal
+
+from mediagoblin import mg_globals
+from mediagoblin.gmg_commands.dbexplain import explain_queries, \
+    plan_problems
+from mediagoblin.tests.tools import get_app
+
+
+def test_plan_problems():
+    assert_equal(
+        plan_problems('sqlite', [
+            u'SCAN core__media_entries',
+            u'SEARCH core__media_entries USING INDEX ix (state=?)',
+            u'USE TEMP B-TREE FOR ORDER BY']),
+        [u'SCAN core__media_entries', u'USE TEMP B-TREE FOR ORDER BY'])
+    assert_equal(
+        plan_problems('postgresql', [
+            u'Limit  (cost=0.00..1.00 rows=1 width=8)',
+            u'  ->  Seq Scan on core__media_entries  (cost=0.00..1.00)',
+            u'  ->  Index Scan using ix on core__media_entries']),
+        [u'  ->  Seq Scan on core__media_entries  (cost=0.00..1.00)'])
+    assert_equal(
+        plan_problems('postgresql', [
+            u'Sort  (cost=1.01..1.02 rows=1 width=8)',
+            u'  ->  Limit  (cost=0.00..1.00 rows=1 width=8)',
+            u'        ->  Sort  (cost=1.01..1.02 rows=1 width=8)',
+            u'              Sort Key: created',
+            u'              ->  Index Scan using ix on core__media_entries']),
+        [u'Sort  (cost=1.01..1.02 rows=1 width=8)',
+         u'        ->  Sort  (cost=1.01..1.02 rows=1 width=8)'])
+
+
+def test_listing_queries_use_indexes():
+    get_app(dump_old_app=False)
+    output = []
+    assert_equal(
+        explain_queries(mg_globals.database, printer=output.append), 0)
@@ -0,0 +1,122 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+
+from nose.tools import assert_equal
+from werkzeug.contrib.atom import AtomFeed
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Request
+
+from mediagoblin import mg_globals
+from mediagoblin.db.models import MediaEntry
+from mediagoblin.tests.tools import setup_fresh_app, fixture_add_user, \
+    fixture_media_entry
+from mediagoblin.tools.feed import cached_feed_response, invalidate_feed, \
+    invalidate_media_entry_feeds
+from mediagoblin.tools.text import convert_to_tag_list_of_dicts
+
+
+def _add_processed_entry(user, title):
+    entry = fixture_media_entry(title=title, uploader=user.id, save=False)
+    entry.state = u'processed'
+    entry.media_type = u'mediagoblin.media_types.image'
+    entry.created = datetime.datetime(2012, 12, 21, 12, 0, 0)
+    entry.tags = convert_to_tag_list_of_dicts(u'feedtag')
+    entry.save()
+    return entry
+
+
+@setup_fresh_app
+def test_conditional_feeds(test_app):
+    user = fixture_add_user(u'feeduser')
+    entry_id = _add_processed_entry(user, u'First title').id
+
+    for url in ['/u/feeduser/atom/', '/tag/feedtag/atom/']:
+        response = test_app.get(url)
+        assert 'First title' in response.body
+        assert_equal(response.headers['Content-Type'],
+                     'application/atom+xml; charset=utf-8')
+        etag = response.headers['ETag']
+        assert not etag.startswith('W/')
+        assert_equal(response.headers['Last-Modified'],
+                     'Fri, 21 Dec 2012 12:00:00 GMT')
+
+        response = test_app.get(url, headers={'If-None-Match': etag})
+        assert_equal(response.status_int, 304)
+        assert_equal(response.body, '')
+
+        response = test_app.get(url, headers={
+            'If-Modified-Since': 'Fri, 21 Dec 2012 12:00:00 GMT'})
+        assert_equal(response.status_int, 304)
+
+    # Served from the cache until invalidated
+    entry = MediaEntry.query.get(entry_id)
+    entry.title = u'Second title'
+    entry.save()
+    assert 'First title' in test_app.get('/u/feeduser/atom/').body
+
+    invalidate_media_entry_feeds(MediaEntry.query.get(entry_id))
+    for url in ['/u/feeduser/atom/', '/tag/feedtag/atom/']:
+        response = test_app.get(url, headers={'If-None-Match': etag})
+        assert_equal(response.status_int, 200)
+        assert 'Second title' in response.body
+
+
+@setup_fresh_app
+def test_feed_of_missing_user(test_app):
+    response = test_app.get('/u/nobody/atom/', expect_errors=True)
+    assert_equal(response.status_int, 404)
+    # ... and not cached as such
+    fixture_add_user(u'nobody')
+    response = test_app.get('/u/nobody/atom/')
+    assert_equal(response.status_int, 200)
+
+
+def _feed_body(build_feed):
+    request = Request(EnvironBuilder('/feed/').get_environ())
+    return cached_feed_response(request, (u'test', u'feed'), build_feed).data
+
+
+def _build_feed(title, edit=None):
+    def build_feed():
+        feed = AtomFeed(title, id=u'test', url=u'http://localhost/')
+        if edit is not None:
+            edit()
+        return feed, None
+    return build_feed
+
+
+@setup_fresh_app
+def test_feed_invalidated_while_building(test_app):
+    # Like an entry finishing processing after the feed read its rows
+    edit = lambda: invalidate_feed(u'test', u'feed')
+    assert 'First' in _feed_body(_build_feed(u'First', edit))
+
+    # That feed was out of date before it was stored
+    assert 'Second' in _feed_body(_build_feed(u'Second'))
+    assert 'Second' in _feed_body(_build_feed(u'Third'))
+
+
+@setup_fresh_app
+def test_feeds_without_cache(test_app):
+    cache, mg_globals.cache = mg_globals.cache, None
+    try:
+        assert 'First' in _feed_body(_build_feed(u'First'))
+        assert 'Second' in _feed_body(_build_feed(u'Second'))
+        invalidate_feed(u'test', u'feed')
+    finally:
+        mg_globals.cache = cache
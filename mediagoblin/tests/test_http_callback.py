@@ -15,12 +15,15 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import json
+from BaseHTTPServer import BaseHTTPRequestHandler
 
+from nose.tools import assert_equal
 from urlparse import urlparse, parse_qs
 
 from mediagoblin import mg_globals
 from mediagoblin.tools import processing
-from mediagoblin.tests.tools import get_app, fixture_add_user
+from mediagoblin.tests.tools import (
+    get_app, fixture_add_user, FakeHTTPServer)
 from mediagoblin.tests.test_submission import GOOD_PNG
 from mediagoblin.tests import test_oauth as oauth
 
@@ -79,3 +82,136 @@ class TestHTTPCallback(object):
             upload_files=[('file', GOOD_PNG)])
 
         assert processing.TESTS_CALLBACKS[callback_url]['state'] == u'processed'
+
+
+class FakeHubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    wbufsize = -1
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.requests.append((self.path, body))
+        status = self.server.statuses.pop(0) if self.server.statuses else 204
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+class FakeHub(FakeHTTPServer):
+    def __init__(self, statuses=()):
+        FakeHTTPServer.__init__(self, FakeHubHandler)
+        self.requests = []
+        self.connections = 0
+        self.statuses = list(statuses)
+
+
+class TestNotificationDispatcher(object):
+    def setUp(self):
+        self.hubs = []
+        self.dispatchers = []
+
+    def tearDown(self):
+        for dispatcher in self.dispatchers:
+            dispatcher.stop(5)
+        for hub in self.hubs:
+            hub.stop()
+
+    def get_hub(self, statuses=()):
+        hub = FakeHub(statuses).start()
+        self.hubs.append(hub)
+        return hub
+
+    def get_dispatcher(self, *args, **kwargs):
+        dispatcher = processing.NotificationDispatcher(*args, **kwargs)
+        self.dispatchers.append(dispatcher)
+        return dispatcher
+
+    def test_coalesces_feed_pings(self):
+        hub1, hub2 = self.get_hub(), self.get_hub()
+        dispatcher = self.get_dispatcher(
+            [hub1.url + '/hub', hub2.url + '/hub'], coalesce_window=60)
+
+        for feed_url in ('http://feed/a', 'http://feed/b', 'http://feed/a'):
+            dispatcher.publish_feed(feed_url)
+        assert dispatcher.join(5)
+
+        for hub in (hub1, hub2):
+            assert_equal(len(hub.requests), 1)
+            path, body = hub.requests[0]
+            assert_equal(path, '/hub')
+            assert_equal(parse_qs(body), {
+                    'hub.mode': ['publish'],
+                    'hub.url': ['http://feed/a', 'http://feed/b']})
+
+    def test_retries_and_reuses_connections(self):
+        hub = self.get_hub(statuses=[500, 503])
+        dispatcher = self.get_dispatcher(threads=1, retry_delay=0.01)
+
+        dispatcher.send_json(
+            hub.url + '/callback?id=1', {'state': 'processed'})
+        assert dispatcher.join(5)
+        assert_equal(len(hub.requests), 3)
+        assert_equal(json.loads(hub.requests[-1][1]), {'state': 'processed'})
+
+        for i in range(5):
+            dispatcher.send_json(hub.url + '/callback', {'id': i})
+        assert dispatcher.join(5)
+        assert_equal(len(hub.requests), 8)
+        assert_equal(hub.connections, 1)
+
+    def test_gives_up(self):
+        hub = self.get_hub(statuses=[500] * 10)
+        dispatcher = self.get_dispatcher(retries=2, retry_delay=0.01)
+
+        dispatcher.post(hub.url + '/hub', 'data')
+        assert dispatcher.join(5)
+        assert_equal(len(hub.requests), 3)
+
+    def test_unicode_url(self):
+        hub = self.get_hub()
+        dispatcher = self.get_dispatcher(threads=1)
+
+        dispatcher.post(hub.url + u'/callback/caf\xe9?q=\xe9', 'data')
+        assert dispatcher.join(5)
+        assert_equal(hub.requests, [('/callback/caf%C3%A9?q=%C3%A9', 'data')])
+
+    def test_worker_survives_errors(self):
+        hub = self.get_hub()
+        dispatcher = self.get_dispatcher(threads=1)
+
+        real_send = dispatcher._send
+        calls = []
+
+        def send(url, body, headers):
+            calls.append(url)
+            if len(calls) == 1:
+                raise ValueError('unexpected')
+            return real_send(url, body, headers)
+
+        dispatcher._send = send
+        dispatcher.post(hub.url + '/first', 'data')
+        dispatcher.post(hub.url + '/second', 'data')
+        assert dispatcher.join(5)
+        assert_equal(len(calls), 2)
+        assert_equal(hub.requests, [('/second', 'data')])
+
+    def test_stop(self):
+        hub = self.get_hub()
+        dispatcher = self.get_dispatcher(threads=2)
+
+        dispatcher.post(hub.url + '/hub', 'data')
+        assert dispatcher.stop(5)
+        assert_equal(len(hub.requests), 1)
+        assert not dispatcher._workers
+
+        # Posting again starts new workers
+        dispatcher.post(hub.url + '/hub', 'data')
+        assert dispatcher.join(5)
+        assert_equal(len(hub.requests), 2)
@@ -0,0 +1,141 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import tempfile
+
+import Image
+from nose.tools import assert_equal
+
+from mediagoblin import mg_globals as mgg
+from mediagoblin.media_types.image import processing
+from mediagoblin.tests.tools import get_app
+
+
+def test_fit_size():
+    assert_equal(processing.fit_size((1000, 500), (640, 640)), (640, 320))
+    assert_equal(processing.fit_size((500, 1000), (640, 640)), (320, 640))
+    assert_equal(processing.fit_size((100, 80), (640, 640)), (100, 80))
+    assert_equal(processing.fit_size((3000, 1), (300, 300)), (300, 1))
+
+
+class TestCreateScaledImages(object):
+    def setUp(self):
+        get_app(dump_old_app=False)
+        self.workdir = tempfile.mkdtemp()
+        self.resized = []
+
+        real_resize_image = processing.resize_image
+
+        def resize_image(image, new_size, resize_filter):
+            result = real_resize_image(image, new_size, resize_filter)
+            self.resized.append((image.size, result.size))
+            return result
+
+        self.real_resize_image = real_resize_image
+        processing.resize_image = resize_image
+
+    def tearDown(self):
+        processing.resize_image = self.real_resize_image
+        shutil.rmtree(self.workdir)
+
+    def create_scaled_images(self, image_size, sizes):
+        filepaths = dict(
+            (keyname, ['media_entries', 'scaled', keyname + '.png'])
+            for keyname, filename_format, max_size in sizes)
+        processing.create_scaled_images(
+            Image.new('RGB', image_size), self.workdir, sizes, filepaths)
+
+        stored = {}
+        for keyname, filepath in filepaths.items():
+            with mgg.public_store.get_file(filepath, 'rb') as stored_file:
+                stored[keyname] = Image.open(stored_file).size
+        return stored
+
+    def test_each_size_from_the_next_larger(self):
+        stored = self.create_scaled_images((2000, 1500), [
+            ('thumb', '{basename}.thumbnail{ext}', (180, 180)),
+            ('medium', '{basename}.medium{ext}', (640, 640)),
+            ('large', '{basename}.large{ext}', (1280, 1280))])
+
+        assert_equal(stored, {
+            'large': (1280, 960),
+            'medium': (640, 480),
+            'thumb': (180, 135)})
+        assert_equal(self.resized, [
+            ((2000, 1500), (1280, 960)),
+            ((1280, 960), (640, 480)),
+            ((640, 480), (180, 135))])
+
+    def test_small_images_kept_as_they_are(self):
+        stored = self.create_scaled_images((100, 80), [
+            ('thumb', '{basename}.thumbnail{ext}', (180, 180)),
+            ('medium', '{basename}.medium{ext}', (640, 640))])
+
+        assert_equal(stored, {'medium': (100, 80), 'thumb': (100, 80)})
+        assert_equal(self.resized, [
+            ((100, 80), (100, 80)),
+            ((100, 80), (100, 80))])
+
+    def test_too_small_previous_size_skipped(self):
+        # The squarer box comes first, but is too small to scale the
+        # wide one from, so that one is made from the original
+        stored = self.create_scaled_images((1000, 100), [
+            ('wide', '{basename}.wide{ext}', (640, 100)),
+            ('square', '{basename}.square{ext}', (300, 300))])
+
+        assert_equal(stored, {'square': (300, 30), 'wide': (640, 64)})
+        assert_equal(self.resized, [
+            ((1000, 100), (300, 30)),
+            ((1000, 100), (640, 64))])
+
+
+class TestLoadImage(object):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def save_image(self, name, size):
+        filename = os.path.join(self.workdir, name)
+        Image.new('RGB', size).save(filename)
+        return filename
+
+    def test_jpeg_draft_stays_big_enough(self):
+        filename = self.save_image('big.jpg', (4000, 3000))
+
+        # 1/4 still covers 640, 1/8 (500x375) would not
+        image = processing.load_image(
+            processing.open_image(filename), {}, [(640, 640)])
+        assert_equal(image.size, (1000, 750))
+
+        # The largest requested size counts
+        image = processing.load_image(
+            processing.open_image(filename), {}, [(180, 180), (1280, 1280)])
+        assert_equal(image.size, (2000, 1500))
+
+    def test_no_draft(self):
+        filename = self.save_image('big.jpg', (4000, 3000))
+        image = processing.load_image(processing.open_image(filename), {})
+        assert_equal(image.size, (4000, 3000))
+
+    def test_draft_only_for_jpeg(self):
+        filename = self.save_image('big.png', (4000, 3000))
+        image = processing.load_image(
+            processing.open_image(filename), {}, [(640, 640)])
+        assert_equal(image.size, (4000, 3000))
@@ -0,0 +1,114 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+
+from nose.plugins.skip import SkipTest
+from nose.tools import assert_equal, assert_raises
+
+try:
+    import pygst
+    import gobject
+except ImportError:
+    raise SkipTest('The media engine needs GStreamer')
+
+from mediagoblin.media_types.media_engine import gst, JobLoop, \
+    MediaEngine, MediaEngineTimeout
+
+
+class FakePipeline(object):
+    def __init__(self):
+        self.states = []
+
+    def set_state(self, state):
+        self.states.append(state)
+
+
+def returns(func, *args):
+    """Whether func(*args) returns within a few seconds"""
+    thread = threading.Thread(target=func, args=args)
+    thread.daemon = True
+    thread.start()
+    thread.join(5)
+    return not thread.is_alive()
+
+
+def test_quit_before_run():
+    loop = JobLoop()
+    loop.quit()
+    assert returns(loop.run)
+
+
+def test_quit_from_another_thread():
+    loop = JobLoop()
+    threading.Timer(0.1, loop.quit).start()
+    assert returns(loop.run)
+    # Ready to be run again
+    assert loop.is_running()
+
+
+def test_cancel_stops_pipelines():
+    loop = JobLoop()
+    pipeline = FakePipeline()
+    loop.watch(pipeline)
+    loop.cancel()
+
+    assert_equal(pipeline.states, [gst.STATE_NULL])
+    assert loop.cancelled
+    # Returns at once from then on
+    assert returns(loop.run)
+    assert returns(loop.run)
+
+    # Watched too late, stopped straight away
+    late = FakePipeline()
+    loop.watch(late)
+    assert_equal(late.states, [gst.STATE_NULL])
+
+
+class TestMediaEngine(object):
+    def setUp(self):
+        self.engine = MediaEngine(threads=1)
+
+    def test_submit_and_run(self):
+        assert_equal(self.engine.submit(lambda a, b: a + b, 1, 2).get(5), 3)
+        assert_equal(self.engine.run(lambda a, b=0: a * b, 3, b=4), 12)
+
+    def test_timeout_stops_pipelines(self):
+        pipeline = FakePipeline()
+
+        def job():
+            loop = JobLoop()
+            loop.watch(pipeline)
+            loop.run()
+            return 'cancelled'
+
+        assert_raises(MediaEngineTimeout, self.engine.run, job, timeout=0.1)
+        assert_equal(pipeline.states, [gst.STATE_NULL])
+        # The job gave back its thread
+        assert_equal(self.engine.run(lambda: 'next', timeout=5), 'next')
+
+    def test_cancel_before_start(self):
+        release = threading.Event()
+        self.engine.submit(release.wait)
+        calls = []
+
+        # Waits behind the first job until it times out
+        assert_raises(MediaEngineTimeout,
+                      self.engine.run, calls.append, 'late', timeout=0.1)
+
+        release.set()
+        self.engine.run(calls.append, 'next', timeout=5)
+        assert_equal(calls, ['next'])
@@ -15,9 +15,16 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from nose.tools import assert_equal
+from beaker.middleware import SessionMiddleware
+from sqlalchemy import event
+from webtest import TestApp
 
+from mediagoblin import mg_globals
 from mediagoblin.db.base import Session
 from mediagoblin.db.models import User, MediaEntry, MediaComment
+from mediagoblin.db.util import media_entries_for_gallery
+from mediagoblin.tools.files import delete_media_files
+from mediagoblin.tools.text import convert_to_tag_list_of_dicts
 from mediagoblin.tests.tools import get_app, \
     fixture_add_user, fixture_media_entry
 
@@ -78,3 +85,104 @@ def test_user_deletes_other_comments():
     assert_equal(med_cnt2, med_cnt1 - 2)
     # All comments gone
     assert_equal(cmt_cnt2, cmt_cnt1 - 4)
+
+
+def test_gallery_query_count():
+    get_app(dump_old_app=False)
+
+    user = fixture_add_user(u'gallery_user')
+    for i in range(5):
+        entry = fixture_media_entry(
+            title=u'Gallery %d' % i, uploader=user.id, save=False)
+        entry.state = u'processed'
+        entry.media_files[u'thumb'] = [u'a', u'thumb%d.jpg' % i]
+        entry.tags = convert_to_tag_list_of_dicts(u'gallery, tag%d' % i)
+        entry.save()
+    Session.expunge_all()
+
+    # SQLAlchemy 0.7 can't remove engine listeners, so just stop counting
+    statements = []
+    counting = [True]
+    def count_statement(*args):
+        if counting:
+            statements.append(args)
+    event.listen(mg_globals.database.engine, 'before_cursor_execute',
+                 count_statement)
+    try:
+        cursor = MediaEntry.query.filter_by(uploader=user.id) \
+            .order_by(MediaEntry.created.desc())
+        for entry in media_entries_for_gallery(cursor):
+            entry.media_files[u'thumb']
+            entry.get_uploader.username
+            [tag['slug'] for tag in entry.tags]
+    finally:
+        del counting[:]
+
+    # The entries with their uploader, the files, the MediaTags and
+    # their Tags; no matter how many entries there are.
+    assert_equal(len(statements), 4)
+
+
+def test_serve_media_sendfile():
+    get_app(dump_old_app=False)
+    # Bypass paste's static file serving
+    media_app = TestApp(SessionMiddleware(mg_globals.app))
+
+    entry = fixture_media_entry(u'Served')
+    entry_id = entry.id
+    filepath = [u'media_entries', unicode(entry_id), u'served.jpg']
+    entry.media_files[u'original'] = filepath
+    entry.state = u'processed'
+    entry.save()
+    with mg_globals.public_store.get_file(filepath, 'wb') as media_file:
+        media_file.write('not really a jpeg')
+
+    url = '/mgoblin_media/media_entries/{0}/served.jpg'.format(entry_id)
+    response = media_app.get(url, headers={'Range': 'bytes=0-3'})
+    assert_equal(response.status_int, 200)
+    assert_equal(response.body, '')
+    assert_equal(response.headers['X-Sendfile'],
+                 mg_globals.public_store.get_local_path(filepath))
+    assert_equal(response.headers['Accept-Ranges'], 'bytes')
+    assert_equal(response.content_type, 'image/jpeg')
+
+    media_app.get(url, headers={'If-None-Match': response.headers['ETag']},
+                  status=304)
+
+    # Only the files of processed media entries are served
+    media_app.get(
+        '/mgoblin_media/media_entries/{0}/other.jpg'.format(entry_id),
+        status=404)
+    media_app.get('/mgoblin_media/../mediagoblin.db', status=404)
+    entry = MediaEntry.query.get(entry_id)
+    entry.state = u'failed'
+    entry.save()
+    media_app.get(url, status=404)
+    entry = MediaEntry.query.get(entry_id)
+    entry.state = u'processed'
+    entry.save()
+
+    mg_globals.app_config['media_sendfile'] = 'x-accel-redirect'
+    try:
+        response = media_app.get(url)
+    finally:
+        mg_globals.app_config['media_sendfile'] = 'x-sendfile'
+    assert_equal(
+        response.headers['X-Accel-Redirect'],
+        '/protected_media/media_entries/{0}/served.jpg'.format(entry_id))
+
+
+def test_delete_media_files_stored_under_two_keys():
+    get_app(dump_old_app=False)
+    entry = fixture_media_entry(title=u'Shared file')
+    filepath = [u'media_entries', unicode(entry.id), u'video.webm']
+    with mg_globals.public_store.get_file(filepath, 'wb') as stored_file:
+        stored_file.write('webm')
+
+    entry.media_files[u'webm_640'] = filepath
+    entry.media_files[u'original'] = filepath
+    entry.save()
+
+    # Only deleted once, so without complaining about a missing file
+    delete_media_files(entry)
+    assert not mg_globals.public_store.file_exists(filepath)
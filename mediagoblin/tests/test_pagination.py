@@ -0,0 +1,108 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+
+from nose.tools import assert_equal, assert_raises
+from werkzeug.exceptions import NotFound
+
+from mediagoblin.db.base import Session
+from mediagoblin.db.models import MediaEntry
+from mediagoblin.tests.tools import get_app, fixture_add_user, \
+    fixture_media_entry
+from mediagoblin.tools.pagination import Pagination, KeysetPagination
+
+
+def _add_entries(username, count):
+    """
+    Add count entries, with some sharing their created time so the id
+    has to break the tie.
+    """
+    user = fixture_add_user(username)
+    start = datetime.datetime(2012, 1, 1)
+    ids = []
+    for i in range(count):
+        entry = fixture_media_entry(
+            title=u'Entry %d' % i, uploader=user.id, save=False)
+        entry.created = start + datetime.timedelta(minutes=i // 2)
+        Session.add(entry)
+        Session.flush()
+        ids.append(entry.id)
+    Session.commit()
+
+    # Newest first
+    ids.reverse()
+    return user, ids
+
+
+def _cursor(user):
+    return MediaEntry.query.filter_by(uploader=user.id).order_by(
+        MediaEntry.created.desc(), MediaEntry.id.desc())
+
+
+def test_keyset_pagination():
+    get_app(dump_old_app=False)
+    user, ids = _add_entries(u'keysetuser', 7)
+
+    first = KeysetPagination(_cursor(user), per_page=3)
+    assert_equal([e.id for e in first()], ids[0:3])
+    assert not first.has_prev
+    assert first.has_next
+
+    key = KeysetPagination.encode_key(first()[-1])
+    second = KeysetPagination(_cursor(user), after=key, per_page=3)
+    assert_equal([e.id for e in second()], ids[3:6])
+    assert second.has_prev
+    assert second.has_next
+
+    key = KeysetPagination.encode_key(second()[-1])
+    last = KeysetPagination(_cursor(user), after=key, per_page=3)
+    assert_equal([e.id for e in last()], ids[6:])
+    assert last.has_prev
+    assert not last.has_next
+
+    # And back again
+    key = KeysetPagination.encode_key(last()[0])
+    back = KeysetPagination(_cursor(user), before=key, per_page=3)
+    assert_equal([e.id for e in back()], ids[3:6])
+    assert back.has_prev
+    assert back.has_next
+
+    # Going back to fewer than a page of entries shows a full first page
+    key = KeysetPagination.encode_key(first()[2])
+    top = KeysetPagination(_cursor(user), before=key, per_page=3)
+    assert_equal([e.id for e in top()], ids[0:3])
+    assert not top.has_prev
+
+    jumped = KeysetPagination(_cursor(user), per_page=3, jump_to_id=ids[4])
+    assert_equal([e.id for e in jumped()], ids[4:7])
+    assert_equal(jumped.active_id, ids[4])
+
+    assert_raises(NotFound, KeysetPagination, _cursor(user),
+                  after='not a key')
+
+
+def test_pagination_jump_to_id():
+    get_app(dump_old_app=False)
+    user, ids = _add_entries(u'jumpuser', 7)
+
+    for index, id in enumerate(ids):
+        pagination = Pagination(1, _cursor(user), 3, jump_to_id=id)
+        assert_equal(pagination.page, index // 3 + 1)
+        assert_equal(pagination.active_id, id)
+        assert id in [e.id for e in pagination()]
+
+    assert_equal(Pagination(1, _cursor(user), 3).pages, 3)
@@ -1,8 +1,16 @@
 #!/usr/bin/env python
 
-from nose.tools import assert_equal
+import os
+import tempfile
+import threading
+
+from nose.tools import assert_equal, assert_raises
 
 from mediagoblin import processing
+from mediagoblin.db.base import Session
+from mediagoblin.db.models import MediaEntry
+from mediagoblin.tests.tools import get_app, fixture_media_entry
+from mediagoblin.tools.workbench import WorkbenchManager
 
 class TestProcessing(object):
     def run_fill(self, input, format, output=None):
@@ -18,3 +26,87 @@ class TestProcessing(object):
     def test_long_filename_fill(self):
         self.run_fill('{0}.png'.format('A' * 300), 'image-{basename}{ext}',
                       'image-{0}.png'.format('A' * 245))
+
+
+class TestProcessingGraph(object):
+    def setUp(self):
+        self.workbench_manager = WorkbenchManager(
+            os.path.join(tempfile.gettempdir(), u'mgoblin_workbench_testing'))
+        self.proc_state = processing.ProcessingState(None)
+
+    def test_results_passed_to_requiring_steps(self):
+        with self.workbench_manager.create() as workbench:
+            self.proc_state.set_workbench(workbench)
+            graph = processing.ProcessingGraph(self.proc_state, max_threads=2)
+            graph.add_step('a', lambda workdir: 1)
+            graph.add_step('b', lambda workdir: 2)
+            graph.add_step('sum', lambda workdir, a, b: a + b,
+                           requires=('a', 'b'))
+            results = graph.run()
+
+        assert_equal(results, {'a': 1, 'b': 2, 'sum': 3})
+
+    def test_independent_steps_overlap(self):
+        both_running = threading.Event()
+        started = []
+
+        def step(workdir):
+            assert os.path.isdir(workdir)
+            started.append(workdir)
+            if len(started) == 2:
+                both_running.set()
+            both_running.wait(5)
+            return both_running.is_set()
+
+        with self.workbench_manager.create() as workbench:
+            self.proc_state.set_workbench(workbench)
+            graph = processing.ProcessingGraph(self.proc_state, max_threads=2)
+            graph.add_step('a', step)
+            graph.add_step('b', step)
+            results = graph.run()
+
+        assert_equal(results, {'a': True, 'b': True})
+        assert started[0] != started[1]
+
+    def test_failing_step_raises(self):
+        ran = []
+
+        def fail(workdir):
+            raise processing.BadMediaFail()
+
+        with self.workbench_manager.create() as workbench:
+            self.proc_state.set_workbench(workbench)
+            graph = processing.ProcessingGraph(self.proc_state, max_threads=2)
+            graph.add_step('fail', fail)
+            graph.add_step('after', lambda workdir, x: ran.append(x),
+                           requires=('fail',))
+            assert_raises(processing.BadMediaFail, graph.run)
+
+        assert_equal(ran, [])
+
+    def test_unknown_requirement(self):
+        graph = processing.ProcessingGraph(self.proc_state, max_threads=2)
+        assert_raises(ValueError, graph.add_step, 'a', lambda workdir: None,
+                      requires=('b',))
+
+
+def test_progress_callback_throttles_writes():
+    get_app(dump_old_app=False)
+    entry = fixture_media_entry()
+    callback = processing.ProgressCallback(entry, step=10, interval=3600)
+
+    def stored_progress():
+        return Session.query(MediaEntry.transcoding_progress).filter_by(
+            id=entry.id).scalar()
+
+    def live_progress():
+        return processing.get_processing_progress([entry])[entry.id]
+
+    callback(3)
+    assert_equal((stored_progress(), live_progress()), (None, 3))
+    callback(12.5)
+    assert_equal((stored_progress(), live_progress()), (12, 12))
+    callback(21)
+    assert_equal((stored_progress(), live_progress()), (12, 21))
+    callback(100)
+    assert_equal((stored_progress(), live_progress()), (100, 100))
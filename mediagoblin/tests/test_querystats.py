@@ -0,0 +1,82 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from nose.tools import assert_equal
+
+from mediagoblin import mg_globals
+from mediagoblin.db.models import User
+from mediagoblin.meddleware.querystats import QueryStats, \
+    get_endpoint_stats, clear_endpoint_stats
+from mediagoblin.tests.tools import get_app, fixture_add_user
+
+
+def test_query_stats_slowest():
+    stats = QueryStats()
+    for duration in [0.1, 0.5, 0.2, 0.05, 0.3]:
+        stats.add('SELECT %s' % duration, duration)
+
+    assert_equal(stats.count, 5)
+    assert_equal(round(stats.total_time, 3), 1.15)
+    assert_equal(stats.slowest,
+                 [(0.5, 'SELECT 0.5'), (0.3, 'SELECT 0.3'),
+                  (0.2, 'SELECT 0.2')])
+
+
+def test_query_stats_meddleware():
+    test_app = get_app(dump_old_app=False)
+
+    # The stats are reset at the end of each request, so this one also
+    # gets the queries other tests ran outside of a request.
+    response = test_app.get('/')
+    assert 'X-Query-Count' not in response.headers
+    clear_endpoint_stats()
+
+    mg_globals.app_config['query_stats_headers'] = True
+    try:
+        response = test_app.get('/')
+    finally:
+        mg_globals.app_config['query_stats_headers'] = False
+
+    # At least fetching the media entries
+    assert int(response.headers['X-Query-Count']) >= 1
+    assert 'X-Query-Time' in response.headers
+    assert 'X-Slow-Query-1' in response.headers
+
+    endpoint_stats = dict(get_endpoint_stats())
+    assert_equal(endpoint_stats['index'].requests, 1)
+    assert_equal(endpoint_stats['index'].max_queries,
+                 int(response.headers['X-Query-Count']))
+
+
+def test_admin_query_stats():
+    test_app = get_app(dump_old_app=False)
+    user = fixture_add_user(u'queryadmin')
+    test_app.post(
+        '/auth/login/', {
+            'username': u'queryadmin',
+            'password': 'toast'})
+
+    # Not an admin
+    response = test_app.get('/a/queries', expect_errors=True)
+    assert_equal(response.status_int, 403)
+
+    user = User.query.get(user.id)
+    user.is_admin = True
+    user.save()
+    test_app.get('/')
+    response = test_app.get('/a/queries')
+    assert 'Database query statistics' in response.body
+    assert '<td>index</td>' in response.body
@@ -0,0 +1,167 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import tempfile
+
+import numpy
+from PIL import Image
+from nose.plugins.skip import SkipTest
+from nose.tools import assert_equal
+
+try:
+    import pygst
+except ImportError:
+    raise SkipTest('The audio media type needs GStreamer')
+
+from mediagoblin.media_types.audio import spectrogram
+
+
+class FakeSndfile(object):
+    """Stands in for audiolab.Sndfile, reading from FakeAudiolab.files"""
+    def __init__(self, filename, mode):
+        self.samples = FakeAudiolab.files[filename]
+        self.nframes = len(self.samples)
+        self.channels = self.samples.shape[1]
+        self.samplerate = 44100
+        self.position = 0
+
+    def seek(self, position):
+        self.position = position
+
+    def read_frames(self, count):
+        samples = self.samples[self.position:self.position + count]
+        self.position += count
+        return samples.copy()
+
+    def close(self):
+        pass
+
+
+class FakeAudiolab(object):
+    Sndfile = FakeSndfile
+    files = {}
+
+
+def make_samples(nframes):
+    """A chirp with some noise in the left channel, in stereo"""
+    random = numpy.random.RandomState(0)
+    t = numpy.arange(nframes)
+    left = (0.5 * numpy.sin(t * (0.01 + t * 2e-7))
+            + 0.1 * random.randn(nframes))
+    return numpy.column_stack([left, left * 0.3])
+
+
+def image_pixels(filename):
+    return numpy.asarray(Image.open(filename))
+
+
+class TestSpectrogram(object):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        # audiolab may well not be installed
+        self.real_audiolab = getattr(spectrogram, 'audiolab', None)
+        spectrogram.audiolab = FakeAudiolab
+
+    def tearDown(self):
+        FakeAudiolab.files.clear()
+        if self.real_audiolab is None:
+            del spectrogram.audiolab
+        else:
+            spectrogram.audiolab = self.real_audiolab
+        shutil.rmtree(self.workdir)
+
+    def column_by_column(self, filename, image_size, fft_size):
+        """Draw the spectrogram of filename the slow way, as reference"""
+        processor = spectrogram.AudioProcessor(
+            filename, fft_size, numpy.hamming)
+        samples_per_pixel = processor.audio_file.nframes / float(image_size[0])
+
+        image = spectrogram.SpectrogramImage(image_size, fft_size)
+        for x in range(image_size[0]):
+            frame = processor.read_block(
+                int(x * samples_per_pixel) - fft_size / 2, fft_size)
+            spectrum = processor.scale * numpy.abs(
+                numpy.fft.rfft(frame * processor.window))
+            image.draw_spectrum(x, spectrogram.db_spectra(spectrum))
+        return image.pixels
+
+    def test_draw_spectra_matches_draw_spectrum(self):
+        spectra = numpy.random.RandomState(0).rand(40, 1025)
+
+        at_once = spectrogram.SpectrogramImage((50, 192), 2048)
+        at_once.draw_spectra(5, spectra)
+
+        by_column = spectrogram.SpectrogramImage((50, 192), 2048)
+        for i, spectrum in enumerate(spectra):
+            by_column.draw_spectrum(5 + i, spectrum)
+
+        assert (at_once.pixels == by_column.pixels).all()
+        # The columns not drawn are left black
+        assert not at_once.pixels[:, :5].any()
+        assert not at_once.pixels[:, 45:].any()
+
+    def check_create_spectrogram_image(self, nframes, image_size, fft_size):
+        FakeAudiolab.files['audio'] = make_samples(nframes)
+        filename = os.path.join(self.workdir, 'spectrogram.png')
+        progress = []
+
+        spectrogram.create_spectrogram_image(
+            'audio', filename, image_size, fft_size, progress.append)
+
+        assert_equal(
+            image_pixels(filename).tolist(),
+            self.column_by_column('audio', image_size, fft_size).tolist())
+        assert_equal(progress[0], 0)
+        assert_equal(progress[-1], 100)
+
+    def test_create_spectrogram_image(self):
+        # Overlapping frames, read as one block
+        self.check_create_spectrogram_image(44100, (640, 192), 2048)
+        # Frames far apart, read one by one
+        self.check_create_spectrogram_image(44100 * 20, (100, 150), 1024)
+        # Shorter than one frame
+        self.check_create_spectrogram_image(1000, (64, 64), 2048)
+
+    def check_accumulator(self, nframes, received, block_size,
+                          image_size, fft_size):
+        samples = make_samples(nframes)
+        # Past received, the audio ended early: that is silence
+        samples[received:] = 0
+        FakeAudiolab.files['audio'] = samples
+        expected = os.path.join(self.workdir, 'expected.png')
+        spectrogram.create_spectrogram_image(
+            'audio', expected, image_size, fft_size,
+            window_function=numpy.hanning)
+
+        accumulator = spectrogram.SpectrogramAccumulator(
+            nframes, image_size, fft_size)
+        for start in range(0, received, block_size):
+            accumulator.feed(samples[start:start + block_size])
+        accumulated = os.path.join(self.workdir, 'accumulated.png')
+        accumulator.save(accumulated)
+
+        assert_equal(
+            image_pixels(accumulated).tolist(),
+            image_pixels(expected).tolist())
+
+    def test_accumulator(self):
+        self.check_accumulator(44100, 44100, 1000, (640, 192), 2048)
+        self.check_accumulator(44100 * 10, 44100 * 10, 4099, (200, 150), 1024)
+        # Blocks smaller than the FFT, and the audio ending early
+        self.check_accumulator(44100, 40000, 333, (640, 192), 2048)
+        self.check_accumulator(3000, 1777, 7, (64, 64), 2048)
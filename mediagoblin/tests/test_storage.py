@@ -16,12 +16,14 @@
 
 
 import os
+import shutil
 import tempfile
 
 from nose.tools import assert_raises, assert_equal, assert_true
 from werkzeug.utils import secure_filename
 
 from mediagoblin import storage
+from mediagoblin.storage.mountstorage import MountStorage
 
 
 ################
@@ -61,6 +63,10 @@ class FakeRemoteStorage(storage.filestorage.BasicFileStorage):
         return storage.StorageInterface.copy_local_to_storage(
             self, *args, **kwargs)
 
+    def move_local_to_storage(self, *args, **kwargs):
+        return storage.StorageInterface.move_local_to_storage(
+            self, *args, **kwargs)
+
 
 def test_storage_system_from_config():
     this_storage = storage.storage_system_from_config(
@@ -147,6 +153,70 @@ def test_basic_storage_get_unique_filepath():
     assert new_filename == secure_filename(new_filename)
 
 
+def test_get_unique_filepaths():
+    tmpdir, this_storage = get_tmp_filestorage()
+    os.makedirs(os.path.join(tmpdir, 'dir1'))
+    with open(os.path.join(tmpdir, 'dir1', 'taken.txt'), 'w') as ourfile:
+        ourfile.write("I'm having a lovely day!")
+
+    def file_exists(filepath):
+        raise AssertionError('Files should be looked up all at once')
+    this_storage.file_exists = file_exists
+
+    free, taken = this_storage.get_unique_filepaths(
+        ['dir1'], ['free.txt', 'taken.txt'])
+    assert_equal(free, [u'dir1', u'free.txt'])
+    assert_equal(taken[0], u'dir1')
+    assert taken[1].endswith('-taken.txt')
+
+    # A directory that does not exist yet has no files in it
+    assert_equal(
+        this_storage.get_unique_filepaths(['dir2'], ['free.txt']),
+        [[u'dir2', u'free.txt']])
+
+    # Storage systems that can't list directories check every file
+    tmpdir, this_storage = get_tmp_filestorage()
+    this_storage.existing_files = lambda *args: \
+        storage.StorageInterface.existing_files(this_storage, *args)
+    this_storage.file_exists = lambda filepath: filepath[-1] == 'taken.txt'
+    free, taken = this_storage.get_unique_filepaths(
+        ['dir1'], ['free.txt', 'taken.txt'])
+    assert_equal(free, [u'dir1', u'free.txt'])
+    assert taken[1].endswith('-taken.txt')
+
+
+def test_get_unique_filepaths_duplicates():
+    # Like an ascii upload named ascii-portable.txt, whose unicode copy
+    # has the same name as its original
+    tmpdir, this_storage = get_tmp_filestorage()
+    thumb, unicode_copy, original = this_storage.get_unique_filepaths(
+        ['media_entries', '1'],
+        ['thumbnail.png', 'ascii-portable.txt', 'ascii-portable.txt'])
+    assert_equal(thumb, [u'media_entries', u'1', u'thumbnail.png'])
+    assert_equal(unicode_copy,
+                 [u'media_entries', u'1', u'ascii-portable.txt'])
+    assert original[-1] != unicode_copy[-1]
+    assert original[-1].endswith('-ascii-portable.txt')
+
+    # Also when the name is taken already
+    os.makedirs(os.path.join(tmpdir, 'dir1'))
+    with open(os.path.join(tmpdir, 'dir1', 'taken.txt'), 'w') as ourfile:
+        ourfile.write("I'm having a lovely day!")
+    first, second = this_storage.get_unique_filepaths(
+        ['dir1'], ['taken.txt', 'taken.txt'])
+    assert first[-1].endswith('-taken.txt')
+    assert second[-1].endswith('-taken.txt')
+    assert first != second
+
+    # And through a mount, which only passes existing_files on
+    mount_storage = MountStorage()
+    mount_storage.mount(['mnt'], this_storage)
+    first, second = mount_storage.get_unique_filepaths(
+        ['mnt', 'dir1'], ['free.txt', 'free.txt'])
+    assert_equal(first, [u'mnt', u'dir1', u'free.txt'])
+    assert second[-1].endswith('-free.txt')
+
+
 def test_basic_storage_get_file():
     tmpdir, this_storage = get_tmp_filestorage()
 
@@ -280,3 +350,108 @@ def test_basic_storage_copy_local_to_storage():
 def test_general_storage_copy_local_to_storage():
     tmpdir, this_storage = get_tmp_filestorage(fake_remote=True)
     _test_copy_local_to_storage_works(tmpdir, this_storage)
+
+
+def test_general_storage_copy_locally():
+    tmpdir, this_storage = get_tmp_filestorage(fake_remote=True)
+
+    filepath = ['dir1', 'ourfile.txt']
+    with this_storage.get_file(filepath, 'w') as our_file:
+        our_file.write('Testing this file')
+
+    new_file_dest = os.path.join(tempfile.mkdtemp(), 'file2.txt')
+    this_storage.copy_locally(filepath, new_file_dest)
+
+    assert file(new_file_dest).read() == 'Testing this file'
+
+
+def test_copy_file_to_storage():
+    for fake_remote in (False, True):
+        tmpdir, this_storage = get_tmp_filestorage(fake_remote=fake_remote)
+
+        with tempfile.TemporaryFile() as source_file:
+            source_file.write('skip this, copy that')
+            source_file.seek(len('skip this, '))
+            this_storage.copy_file_to_storage(
+                source_file, ['dir1', 'copied.txt'])
+
+        assert_equal(
+            file(os.path.join(tmpdir, 'dir1/copied.txt')).read(),
+            'copy that')
+
+
+def test_copy_file_object_chunks():
+    class RecordingFile(object):
+        def __init__(self):
+            self.writes = []
+
+        def write(self, data):
+            self.writes.append(data)
+
+    source_file = tempfile.TemporaryFile()
+    source_file.write('x' * 2500)
+    source_file.seek(0)
+    dest_file = RecordingFile()
+
+    storage.copy_file_object(source_file, dest_file, buffer_size=1000)
+
+    assert_equal([len(data) for data in dest_file.writes], [1000, 1000, 500])
+
+
+def test_copy_file_keeps_permissions():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        source_path = os.path.join(tmpdir, 'source')
+        dest_path = os.path.join(tmpdir, 'dest')
+        with open(source_path, 'wb') as source_file:
+            source_file.write('data')
+        os.chmod(source_path, 0640)
+
+        storage.copy_file(source_path, dest_path)
+
+        assert_equal(open(dest_path, 'rb').read(), 'data')
+        assert_equal(os.stat(dest_path).st_mode & 0777, 0640)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_basic_storage_move_local_to_storage():
+    tmpdir, this_storage = get_tmp_filestorage()
+    local_dir = tempfile.mkdtemp()
+
+    # Moving renames the file
+    local_filename = os.path.join(local_dir, 'moved.txt')
+    with file(local_filename, 'w') as local_file:
+        local_file.write('moved')
+    inode = os.stat(local_filename).st_ino
+    this_storage.move_local_to_storage(local_filename, ['dir1', 'moved.txt'])
+
+    stored = os.path.join(tmpdir, 'dir1/moved.txt')
+    assert not os.path.exists(local_filename)
+    assert_equal(file(stored).read(), 'moved')
+    assert_equal(os.stat(stored).st_ino, inode)
+
+    # Keeping the local file links it, replacing any existing file
+    local_filename = os.path.join(local_dir, 'linked.txt')
+    with file(local_filename, 'w') as local_file:
+        local_file.write('linked')
+    this_storage.move_local_to_storage(
+        local_filename, ['dir1', 'moved.txt'], keep_local=True)
+
+    assert_equal(file(local_filename).read(), 'linked')
+    assert_equal(file(stored).read(), 'linked')
+    assert_equal(os.stat(stored).st_ino, os.stat(local_filename).st_ino)
+    assert_equal(os.listdir(os.path.join(tmpdir, 'dir1')), ['moved.txt'])
+
+
+def test_general_storage_move_local_to_storage():
+    tmpdir, this_storage = get_tmp_filestorage(fake_remote=True)
+    local_filename = tempfile.mktemp()
+    with file(local_filename, 'w') as local_file:
+        local_file.write('moved')
+
+    this_storage.move_local_to_storage(local_filename, ['dir1', 'moved.txt'])
+
+    assert not os.path.exists(local_filename)
+    assert_equal(
+        file(os.path.join(tmpdir, 'dir1/moved.txt')).read(), 'moved')
@@ -21,15 +21,20 @@ sys.setdefaultencoding('utf-8')
 import urlparse
 import os
 
+from StringIO import StringIO
+
 from nose.tools import assert_equal, assert_true
 from pkg_resources import resource_filename
+from werkzeug.test import EnvironBuilder
 
 from mediagoblin.tests.tools import get_app, \
     fixture_add_user
 from mediagoblin import mg_globals
 from mediagoblin.db.models import MediaEntry
 from mediagoblin.tools import template
+from mediagoblin.media_types import _sniffable_file
 from mediagoblin.media_types.image import MEDIA_MANAGER as img_MEDIA_MANAGER
+from mediagoblin.tools.request import Request
 
 def resource(filename):
     return resource_filename('mediagoblin.tests', 'test_submission/' + filename)
@@ -291,3 +296,27 @@ class TestSubmission:
             size = os.stat(filename).st_size
             assert_true(last_size > size)
             last_size = size
+
+
+def _upload_request(data):
+    builder = EnvironBuilder(
+        method='POST', data={'file': (StringIO(data), 'upload')})
+    return Request(builder.get_environ())
+
+
+def test_upload_spooling():
+    # Big uploads are spooled to disk, and sniffers get that file
+    data = 'x' * (Request.MAX_MEMORY_UPLOAD_SIZE + 1)
+    upload = _upload_request(data).files['file']
+    assert os.path.isfile(upload.stream.name)
+
+    media_file = _sniffable_file(upload)
+    assert media_file is upload.stream
+    assert_equal(open(media_file.name, 'rb').read(), data)
+
+    # Small ones stay in memory, sniffers get a copy
+    upload = _upload_request('small').files['file']
+    assert not hasattr(upload.stream, 'name')
+
+    media_file = _sniffable_file(upload)
+    assert_equal(open(media_file.name, 'rb').read(), 'small')
@@ -0,0 +1,293 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import urllib
+import urlparse
+from BaseHTTPServer import BaseHTTPRequestHandler
+
+from nose.tools import assert_equal, assert_raises, assert_true
+
+from mediagoblin.storage.swift import SwiftStorage
+from mediagoblin.tests.tools import FakeHTTPServer
+
+
+class FakeSwiftHandler(BaseHTTPRequestHandler):
+    """Just enough of the Swift API, kept in memory"""
+    protocol_version = 'HTTP/1.1'
+    # Send each response in one go
+    wbufsize = -1
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def _respond(self, status, body='', headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if 'Content-Length' not in (headers or {}):
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _parse(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.body = self.rfile.read(length) if length else ''
+        if self.path.startswith('/auth/'):
+            return False
+
+        # /v1/<account>/<container>[/<object>]
+        url = urlparse.urlsplit(self.path)
+        self.query = dict(urlparse.parse_qsl(url.query))
+        parts = url.path.split('/', 4)[3:]
+        self.object_name = urllib.unquote(parts[1]) if len(parts) > 1 else None
+        self.server.requests.append(
+            (self.command, self.object_name, self.headers.get('Range')))
+
+        if self.headers.get('X-Auth-Token') != self.server.token:
+            self._respond(401)
+            return False
+        return True
+
+    def _object_data(self, obj):
+        manifest = obj['headers'].get('X-Object-Manifest')
+        if not manifest:
+            return obj['data']
+        prefix = urllib.unquote(manifest).split('/', 1)[1]
+        return ''.join(self.server.objects[name]['data']
+                       for name in sorted(self.server.objects)
+                       if name.startswith(prefix))
+
+    def do_GET(self):
+        if self.path.startswith('/auth/'):
+            self._parse()
+            self.server.token = self.server.next_token
+            return self._respond(200, headers={
+                    'X-Storage-Url': self.server.storage_url,
+                    'X-Auth-Token': self.server.token})
+        if not self._parse():
+            return
+
+        if self.object_name is None:
+            names = sorted(name for name in self.server.objects
+                           if name.startswith(self.query.get('prefix', '')))
+            listing = ''.join(name + '\n' for name in names)
+            return self._respond(200 if listing else 204, listing)
+
+        obj = self.server.objects.get(self.object_name)
+        if obj is None:
+            return self._respond(404)
+        data = self._object_data(obj)
+        headers = {'Content-Type': obj['headers'].get('Content-Type')}
+        if obj['headers'].get('X-Object-Manifest'):
+            headers['X-Object-Manifest'] = obj['headers']['X-Object-Manifest']
+
+        byte_range = self.headers.get('Range')
+        if byte_range:
+            start = int(byte_range[len('bytes='):].rstrip('-'))
+            if start >= len(data):
+                return self._respond(416)
+            headers['Content-Range'] = 'bytes {0}-{1}/{2}'.format(
+                start, len(data) - 1, len(data))
+            return self._respond(206, data[start:], headers)
+        headers['Content-Length'] = str(len(data))
+        self._respond(200, data, headers)
+
+    do_HEAD = do_GET
+
+    def do_PUT(self):
+        if not self._parse():
+            return
+        if self.object_name is None:
+            return self._respond(201)
+        headers = dict(
+            (name, self.headers.get(name))
+            for name in ('Content-Type', 'X-Object-Manifest')
+            if self.headers.get(name) is not None)
+        self.server.objects[self.object_name] = {
+            'data': self.body, 'headers': headers}
+        self._respond(201)
+
+    def do_DELETE(self):
+        if not self._parse():
+            return
+        if self.server.objects.pop(self.object_name, None) is None:
+            return self._respond(404)
+        self._respond(204)
+
+
+class FakeSwiftServer(FakeHTTPServer):
+    def __init__(self):
+        FakeHTTPServer.__init__(self, FakeSwiftHandler)
+        self.objects = {}
+        self.requests = []
+        self.connections = 0
+        self.token = self.next_token = 'token1'
+        self.storage_url = self.url + '/v1/AUTH_test'
+
+
+class TestSwiftStorage(object):
+    def setUp(self):
+        self.servers = []
+        self.storages = []
+
+    def tearDown(self):
+        for storage in self.storages:
+            storage.close()
+        for server in self.servers:
+            server.stop()
+
+    def get_swift_storage(self, **kwargs):
+        server = FakeSwiftServer().start()
+        self.servers.append(server)
+        config = {
+            'swift_auth_url': server.url + '/auth/v1.0',
+            'swift_user': 'test:tester',
+            'swift_key': 'testing',
+            'swift_container': 'media'}
+        config.update(kwargs)
+        storage = SwiftStorage(**config)
+        self.storages.append(storage)
+        return server, storage
+
+    def test_swift_storage_write_read_delete(self):
+        server, storage = self.get_swift_storage()
+        filepath = ['dir1', 'file.webm']
+
+        assert not storage.file_exists(filepath)
+        with storage.get_file(filepath, 'wb') as our_file:
+            our_file.write('first ')
+            our_file.write('second')
+
+        # Just the file_exists HEAD and the PUT
+        assert_equal([method for method, name, byte_range in server.requests
+                      if name == 'dir1/file.webm'], ['HEAD', 'PUT'])
+
+        assert_true(storage.file_exists(filepath))
+        our_object = server.objects['dir1/file.webm']
+        assert_equal(our_object['data'], 'first second')
+        assert_equal(our_object['headers']['Content-Type'], 'video/webm')
+        with storage.get_file(filepath) as our_file:
+            assert_equal(our_file.read(), 'first second')
+        assert_equal(storage.file_url(filepath),
+                     server.storage_url + '/media/dir1/file.webm')
+
+        storage.delete_file(filepath)
+        assert not storage.file_exists(filepath)
+        assert_raises(IOError, storage.get_file(filepath).read)
+
+    def test_swift_storage_segmented_upload(self):
+        server, storage = self.get_swift_storage(
+            swift_segment_size='10', swift_upload_threads='2')
+        data = ''.join(chr(ord('a') + i % 26) for i in range(35))
+
+        with storage.get_file(['big.bin'], 'wb') as our_file:
+            for start in range(0, len(data), 7):
+                our_file.write(data[start:start + 7])
+
+        segments = sorted(name for name in server.objects
+                          if name.startswith('.segments/big.bin/'))
+        assert_equal([len(server.objects[name]['data']) for name in segments],
+                     [10, 10, 10, 5])
+        assert_equal(server.objects['big.bin']['data'], '')
+        with storage.get_file(['big.bin']) as our_file:
+            assert_equal(our_file.read(), data)
+
+        # Overwriting drops the old segments
+        with storage.get_file(['big.bin'], 'wb') as our_file:
+            our_file.write('small')
+        assert_equal(sorted(server.objects), ['big.bin'])
+
+        with storage.get_file(['big.bin'], 'wb') as our_file:
+            our_file.write(data)
+        storage.delete_file(['big.bin'])
+        assert_equal(server.objects, {})
+
+    def test_swift_storage_aborted_upload(self):
+        server, storage = self.get_swift_storage(swift_segment_size='10')
+
+        def write_and_fail():
+            with storage.get_file(['failed.bin'], 'wb') as our_file:
+                our_file.write('x' * 25)
+                raise ValueError()
+
+        assert_raises(ValueError, write_and_fail)
+        assert_equal(server.objects, {})
+
+    def test_swift_storage_range_reads(self):
+        server, storage = self.get_swift_storage()
+        with storage.get_file(['file.txt'], 'wb') as our_file:
+            our_file.write('0123456789')
+
+        our_file = storage.get_file(['file.txt'])
+        assert_equal(our_file.read(3), '012')
+        assert_equal(our_file.read(3), '345')
+        our_file.seek(8)
+        assert_equal(our_file.read(), '89')
+        our_file.seek(-4, 2)
+        assert_equal(our_file.tell(), 6)
+        assert_equal(our_file.read(2), '67')
+        our_file.seek(20)
+        assert_equal(our_file.read(), '')
+        our_file.close()
+
+        gets = [byte_range for method, name, byte_range in server.requests
+                if method == 'GET' and name == 'file.txt']
+        assert_equal(gets, [None, 'bytes=8-', 'bytes=6-'])
+
+    def test_swift_storage_reuses_connections(self):
+        server, storage = self.get_swift_storage(swift_pool_size='2')
+        for i in range(10):
+            with storage.get_file(['file{0}.txt'.format(i)], 'wb') as our_file:
+                our_file.write('data')
+            storage.file_exists(['file{0}.txt'.format(i)])
+
+        # One for authenticating, one kept alive for all the requests
+        assert_equal(server.connections, 2)
+
+    def test_swift_storage_reauthenticates(self):
+        server, storage = self.get_swift_storage()
+        server.token = 'expired'
+        server.next_token = 'token2'
+
+        with storage.get_file(['file.txt'], 'wb') as our_file:
+            our_file.write('data')
+
+        assert_equal(storage.auth_token, 'token2')
+        assert_equal(server.objects['file.txt']['data'], 'data')
+
+    def test_swift_storage_existing_files(self):
+        server, storage = self.get_swift_storage()
+        for filepath in (['dir1', 'taken.txt'], ['dir1', 'sub', 'free.txt'],
+                         ['dir2', 'free.txt']):
+            with storage.get_file(filepath, 'wb') as our_file:
+                our_file.write('data')
+        del server.requests[:]
+
+        assert_equal(
+            storage.existing_files([u'dir1'], [u'free.txt', u'taken.txt']),
+            set([u'taken.txt']))
+        assert_equal(len(server.requests), 1)
+
+        first, second, third = storage.get_unique_filepaths(
+            [u'dir1'], [u'taken.txt', u'free.txt', u'free.txt'])
+        assert first[-1].endswith(u'-taken.txt')
+        assert_equal(second, [u'dir1', u'free.txt'])
+        assert third[-1].endswith(u'-free.txt')
@@ -0,0 +1,294 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import time
+import tempfile
+from StringIO import StringIO
+
+from nose.plugins.skip import SkipTest
+from nose.tools import assert_equal, assert_raises
+
+try:
+    import pygst
+except ImportError:
+    raise SkipTest('The video media type needs GStreamer')
+
+from mediagoblin.media_types.video.processing import parse_renditions, \
+    is_web_compatible
+from mediagoblin.media_types.video.transcoders import fit_renditions
+from mediagoblin.media_types.video import segments
+from mediagoblin.media_types.video.storyboard import format_vtt_time, \
+    storyboard_cues, write_vtt
+
+
+def test_parse_renditions():
+    assert_equal(
+        parse_renditions(['360p:640x360:700', '1080p:1920x1080:4000']),
+        [('360p', (640, 360), 700000), ('1080p', (1920, 1080), 4000000)])
+    assert_equal(parse_renditions([]), [])
+
+
+def test_parse_renditions_rejects_bad_ones():
+    for renditions in (
+            ['360p:640x360'],
+            ['360p:640:700'],
+            ['360p:640xabc:700'],
+            # Names end up in media file keys and filenames
+            ['../360p:640x360:700'],
+            ['360 p:640x360:700'],
+            [':640x360:700'],
+            # Taken by the 640p WebM
+            ['640:640x480:1000'],
+            ['640p:640x480:1000'],
+            ['360p:640x360:700', '360p:480x360:500']):
+        assert_raises(ValueError, parse_renditions, renditions)
+
+
+RENDITIONS = [
+    ('360p.webm', (640, 360), 700000),
+    ('720p.webm', (1280, 720), 2000000),
+    ('1080p.webm', (1920, 1080), 4000000)]
+
+
+def test_fit_renditions():
+    assert_equal(fit_renditions(RENDITIONS, 1920, 1080), [
+            ('360p.webm', (640, 360), 700000),
+            ('720p.webm', (1280, 720), 2000000),
+            ('1080p.webm', (1920, 1080), 4000000)])
+
+    # 4:3 fits by its height
+    assert_equal(fit_renditions(RENDITIONS[:2], 1440, 1080), [
+            ('360p.webm', (480, 360), 700000),
+            ('720p.webm', (960, 720), 2000000)])
+
+
+def test_fit_renditions_leaves_out_bigger_ones():
+    assert_equal(fit_renditions(RENDITIONS, 1280, 720), [
+            ('360p.webm', (640, 360), 700000),
+            ('720p.webm', (1280, 720), 2000000)])
+    assert_equal(fit_renditions(RENDITIONS, 320, 240), [])
+
+
+def test_fit_renditions_portrait():
+    # Turned on its side, 720p is 720 pixels wide
+    assert_equal(fit_renditions(RENDITIONS, 1080, 1920), [
+            ('360p.webm', (360, 640), 700000),
+            ('720p.webm', (720, 1280), 2000000),
+            ('1080p.webm', (1080, 1920), 4000000)])
+
+
+def test_fit_renditions_even_dimensions():
+    # 639.43x360 and 852x479.81 rounded down to even sizes
+    assert_equal(
+        fit_renditions([('a.webm', (640, 360), 1)], 1000, 563),
+        [('a.webm', (638, 360), 1)])
+    assert_equal(
+        fit_renditions([('b.webm', (853, 480), 1)], 1280, 720),
+        [('b.webm', (852, 478), 1)])
+
+
+def test_split_ranges():
+    # Each range at least a segment long, the last one at least half
+    assert_equal(
+        segments.split_ranges(range(0, 20, 2), 20, 6),
+        [(0, 6), (6, 12), (12, None)])
+    assert_equal(
+        segments.split_ranges([0, 7, 9, 15], 16, 5),
+        [(0, 7), (7, None)])
+    # Too short to split
+    assert_equal(segments.split_ranges([0, 2], 4, 10), [(0, None)])
+
+
+def test_split_ranges_without_keyframes():
+    assert_equal(
+        segments.split_ranges([], 20, 6),
+        [(0, 6), (6, 12), (12, None)])
+
+
+def test_segment_progress_callbacks():
+    progress = []
+    callbacks = segments.segment_progress_callbacks(
+        [300, 100], progress.append)
+
+    callbacks[1](100)
+    callbacks[0](50)
+    callbacks[0](100)
+    assert_equal(progress, [25, 62, 100])
+
+    # Without a callback to report to
+    segments.segment_progress_callbacks([1])[0](50)
+
+
+class TestTranscodeSegments(object):
+    """
+    Child processes running scripts in place of the real transcoding,
+    which segments._segment_command picks by the spec's dst
+    """
+    SCRIPTS = {
+        'ok': 'print "progress 50"; print "renditions [0, 2]"',
+        'stray': ('print "some warning"; print "progress 50"; '
+                  'print "progress soon"; print "renditions [0, 2]"'),
+        'no renditions': 'print "progress 100"',
+        'exit 1': 'import sys; print "renditions []"; sys.exit(1)',
+        'fail': 'import sys, time; time.sleep(0.5); sys.exit(1)',
+        'slow': 'import time; time.sleep(30); print "renditions []"'}
+
+    def setUp(self):
+        self.real_segment_command = segments._segment_command
+        segments._segment_command = lambda spec: [
+            sys.executable, '-c', self.SCRIPTS[spec['dst']]]
+
+    def tearDown(self):
+        segments._segment_command = self.real_segment_command
+
+    def transcode(self, *dsts):
+        self.progress = [[] for dst in dsts]
+        return segments.transcode_segments(
+            [{'dst': dst} for dst in dsts],
+            [progress.append for progress in self.progress],
+            len(dsts))
+
+    def test_renditions_and_progress(self):
+        assert_equal(self.transcode('ok', 'stray'), [[0, 2], [0, 2]])
+        assert_equal(self.progress, [[50], [50]])
+
+    def test_failures(self):
+        assert_raises(segments.SegmentError, self.transcode, 'no renditions')
+        assert_raises(segments.SegmentError, self.transcode, 'exit 1')
+
+    def test_first_failure_stops_the_others(self):
+        start = time.time()
+        try:
+            self.transcode('slow', 'fail', 'slow')
+        except segments.SegmentError as exc:
+            # Not the errors of the segments it stopped
+            assert_equal(str(exc), 'Transcoding fail failed')
+        else:
+            assert False, 'SegmentError not raised'
+        assert time.time() - start < 10
+
+
+class FakeCaps(object):
+    """Stands in for the gst.Caps the discoverer finds"""
+    def __init__(self, name):
+        self.name = name
+
+    def __getitem__(self, index):
+        return self
+
+    def get_name(self):
+        return self.name
+
+
+class TestIsWebCompatible(object):
+    def setUp(self):
+        # 250000 bytes: 2000 kbit, 2000 kbit/s for a second of video
+        handle, self.filename = tempfile.mkstemp(suffix='.webm')
+        os.write(handle, '\0' * 250000)
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def discovered(self, **kwargs):
+        data = {
+            'is_video': True,
+            'is_audio': True,
+            'mimetype': 'video/webm',
+            'videocaps': FakeCaps('video/x-vp8'),
+            'audiocaps': FakeCaps('audio/x-vorbis'),
+            'videowidth': 640,
+            'videoheight': 360,
+            'videolength': 1000000000}
+        data.update(kwargs)
+        return data
+
+    def test_compatible(self):
+        assert is_web_compatible(self.discovered(), self.filename, 2000)
+        assert is_web_compatible(
+            self.discovered(is_audio=False, audiocaps=None),
+            self.filename, 2000)
+
+    def test_bitrate(self):
+        assert not is_web_compatible(self.discovered(), self.filename, 1999)
+        # Twice as long, half the bitrate
+        assert is_web_compatible(
+            self.discovered(videolength=2000000000), self.filename, 1000)
+        assert not is_web_compatible(
+            self.discovered(videolength=0), self.filename, 2000)
+
+    def test_format(self):
+        for data in (
+                None,
+                self.discovered(is_video=False),
+                self.discovered(mimetype='video/x-matroska'),
+                self.discovered(videocaps=FakeCaps('video/x-h264')),
+                self.discovered(audiocaps=FakeCaps('audio/mpeg'))):
+            assert not is_web_compatible(data, self.filename, 2000)
+
+    def test_dimensions(self):
+        assert is_web_compatible(
+            self.discovered(videowidth=640, videoheight=640),
+            self.filename, 2000)
+        assert not is_web_compatible(
+            self.discovered(videowidth=642), self.filename, 2000)
+        assert not is_web_compatible(
+            self.discovered(videoheight=720), self.filename, 2000)
+        assert is_web_compatible(
+            self.discovered(videowidth=1280, videoheight=720),
+            self.filename, 2000, dimensions=(1280, 1280))
+
+
+SECOND = 1000000000
+
+
+def test_format_vtt_time():
+    assert_equal(format_vtt_time(0), '00:00:00.000')
+    assert_equal(format_vtt_time(62 * SECOND + 500999999), '00:01:02.500')
+    assert_equal(format_vtt_time(3 * 3600 * SECOND + 7 * SECOND),
+                 '03:00:07.000')
+
+
+def test_storyboard_cues():
+    cues = storyboard_cues(
+        [2 * SECOND, 5 * SECOND, 9 * SECOND], 12 * SECOND, 2, (160, 90))
+    assert_equal(cues, [
+        # The first frame is shown from the beginning
+        (0, 5 * SECOND, (0, 0, 160, 90)),
+        (5 * SECOND, 9 * SECOND, (160, 0, 160, 90)),
+        # On the next row, until the end
+        (9 * SECOND, 12 * SECOND, (0, 90, 160, 90))])
+
+    assert_equal(storyboard_cues([0], SECOND, 10, (160, 120)),
+                 [(0, SECOND, (0, 0, 160, 120))])
+    assert_equal(storyboard_cues([], SECOND, 10, (160, 120)), [])
+
+
+def test_write_vtt():
+    vtt = StringIO()
+    write_vtt(vtt, storyboard_cues(
+            [0, 1500000000], 61 * SECOND, 10, (160, 90)),
+        '/media/storyboard.jpg')
+    assert_equal(vtt.getvalue(), (
+            'WEBVTT\n'
+            '\n'
+            '00:00:00.000 --> 00:00:01.500\n'
+            '/media/storyboard.jpg#xywh=0,0,160,90\n'
+            '\n'
+            '00:00:01.500 --> 00:01:01.000\n'
+            '/media/storyboard.jpg#xywh=160,0,160,90\n'))
@@ -17,6 +17,8 @@
 import os
 import tempfile
 
+from nose.tools import assert_equal
+
 
 from mediagoblin.tools import workbench
 from mediagoblin.mg_globals import setup_globals
@@ -109,3 +111,61 @@ class TestWorkbench(object):
         benchdir = create_it()
         # workbench dir has been cleaned up automatically?
         assert not os.path.isdir(benchdir)
+
+    def test_localized_file_cache(self):
+        workbench_manager = workbench.WorkbenchManager(
+            tempfile.mkdtemp(), cache_size=15)
+        tmpdir, this_storage = get_tmp_filestorage(fake_remote=True)
+        copied = []
+
+        def copy_locally(filepath, dest_path):
+            copied.append(filepath)
+            with file(dest_path, 'w') as dest_file:
+                dest_file.write(this_storage.get_file(filepath).read())
+        this_storage.copy_locally = copy_locally
+        this_storage.file_version = lambda filepath: unicode(
+            os.path.getmtime(this_storage.get_local_path(filepath)))
+
+        filepath = ['dir1', 'ourfile.txt']
+        with this_storage.get_file(filepath, 'w') as our_file:
+            our_file.write('Our file')
+
+        # The second workbench gets a link to the first copy
+        with workbench_manager.create() as first_workbench:
+            first = first_workbench.localized_file(this_storage, filepath)
+            with workbench_manager.create() as second_workbench:
+                second = second_workbench.localized_file(
+                    this_storage, filepath)
+                assert_equal(file(second).read(), 'Our file')
+                assert_equal(os.stat(first).st_ino, os.stat(second).st_ino)
+        assert_equal(len(copied), 1)
+
+        # A changed file is copied again
+        with this_storage.get_file(filepath, 'w') as our_file:
+            our_file.write('Changed')
+        os.utime(this_storage.get_local_path(filepath), (0, 0))
+        with workbench_manager.create() as this_workbench:
+            filename = this_workbench.localized_file(this_storage, filepath)
+            assert_equal(file(filename).read(), 'Changed')
+
+            # Adding a file over the size limit evicts the old ones,
+            # but files linked into workbenches stay
+            with this_storage.get_file(['other.txt'], 'w') as our_file:
+                our_file.write('Another file')
+            this_workbench.localized_file(this_storage, ['other.txt'])
+            assert_equal(file(filename).read(), 'Changed')
+
+        assert_equal(len(copied), 3)
+        cache_dir = workbench_manager.cache.cache_dir
+        cached = [name for name in os.listdir(cache_dir)
+                  if not name.endswith('.lock')]
+        assert_equal(len(cached), 1)
+        assert_equal(file(os.path.join(cache_dir, cached[0])).read(),
+                     'Another file')
+
+        # Storage systems without file versions are not cached
+        del this_storage.file_version
+        with workbench_manager.create() as this_workbench:
+            this_workbench.localized_file(this_storage, filepath)
+            this_workbench.localized_file(this_storage, filepath, 'again')
+        assert_equal(len(copied), 5)
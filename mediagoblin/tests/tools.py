@@ -18,9 +18,13 @@
 import os
 import pkg_resources
 import shutil
+import threading
 
+from BaseHTTPServer import HTTPServer
+from SocketServer import ThreadingMixIn
 from functools import wraps
 
+import beaker.cache
 from paste.deploy import loadapp
 from webtest import TestApp
 
@@ -125,6 +129,8 @@ def get_app(dump_old_app=True):
     # Remove and reinstall user_dev directories
     if os.path.exists(TEST_USER_DEV):
         shutil.rmtree(TEST_USER_DEV)
+    # ... and forget beaker's caches, their files and locks are gone
+    beaker.cache.cache_managers.clear()
 
     for directory in USER_DEV_DIRECTORIES_TO_SETUP:
         full_dir = os.path.join(TEST_USER_DEV, directory)
@@ -263,3 +269,37 @@ def fixture_add_collection(name=u"My first Collection", user=None):
     Session.expunge(coll)
 
     return coll
+
+
+class FakeHTTPServer(ThreadingMixIn, HTTPServer):
+    """
+    A threaded HTTP server on a free local port, answering with
+    handler_class, to stand in for remote services.
+
+    Call start() to serve, and stop() in the test's teardown.
+    """
+    daemon_threads = True
+
+    def __init__(self, handler_class):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), handler_class)
+        self.url = 'http://127.0.0.1:{0}'.format(self.server_port)
+        self._thread = None
+
+    def handle_error(self, request, client_address):
+        # Clients closing half read connections are fine
+        pass
+
+    def start(self):
+        # Poll often, so stop() is quick
+        self._thread = threading.Thread(
+            target=self.serve_forever, args=(0.05,))
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self.shutdown()
+            self._thread.join()
+            self._thread = None
+        self.server_close()
@@ -0,0 +1,70 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Cached values that may be invalidated while they are being built.
+
+A value built from rows read before an edit commits can be put after
+the edit invalidated it.  So each key has a generation, which
+invalidating replaces, and values are stored with the generation they
+were built in; those of an older one don't count.
+
+Use:
+  generation, value = get_versioned(cache, key)
+  if value is None:
+      value = build()
+      put_versioned(cache, key, generation, value)
+"""
+
+import uuid
+
+
+def _generation_key(key):
+    return u'generation:' + key
+
+
+def get_versioned(cache, key):
+    """
+    Return the current generation of key in the beaker cache, and its
+    value, or None if it has none of that generation.
+
+    Get this before reading what the value is built from.
+    """
+    try:
+        generation = cache.get(_generation_key(key))
+    except KeyError:
+        generation = uuid.uuid4().hex
+        cache.put(_generation_key(key), generation)
+
+    try:
+        stored_generation, value = cache.get(key)
+    except KeyError:
+        return generation, None
+
+    if stored_generation != generation:
+        return generation, None
+    return generation, value
+
+
+def put_versioned(cache, key, generation, value):
+    """Store value, built in generation, under key"""
+    cache.put(key, (generation, value))
+
+
+def invalidate_versioned(cache, key):
+    """Start a new generation of key, so the value there doesn't count"""
+    cache.put(_generation_key(key), uuid.uuid4().hex)
+    cache.remove_value(key)
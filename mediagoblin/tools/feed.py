@@ -0,0 +1,108 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import logging
+
+from werkzeug.wrappers import Response
+
+from mediagoblin import mg_globals
+from mediagoblin.tools.cache import get_versioned, put_versioned, \
+    invalidate_versioned
+
+_log = logging.getLogger(__name__)
+
+FEED_CACHE_NAME = 'atom_feeds'
+
+
+def _feed_cache():
+    if mg_globals.cache is None:
+        return None
+    return mg_globals.cache.get_cache(FEED_CACHE_NAME)
+
+
+def _feed_cache_key(key_parts):
+    return u':'.join(unicode(part) for part in key_parts)
+
+
+def cached_feed_response(request, feed_key, build_feed):
+    """
+    Return a conditional response for an atom feed, cached per host.
+
+    :param feed_key: tuple identifying the feed, like (u'user', username)
+    :param build_feed: called without arguments on a cache miss.  Returns
+        a tuple of the AtomFeed and the datetime of its newest entry (or
+        None), or a Response (like a 404) to return uncached.
+
+    The cached feed is served with a strong ETag and a Last-Modified
+    header, so polling clients can get a 304 without the feed being
+    built or the database being touched.
+    """
+    cache = _feed_cache()
+    key = _feed_cache_key(feed_key)
+
+    # All hosts' versions of a feed are kept under one key, so they
+    # can be invalidated together.  A feed invalidated while it is
+    # built, like by an entry finishing processing, doesn't count.
+    feeds = None
+    if cache is not None:
+        generation, feeds = get_versioned(cache, key)
+    feeds = feeds or {}
+
+    cached = feeds.get(request.host_url)
+    if cached is None:
+        result = build_feed()
+        if not isinstance(result, tuple):
+            return result
+
+        feed, last_modified = result
+        body = feed.to_string().encode('utf-8')
+        cached = (hashlib.sha1(body).hexdigest(), last_modified, body)
+        if cache is not None:
+            feeds[request.host_url] = cached
+            put_versioned(cache, key, generation, feeds)
+
+    etag, last_modified, body = cached
+    response = Response(body, mimetype='application/atom+xml')
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    return response.make_conditional(request)
+
+
+def invalidate_feed(*feed_key):
+    """Drop the cached feed for feed_key, for all hosts"""
+    cache = _feed_cache()
+    if cache is None:
+        return
+    invalidate_versioned(cache, _feed_cache_key(feed_key))
+
+
+def invalidate_media_entry_feeds(entry):
+    """
+    Drop every cached feed a MediaEntry shows up in: its uploader's,
+    its tags' and its collections'.
+    """
+    invalidate_feed(u'user', entry.get_uploader.username)
+    for tag in entry.tags:
+        invalidate_feed(u'tag', tag['slug'])
+    for item in entry.collections_helper:
+        invalidate_collection_feed(item.in_collection)
+
+
+def invalidate_collection_feed(collection):
+    invalidate_feed(
+        u'collection', collection.get_creator.username, collection.slug)
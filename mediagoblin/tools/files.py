@@ -17,6 +17,10 @@
 from mediagoblin import mg_globals
 
 
+# How much of a file to hold in memory at once when copying it around
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
 def delete_media_files(media):
     """
     Delete all files associated with a MediaEntry
@@ -25,7 +29,13 @@ def delete_media_files(media):
      - media: A MediaEntry document
     """
     no_such_files = []
+    # A file may be stored under several keys, like a video published
+    # as it was uploaded, as both its WebM and its original
+    seen = set()
     for listpath in media.media_files.itervalues():
+        if tuple(listpath) in seen:
+            continue
+        seen.add(tuple(listpath))
         try:
             mg_globals.public_store.delete_file(
                 listpath)
@@ -0,0 +1,71 @@
+# GNU MediaGoblin -- federated, autonomous media hosting
+# Copyright (C) 2011, 2012 MediaGoblin contributors.  See AUTHORS.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import httplib
+import threading
+import urlparse
+import Queue
+from contextlib import contextmanager
+
+
+class ConnectionPool(object):
+    """
+    At most size connections to one host, reused across requests and
+    threads.
+    """
+    def __init__(self, url, size, timeout=None):
+        url = urlparse.urlsplit(url)
+        if url.scheme == 'https':
+            self.connection_class = httplib.HTTPSConnection
+        else:
+            self.connection_class = httplib.HTTPConnection
+        self.netloc = url.netloc
+        self.timeout = timeout
+        self._idle = Queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def get(self):
+        """Wait for a free connection and take it"""
+        self._slots.acquire()
+        try:
+            return self._idle.get_nowait()
+        except Queue.Empty:
+            return self.connection_class(self.netloc, timeout=self.timeout)
+
+    def put(self, connection):
+        """Hand a connection taken with get() back"""
+        self._idle.put(connection)
+        self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        connection = self.get()
+        try:
+            yield connection
+        except:
+            # Whatever state it is in, it can't be reused
+            connection.close()
+            raise
+        finally:
+            self.put(connection)
+
+    def close(self):
+        """Close the idle connections"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except Queue.Empty:
+                break
@@ -15,13 +15,46 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import urllib
-import copy
+import base64
+import datetime
 from math import ceil, floor
-from itertools import izip, count
+
+from sqlalchemy import and_, or_
+
+from werkzeug.exceptions import NotFound
+
+from mediagoblin import mg_globals
 
 
 PAGINATION_DEFAULT_PER_PAGE = 30
 
+KEYSET_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def _cursor_model(cursor):
+    """Return the model class a query cursor selects"""
+    return cursor.column_descriptions[0]['type']
+
+
+def _sorts_before(model, created, id, ascending=False):
+    """
+    Condition for rows that are listed before the row with the given
+    created and id when sorting by (created, id).
+    """
+    if ascending:
+        return or_(model.created < created,
+                   and_(model.created == created, model.id < id))
+    return or_(model.created > created,
+               and_(model.created == created, model.id > id))
+
+
+def _sorts_after(model, created, id, ascending=False):
+    """
+    Condition for rows that are listed after the row with the given
+    created and id when sorting by (created, id).
+    """
+    return _sorts_before(model, created, id, not ascending)
+
 
 class Pagination(object):
     """
@@ -30,9 +63,10 @@ class Pagination(object):
     Initialization through __init__(self, cursor, page=1, per_page=2),
     get actual data slice through __call__().
     """
+    keyset = False
 
     def __init__(self, page, cursor, per_page=PAGINATION_DEFAULT_PER_PAGE,
-                 jump_to_id=False):
+                 jump_to_id=False, ascending=False):
         """
         Initializes Pagination
 
@@ -42,22 +76,37 @@ class Pagination(object):
          - cursor: db cursor
          - jump_to_id: object id, sets the page to the page containing the
            object with id == jump_to_id.
+         - ascending: whether the cursor is sorted by created ascending
+           rather than descending, needed to find jump_to_id.
         """
         self.page = page
         self.per_page = per_page
         self.cursor = cursor
-        self.total_count = self.cursor.count()
         self.active_id = None
+        self._total_count = None
 
         if jump_to_id:
-            cursor = copy.copy(self.cursor)
+            # Count the rows listed before the wanted one, rather than
+            # walking through the cursor to find it.
+            model = _cursor_model(self.cursor)
+            obj = self.cursor.filter(model.id == jump_to_id).first()
 
-            for (doc, increment) in izip(cursor, count(0)):
-                if doc.id == jump_to_id:
-                    self.page = 1 + int(floor(increment / self.per_page))
+            if obj is not None:
+                position = self.cursor.filter(_sorts_before(
+                    model, obj.created, obj.id, ascending)).count()
+                self.page = 1 + int(floor(position / self.per_page))
 
-                    self.active_id = jump_to_id
-                    break
+                self.active_id = obj.id
+
+    @property
+    def total_count(self):
+        """
+        Number of objects in the cursor.  Only counted when needed, and
+        then only once.
+        """
+        if self._total_count is None:
+            self._total_count = self.cursor.count()
+        return self._total_count
 
     def __call__(self):
         """
@@ -111,3 +160,157 @@ class Pagination(object):
         """
         return self.get_page_url_explicit(
             request.full_path, request.GET, page_no)
+
+
+class KeysetPagination(object):
+    """
+    Pagination that seeks to a page instead of counting rows up to it.
+
+    Objects are listed by (created, id), newest first.  Rather than a page
+    number, a page is requested by the opaque key of the object just
+    before it (after=) or just after it (before=), so every page costs an
+    index lookup no matter how deep it is, and no COUNT is ever run.
+
+    Has the same interface as Pagination apart from page numbers: get the
+    objects through __call__() and the links through get_prev_url() and
+    get_next_url().
+    """
+    keyset = True
+
+    def __init__(self, cursor, after=None, before=None,
+                 per_page=PAGINATION_DEFAULT_PER_PAGE, jump_to_id=False):
+        """
+        Initializes KeysetPagination
+
+        Args:
+         - cursor: db cursor, its ordering is replaced by (created, id)
+         - after: key of the object right before the requested page
+         - before: key of the object right after the requested page
+         - per_page: number of objects per page
+         - jump_to_id: object id, starts the page at the object with
+           id == jump_to_id.
+
+        Raises NotFound for keys that can't be decoded.
+        """
+        self.per_page = per_page
+        self.model = _cursor_model(cursor)
+        self.cursor = cursor.order_by(None)
+        self.active_id = None
+        self.has_prev = False
+        self.has_next = False
+
+        if jump_to_id:
+            obj = self.cursor.filter(self.model.id == jump_to_id).first()
+            if obj is not None:
+                self.active_id = obj.id
+                self.objects = self._older_than(
+                    obj.created, obj.id, inclusive=True)
+                self.has_prev = True
+                return
+
+        if before is not None:
+            created, id = self.decode_key(before)
+            self.objects = self._newer_than(created, id)
+            self.has_next = True
+            if len(self.objects) == self.per_page:
+                return
+            # We've run into the top of the listing, show the first page
+            # in full rather than a short one.
+
+        if after is not None and before is None:
+            created, id = self.decode_key(after)
+            self.has_prev = True
+        else:
+            created = id = None
+        self.objects = self._older_than(created, id)
+
+        if not self.objects:
+            # Nothing to link from (like an outdated link past the end)
+            self.has_prev = self.has_next = False
+
+    def _order(self, ascending=False):
+        if ascending:
+            return self.model.created, self.model.id
+        return self.model.created.desc(), self.model.id.desc()
+
+    def _older_than(self, created, id, inclusive=False):
+        cursor = self.cursor
+        if created is not None:
+            condition = _sorts_after(self.model, created, id)
+            if inclusive:
+                condition = or_(condition, self.model.id == id)
+            cursor = cursor.filter(condition)
+
+        objects = cursor.order_by(*self._order()).limit(
+            self.per_page + 1).all()
+        self.has_next = len(objects) > self.per_page
+        return objects[:self.per_page]
+
+    def _newer_than(self, created, id):
+        objects = self.cursor.filter(
+            _sorts_before(self.model, created, id)).order_by(
+                *self._order(ascending=True)).limit(self.per_page + 1).all()
+        self.has_prev = len(objects) > self.per_page
+        objects = objects[:self.per_page]
+        objects.reverse()
+        return objects
+
+    @staticmethod
+    def encode_key(obj):
+        """Build the opaque key for a listed object"""
+        return base64.urlsafe_b64encode('{0}|{1}'.format(
+            obj.created.strftime(KEYSET_DATETIME_FORMAT), obj.id))
+
+    @staticmethod
+    def decode_key(key):
+        """Return (created, id) for a key made by encode_key()"""
+        try:
+            created, id = base64.urlsafe_b64decode(str(key)).split('|')
+            return (datetime.datetime.strptime(created, KEYSET_DATETIME_FORMAT),
+                    int(id))
+        except (TypeError, ValueError):
+            raise NotFound()
+
+    def __call__(self):
+        """
+        Returns the objects of the requested page
+        """
+        return self.objects
+
+    def get_page_url_explicit(self, base_url, get_params, key_name, key):
+        """
+        Get a page url by adding an after= or before= parameter to the
+        base url
+        """
+        new_get_params = dict(get_params) or {}
+        for name in ('page', 'after', 'before'):
+            new_get_params.pop(name, None)
+        new_get_params[key_name] = key
+        return "%s?%s" % (
+            base_url, urllib.urlencode(new_get_params))
+
+    def get_prev_url(self, base_url, get_params):
+        """Url of the page of newer objects"""
+        return self.get_page_url_explicit(
+            base_url, get_params, 'before', self.encode_key(self.objects[0]))
+
+    def get_next_url(self, base_url, get_params):
+        """Url of the page of older objects"""
+        return self.get_page_url_explicit(
+            base_url, get_params, 'after', self.encode_key(self.objects[-1]))
+
+
+def get_listing_pagination(request, page, cursor,
+                           per_page=PAGINATION_DEFAULT_PER_PAGE):
+    """
+    Paginate a listing of media entries the way this site is configured
+    to, with a KeysetPagination if keyset_pagination is set and a
+    Pagination otherwise.
+    """
+    if mg_globals.app_config['keyset_pagination']:
+        return KeysetPagination(
+            cursor,
+            after=request.GET.get('after'),
+            before=request.GET.get('before'),
+            per_page=per_page)
+    return Pagination(page, cursor, per_page)
@@ -14,19 +14,30 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import atexit
+import httplib
 import logging
 import json
-import traceback
+import socket
+import threading
+import urlparse
+import Queue
 
-from urllib2 import urlopen, Request, HTTPError
+import urllib
+from urllib2 import Request
 from urllib import urlencode
 
+from mediagoblin import mg_globals
 from mediagoblin.tools.common import TESTS_ENABLED
+from mediagoblin.tools.http import ConnectionPool
 
 _log = logging.getLogger(__name__)
 
 TESTS_CALLBACKS = {}
 
+# Characters left as they are when percent-encoding a URL
+URL_SAFE_CHARACTERS = "%/:=&?~#+!$,;'@()*[]"
+
 
 def create_post_request(url, data, **kw):
     '''
@@ -55,12 +66,8 @@ def json_processing_callback(entry):
 
     url = entry.processing_metadata[0].callback_url
 
-    _log.debug('Sending processing callback for {0} ({1})'.format(
-        entry,
-        url))
-
-    headers = {
-            'Content-Type': 'application/json'}
+    # The URL comes from the uploader, and may well be unicode
+    _log.debug(u'Sending processing callback for %r (%r)', entry, url)
 
     data = {
             'id': entry.id,
@@ -71,19 +78,233 @@ def json_processing_callback(entry):
         TESTS_CALLBACKS.update({url: data})
         return True
 
-    request = create_post_request(
-            url,
-            data,
-            headers=headers,
-            data_parser=json.dumps)
+    notification_dispatcher().send_json(url, data)
+    return True
 
-    try:
-        urlopen(request)
-        _log.debug('Processing callback for {0} sent'.format(entry))
 
-        return True
-    except HTTPError:
-        _log.error('Failed to send callback: {0}'.format(
-            traceback.format_exc()))
+class NotificationDispatcher(object):
+    """
+    Sends HTTP POST notifications (processing callbacks and PuSH hub
+    pings) in the background, so nothing waits for the receiving end.
+
+    Requests are sent by a few threads over kept-alive connections,
+    with a timeout.  Failed ones (connection errors and 5xx responses)
+    are retried retries times, waiting retry_delay seconds at first
+    and twice as long every time after that.
+
+    Feeds published within coalesce_window seconds of each other are
+    sent to the hubs in one ping.
+    """
+    # Connections kept per host
+    CONNECTIONS_PER_HOST = 2
+
+    def __init__(self, hub_urls=(), threads=2, timeout=10, retries=4,
+                 retry_delay=2, coalesce_window=5, queue_size=1000):
+        self.hub_urls = list(hub_urls)
+        self.threads = threads
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.coalesce_window = coalesce_window
+
+        self._queue = Queue.Queue(queue_size)
+        self._workers = []
+        self._pools = {}
+        self._lock = threading.Lock()
+        self._feeds = set()
+        self._feeds_timer = None
+        # Notifications queued, being sent or waiting for a retry
+        self._pending = 0
+        self._idle = threading.Condition(self._lock)
+
+    def post(self, url, body, headers=None):
+        """Send body to url in a POST request, some time soon"""
+        with self._lock:
+            self._pending += 1
+        self._put((url, body, headers or {}, 0))
+
+    def send_json(self, url, data):
+        self.post(url, json.dumps(data),
+                  {'Content-Type': 'application/json'})
+
+    def publish_feed(self, feed_url):
+        """Tell the PuSH hubs that the feed at feed_url has changed"""
+        if not self.hub_urls:
+            return
+        with self._lock:
+            self._feeds.add(feed_url)
+            if self._feeds_timer is None:
+                self._pending += 1
+                self._feeds_timer = threading.Timer(
+                    self.coalesce_window, self._ping_hubs)
+                self._feeds_timer.args = [self._feeds_timer]
+                self._feeds_timer.daemon = True
+                self._feeds_timer.start()
+
+    def _ping_hubs(self, timer):
+        with self._lock:
+            if self._feeds_timer is not timer:
+                # join() was quicker
+                return
+            feeds = sorted(self._feeds)
+            self._feeds.clear()
+            self._feeds_timer = None
+            self._pending -= 1
+
+        _log.debug('Notifying PuSH servers for feeds {0}'.format(feeds))
+        body = urlencode(
+            [('hub.mode', 'publish')] +
+            [('hub.url', feed_url) for feed_url in feeds])
+        for hub_url in self.hub_urls:
+            self.post(hub_url, body, {
+                    'Content-Type': 'application/x-www-form-urlencoded'})
+
+    def _put(self, job):
+        with self._lock:
+            if not self._workers:
+                for i in range(self.threads):
+                    worker = threading.Thread(target=self._work)
+                    worker.daemon = True
+                    worker.start()
+                    self._workers.append(worker)
+
+        try:
+            self._queue.put_nowait(job)
+        except Queue.Full:
+            _log.error(u'Too many notifications queued, dropping the one '
+                       u'to %r', job[0])
+            self._done()
 
+    def _done(self):
+        with self._lock:
+            self._pending -= 1
+            if not self._pending:
+                self._idle.notify_all()
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                # Sent by stop()
+                return
+
+            url, body, headers, attempt = job
+            retrying = False
+            try:
+                retrying = self._attempt(url, body, headers, attempt)
+            except Exception:
+                # Whatever went wrong, this thread has more to send
+                _log.exception(u'Sending the notification to %r failed', url)
+            finally:
+                if not retrying:
+                    self._done()
+
+    def _attempt(self, url, body, headers, attempt):
+        """
+        Send a notification, and return whether a retry of it was
+        scheduled
+        """
+        try:
+            status = self._send(url, body, headers)
+        except (httplib.HTTPException, socket.error) as exc:
+            error = exc
+        else:
+            if status < 500:
+                if status >= 400:
+                    _log.error(u'Notification to %r was refused with '
+                               u'status %s', url, status)
+                return False
+            error = 'status {0}'.format(status)
+
+        if attempt < self.retries:
+            delay = self.retry_delay * 2 ** attempt
+            _log.info(u'Notification to %r failed (%r), retrying in '
+                      u'%s seconds', url, error, delay)
+            timer = threading.Timer(
+                delay, self._put, [(url, body, headers, attempt + 1)])
+            timer.daemon = True
+            timer.start()
+            return True
+
+        _log.warn(u'Notification to %r failed (%r), giving up', url, error)
         return False
+
+    def _send(self, url, body, headers):
+        if isinstance(url, unicode):
+            # Percent-encode what isn't ASCII, like browsers do
+            url = urllib.quote(url.encode('utf-8'), safe=URL_SAFE_CHARACTERS)
+        url = urlparse.urlsplit(url)
+        key = (url.scheme, url.netloc)
+        with self._lock:
+            if key not in self._pools:
+                self._pools[key] = ConnectionPool(
+                    '{0}://{1}'.format(*key), self.CONNECTIONS_PER_HOST,
+                    self.timeout)
+            pool = self._pools[key]
+
+        path = url.path or '/'
+        if url.query:
+            path += '?' + url.query
+        with pool.connection() as connection:
+            connection.request('POST', path, body, headers)
+            response = connection.getresponse()
+            response.read()
+        return response.status
+
+    def join(self, timeout=None):
+        """
+        Send the hub pings waiting for the coalesce window now, and
+        wait until all notifications are sent or given up on.
+        """
+        with self._lock:
+            timer = self._feeds_timer
+        if timer is not None:
+            timer.cancel()
+            self._ping_hubs(timer)
+
+        with self._lock:
+            while self._pending:
+                self._idle.wait(timeout)
+                if timeout is not None:
+                    break
+            return not self._pending
+
+    def stop(self, timeout=None):
+        """
+        join(), then end the worker threads and close the connections.
+        Notifications posted afterwards start new workers.
+        """
+        done = self.join(timeout)
+        with self._lock:
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            self._queue.put(None)
+        for worker in workers:
+            worker.join(timeout)
+        with self._lock:
+            pools, self._pools = self._pools.values(), {}
+        for pool in pools:
+            pool.close()
+        return done
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def notification_dispatcher():
+    """Return the NotificationDispatcher of this process"""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            config = mg_globals.app_config
+            _dispatcher = NotificationDispatcher(
+                hub_urls=config['push_urls'],
+                threads=config['notification_threads'],
+                timeout=config['notification_timeout'],
+                retries=config['notification_retries'],
+                retry_delay=config['notification_retry_delay'],
+                coalesce_window=config['push_coalesce_window'])
+            # Don't lose what's waiting when the worker shuts down
+            atexit.register(_dispatcher.join, config['notification_timeout'])
+    return _dispatcher
@@ -15,11 +15,37 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
+import tempfile
+
+from werkzeug.wrappers import Request as BaseRequest
+
 from mediagoblin.db.models import User
 
 _log = logging.getLogger(__name__)
 
 
+class Request(BaseRequest):
+    # Uploads bigger than this go to a temporary file, smaller ones
+    # stay in memory
+    MAX_MEMORY_UPLOAD_SIZE = 1024 * 500
+
+    def _get_file_stream(self, total_content_length, content_type,
+                         filename=None, content_length=None):
+        """
+        Spool big file uploads (and those of unknown size) to a named
+        temporary file.
+
+        Having a name lets media sniffers that need a real file read
+        the upload as is, instead of copying it first.
+        """
+        if (total_content_length is None
+                or total_content_length > self.MAX_MEMORY_UPLOAD_SIZE):
+            return tempfile.NamedTemporaryFile('w+b', prefix='mgupload-')
+        return BaseRequest._get_file_stream(
+            self, total_content_length, content_type, filename,
+            content_length)
+
+
 def setup_user_in_request(request):
     """
     Examine a request and tack on a request.user parameter if that's
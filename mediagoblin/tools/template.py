@@ -17,6 +17,7 @@
 from math import ceil
 
 import jinja2
+from jinja2 import nodes
 from jinja2.ext import Extension
 from jinja2.nodes import Include, Const
 
@@ -27,6 +28,8 @@ from mediagoblin import mg_globals
 from mediagoblin import messages
 from mediagoblin import _version
 from mediagoblin.tools import common
+from mediagoblin.tools.cache import get_versioned, put_versioned, \
+    invalidate_versioned
 from mediagoblin.tools.translate import get_gettext_translation
 from mediagoblin.tools.pluginapi import get_hook_templates
 from mediagoblin.meddleware.csrf import render_csrf_form_token
@@ -56,7 +59,8 @@ def get_jinja_env(template_loader, locale):
         undefined=jinja2.StrictUndefined,
         extensions=[
             'jinja2.ext.i18n', 'jinja2.ext.autoescape',
-            TemplateHookExtension])
+            TemplateHookExtension, FragmentCacheExtension])
+    template_env.fragment_cache_locale = locale
 
     template_env.install_gettext_callables(
         mg_globals.thread_scope.translations.ugettext,
@@ -137,3 +141,80 @@ class TemplateHookExtension(Extension):
                     True))
 
         return includes
+
+
+def _fragment_cache_key(key_parts):
+    return u':'.join(unicode(part) for part in key_parts)
+
+
+def invalidate_template_fragment(*key_parts):
+    """
+    Drop a fragment cached by {% cache %} in all locales.
+
+    Call this with the same key as the template uses, eg:
+      invalidate_template_fragment("media_tile", entry.id)
+    """
+    if mg_globals.cache is None:
+        return
+    cache = mg_globals.cache.get_cache(FragmentCacheExtension.CACHE_NAME)
+    invalidate_versioned(cache, _fragment_cache_key(key_parts))
+
+
+class FragmentCacheExtension(Extension):
+    """
+    Cache a rendered part of a template in the beaker cache.
+
+    Use:
+      {% cache "media_tile", entry.id %}
+        ...
+      {% endcache %}
+
+    ... renders the body only once per locale, until
+    invalidate_template_fragment("media_tile", entry.id) is called.
+    Whatever the body shows must not change without that key being
+    invalidated.  Only does anything if fragment_cache is enabled.
+    """
+
+    tags = set(["cache"])
+
+    CACHE_NAME = 'template_fragments'
+
+    def __init__(self, environment):
+        super(FragmentCacheExtension, self).__init__(environment)
+        environment.extend(fragment_cache_locale=None)
+
+    def parse(self, parser):
+        lineno = parser.stream.next().lineno
+
+        key_parts = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            key_parts.append(parser.parse_expression())
+
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+
+        return nodes.CallBlock(
+            self.call_method('_cache_fragment', [nodes.List(key_parts)]),
+            [], [], body).set_lineno(lineno)
+
+    def _cache_fragment(self, key_parts, caller):
+        if not (mg_globals.app_config.get('fragment_cache')
+                and mg_globals.cache is not None):
+            return caller()
+
+        cache = mg_globals.cache.get_cache(self.CACHE_NAME)
+        key = _fragment_cache_key(key_parts)
+        locale = self.environment.fragment_cache_locale
+
+        # All locales of a fragment are kept under one key, so they
+        # can be invalidated together.  An edit invalidating it while
+        # it is rendered makes this rendering not count.
+        generation, fragments = get_versioned(cache, key)
+        fragments = fragments or {}
+
+        if locale in fragments:
+            return jinja2.Markup(fragments[locale])
+
+        rendered = caller()
+        fragments[locale] = unicode(rendered)
+        put_versioned(cache, key, generation, fragments)
+        return rendered
@@ -14,9 +14,20 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import errno
+import hashlib
+import logging
 import os
 import shutil
 import tempfile
+import uuid
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+_log = logging.getLogger(__name__)
 
 
 # Actual workbench stuff
@@ -29,12 +40,13 @@ class Workbench(object):
     WARNING: DO NOT create Workbench objects on your own,
     let the WorkbenchManager do that for you!
     """
-    def __init__(self, dir):
+    def __init__(self, dir, cache=None):
         """
         WARNING: DO NOT create Workbench objects on your own,
         let the WorkbenchManager do that for you!
         """
         self.dir = dir
+        self.cache = cache
 
     def __unicode__(self):
         return unicode(self.dir)
@@ -60,7 +72,8 @@ class Workbench(object):
 
         If the file is already local, just return the absolute filename of that
         local file.  Otherwise, copy the file locally to the workbench, and
-        return the absolute path of the new file.
+        return the absolute path of the new file.  With a LocalizedFileCache,
+        the new file may be a hard link to a copy made before.
 
         If it is copying locally, we might want to require a filename like
         "source.jpg" to ensure that we won't conflict with other filenames in
@@ -110,8 +123,11 @@ class Workbench(object):
                 self.dir, dest_filename)
 
             # copy it over
-            storage.copy_locally(
-                filepath, full_dest_filename)
+            if self.cache is not None:
+                self.cache.localize(storage, filepath, full_dest_filename)
+            else:
+                storage.copy_locally(
+                    filepath, full_dest_filename)
 
             return full_dest_filename
 
@@ -152,13 +168,152 @@ class WorkbenchManager(object):
     wrapper.
     """
 
-    def __init__(self, base_workbench_dir):
+    def __init__(self, base_workbench_dir, cache_size=0):
         self.base_workbench_dir = os.path.abspath(base_workbench_dir)
         if not os.path.exists(self.base_workbench_dir):
             os.makedirs(self.base_workbench_dir)
 
+        # The cache is next to the workbenches, so it can hard link
+        # into them
+        if cache_size:
+            self.cache = LocalizedFileCache(
+                os.path.join(self.base_workbench_dir, 'cache'), cache_size)
+        else:
+            self.cache = None
+
     def create(self):
         """
         Create and return the path to a new workbench (directory).
         """
-        return Workbench(tempfile.mkdtemp(dir=self.base_workbench_dir))
+        return Workbench(tempfile.mkdtemp(dir=self.base_workbench_dir),
+                         self.cache)
+
+
+class LocalizedFileCache(object):
+    """
+    A least recently used cache of files copied from remote storage,
+    shared by all workbenches (and processes) with the same
+    workbench_path.
+
+    Files are cached under their storage path and the version the
+    storage gives for them (like their ETag), so a changed file is
+    never taken from the cache.  Storage systems that can't tell a
+    version are not cached.  Workbenches get hard links to the cached
+    files, which stay around when the cached file is evicted.
+
+    When more than max_size bytes are cached, the files that were used
+    the longest time ago are removed.
+    """
+    # Files being copied into the cache and lock files
+    TMP_SUFFIX = '.tmp'
+    LOCK_SUFFIX = '.lock'
+
+    def __init__(self, cache_dir, max_size):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        if not os.path.exists(self.cache_dir):
+            try:
+                os.makedirs(self.cache_dir)
+            except OSError as exc:
+                # Another process was quicker
+                if exc.errno != errno.EEXIST:
+                    raise
+
+    def _lock(self, name, blocking=True):
+        """
+        Lock name across processes and return the open lock file, or
+        None if blocking is False and it is locked already.
+        """
+        lock_file = open(
+            os.path.join(self.cache_dir, name + self.LOCK_SUFFIX), 'a')
+        if fcntl is not None:
+            flags = fcntl.LOCK_EX
+            if not blocking:
+                flags |= fcntl.LOCK_NB
+            try:
+                fcntl.flock(lock_file.fileno(), flags)
+            except IOError:
+                lock_file.close()
+                return None
+        return lock_file
+
+    def localize(self, storage, filepath, dest_path):
+        """
+        Put a copy of the file at filepath in storage at dest_path,
+        from the cache if it's there.
+        """
+        version = storage.file_version(filepath)
+        if version is None:
+            storage.copy_locally(filepath, dest_path)
+            return
+
+        key = hashlib.sha1(u'\0'.join(
+                list(filepath) + [version]).encode('utf-8')).hexdigest()
+        cached_path = os.path.join(self.cache_dir, key)
+        added = False
+
+        # Files are locked in 256 stripes, so there are only as many
+        # lock files.  A file is only copied once, while those waiting
+        # for it get it from the cache.
+        lock_file = self._lock(key[:2])
+        try:
+            if os.path.exists(cached_path):
+                # Mark as recently used
+                os.utime(cached_path, None)
+            else:
+                tmp_path = '{0}.{1}{2}'.format(
+                    cached_path, uuid.uuid4().hex, self.TMP_SUFFIX)
+                try:
+                    storage.copy_locally(filepath, tmp_path)
+                    os.rename(tmp_path, cached_path)
+                except:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                    raise
+                added = True
+
+            try:
+                os.link(cached_path, dest_path)
+            except OSError:
+                shutil.copyfile(cached_path, dest_path)
+        finally:
+            lock_file.close()
+
+        if added:
+            self.evict()
+
+    def evict(self):
+        """Remove the least recently used files over max_size"""
+        # If another process is at it already, leave it to that one
+        lock_file = self._lock('evict', blocking=False)
+        if lock_file is None:
+            return
+
+        try:
+            cached = []
+            for name in os.listdir(self.cache_dir):
+                if name.endswith((self.TMP_SUFFIX, self.LOCK_SUFFIX)):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                except OSError:
+                    continue
+                cached.append((stat.st_mtime, stat.st_size, name))
+
+            total_size = sum(size for mtime, size, name in cached)
+            for mtime, size, name in sorted(cached):
+                if total_size <= self.max_size:
+                    break
+                _log.debug('Evicting {0} from the localized file cache'.format(
+                    name))
+                # Not while it's being linked to
+                stripe_lock = self._lock(name[:2])
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except OSError:
+                    continue
+                finally:
+                    stripe_lock.close()
+                total_size -= size
+        finally:
+            lock_file.close()
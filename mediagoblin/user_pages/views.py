@@ -20,9 +20,15 @@ import datetime
 from mediagoblin import messages, mg_globals
 from mediagoblin.db.models import (MediaEntry, Collection, CollectionItem,
                                        User)
+from mediagoblin.db.util import media_entries_for_gallery, \
+    collection_items_for_gallery
+from mediagoblin.processing import get_processing_progress
 from mediagoblin.tools.response import render_to_response, render_404, redirect
+from mediagoblin.tools.feed import cached_feed_response, \
+    invalidate_collection_feed
 from mediagoblin.tools.translate import pass_to_ugettext as _
-from mediagoblin.tools.pagination import Pagination
+from mediagoblin.tools.pagination import Pagination, \
+    get_listing_pagination
 from mediagoblin.user_pages import forms as user_forms
 from mediagoblin.user_pages.lib import send_comment_email
 
@@ -56,8 +62,9 @@ def user_home(request, page):
     cursor = MediaEntry.query.\
         filter_by(uploader = user.id,
                   state = u'processed').order_by(MediaEntry.created.desc())
+    cursor = media_entries_for_gallery(cursor)
 
-    pagination = Pagination(page, cursor)
+    pagination = get_listing_pagination(request, page, cursor)
     media_entries = pagination()
 
     #if no data is available, return NotFound
@@ -84,9 +91,10 @@ def user_gallery(request, page, url_user=None):
     cursor = MediaEntry.query.filter_by(
         uploader=url_user.id,
         state=u'processed').order_by(MediaEntry.created.desc())
+    cursor = media_entries_for_gallery(cursor)
 
     # Paginate gallery
-    pagination = Pagination(page, cursor)
+    pagination = get_listing_pagination(request, page, cursor)
     media_entries = pagination()
 
     #if no data is available, return NotFound
@@ -116,7 +124,8 @@ def media_home(request, media, page, **kwargs):
             page, media.get_comments(
                 mg_globals.app_config['comments_ascending']),
             MEDIA_COMMENTS_PER_PAGE,
-            comment_id)
+            comment_id,
+            mg_globals.app_config['comments_ascending'])
     else:
         pagination = Pagination(
             page, media.get_comments(
@@ -252,6 +261,7 @@ def media_collect(request, media):
 
         media.collected = media.collected + 1
         media.save()
+        invalidate_collection_feed(collection)
 
         messages.add_message(request, messages.SUCCESS,
                              _('"%s" added to collection "%s"'
@@ -309,7 +319,8 @@ def user_collection(request, page, url_user=None):
         get_creator=url_user,
         slug=request.matchdict['collection']).first()
 
-    cursor = collection.get_collection_items()
+    cursor = collection_items_for_gallery(
+        collection.get_collection_items())
 
     pagination = Pagination(page, cursor)
     collection_items = pagination()
@@ -360,6 +371,7 @@ def collection_item_confirm_remove(request, collection_item):
             collection_item.delete()
             collection.items = collection.items - 1
             collection.save()
+            invalidate_collection_feed(collection)
 
             messages.add_message(
                 request, messages.SUCCESS, _('You deleted the item from the collection.'))
@@ -407,6 +419,7 @@ def collection_confirm_delete(request, collection):
                 entry.save()
                 item.delete()
 
+            invalidate_collection_feed(collection)
             collection.delete()
             messages.add_message(
                 request, messages.SUCCESS, _('You deleted the collection "%s"' % collection_title))
@@ -443,6 +456,12 @@ def atom_feed(request):
     """
     generates the atom feed with the newest images
     """
+    return cached_feed_response(
+        request, (u'user', request.matchdict['user']),
+        lambda: _build_atom_feed(request))
+
+
+def _build_atom_feed(request):
     user = User.query.filter_by(
         username = request.matchdict['user'],
         status = u'active').first()
@@ -454,6 +473,7 @@ def atom_feed(request):
         state = u'processed').\
         order_by(MediaEntry.created.desc()).\
         limit(ATOM_DEFAULT_NR_OF_UPDATED_ITEMS)
+    cursor = media_entries_for_gallery(cursor)
 
     """
     ATOM feed id is a tag URI (see http://en.wikipedia.org/wiki/Tag_URI)
@@ -481,7 +501,10 @@ def atom_feed(request):
                    user=request.matchdict['user']),
                links=atomlinks)
 
+    last_modified = None
     for entry in cursor:
+        if last_modified is None:
+            last_modified = entry.created
         feed.add(entry.get('title'),
             entry.description_html,
             id=entry.url_for_self(request.urlgen, qualified=True),
@@ -499,13 +522,21 @@ def atom_feed(request):
                 'rel': 'alternate',
                 'type': 'text/html'}])
 
-    return feed.get_response()
+    return feed, last_modified
 
 
 def collection_atom_feed(request):
     """
     generates the atom feed with the newest images from a collection
     """
+    return cached_feed_response(
+        request,
+        (u'collection', request.matchdict['user'],
+         request.matchdict['collection']),
+        lambda: _build_collection_atom_feed(request))
+
+
+def _build_collection_atom_feed(request):
     user = User.query.filter_by(
         username = request.matchdict['user'],
         status = u'active').first()
@@ -520,6 +551,7 @@ def collection_atom_feed(request):
                  collection=collection.id) \
                  .order_by(CollectionItem.added.desc()) \
                  .limit(ATOM_DEFAULT_NR_OF_UPDATED_ITEMS)
+    cursor = collection_items_for_gallery(cursor)
 
     """
     ATOM feed id is a tag URI (see http://en.wikipedia.org/wiki/Tag_URI)
@@ -548,8 +580,11 @@ def collection_atom_feed(request):
                    title=collection.title),
                links=atomlinks)
 
+    last_modified = None
     for item in cursor:
         entry = item.get_media_entry
+        if last_modified is None:
+            last_modified = item.added
         feed.add(entry.get('title'),
             item.note_html,
             id=entry.url_for_self(request.urlgen, qualified=True),
@@ -567,7 +602,7 @@ def collection_atom_feed(request):
                 'rel': 'alternate',
                 'type': 'text/html'}])
 
-    return feed.get_response()
+    return feed, last_modified
 
 
 @require_active_login
@@ -611,5 +646,7 @@ def processing_panel(request):
         'mediagoblin/user_pages/processing_panel.html',
         {'user': user,
          'processing_entries': processing_entries,
+         'processing_progress': get_processing_progress(
+             processing_entries),
          'failed_entries': failed_entries,
          'processed_entries': processed_entries})
@@ -14,20 +14,32 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import mimetypes
+import os
+import urllib
+from datetime import datetime
+
 from mediagoblin import mg_globals
 from mediagoblin.db.models import MediaEntry
-from mediagoblin.tools.pagination import Pagination
-from mediagoblin.tools.response import render_to_response
+from mediagoblin.db.util import media_entries_for_gallery
+from mediagoblin.storage import clean_listy_filepath, InvalidFilepath
+from mediagoblin.tools.pagination import get_listing_pagination
+from mediagoblin.tools.response import render_to_response, render_404, \
+    Response
 from mediagoblin.decorators import uses_pagination
 
+# Like the public store in paste.ini
+MEDIA_CACHE_MAX_AGE = 604800
+
 
 
 @uses_pagination
 def root_view(request, page):
     cursor = MediaEntry.query.filter_by(state=u'processed').\
         order_by(MediaEntry.created.desc())
+    cursor = media_entries_for_gallery(cursor)
 
-    pagination = Pagination(page, cursor)
+    pagination = get_listing_pagination(request, page, cursor)
     media_entries = pagination()
     return render_to_response(
         request, 'mediagoblin/root.html',
@@ -44,3 +56,67 @@ def simple_template_render(request):
     template_name = request.matchdict['template']
     return render_to_response(
         request, template_name, {})
+
+
+def _media_entry_file(filepath):
+    """
+    Return whether filepath is one of the files of a processed media
+    entry.
+    """
+    if len(filepath) < 3 or filepath[0] != u'media_entries' \
+            or not filepath[1].isdigit():
+        return False
+
+    media = MediaEntry.query.filter_by(
+        id=int(filepath[1]), state=u'processed').first()
+    if media is None:
+        return False
+
+    # Stored file paths are tuples
+    filepaths = media.media_files.values() + [
+        attachment['filepath'] for attachment in media.attachment_files]
+    return tuple(filepath) in [tuple(path) for path in filepaths]
+
+
+def serve_media(request):
+    """
+    Serve a file from the public store, if it belongs to a processed
+    media entry.
+
+    The file itself is sent by the web server in front of MediaGoblin,
+    see media_sendfile.  It also answers range requests.
+    """
+    try:
+        filepath = clean_listy_filepath(
+            request.matchdict['filepath'].split('/'))
+    except InvalidFilepath:
+        return render_404(request)
+    if not _media_entry_file(filepath):
+        return render_404(request)
+
+    local_path = mg_globals.public_store.get_local_path(filepath)
+    try:
+        stat = os.stat(local_path)
+    except OSError:
+        return render_404(request)
+
+    response = Response(
+        mimetype=mimetypes.guess_type(filepath[-1])[0]
+                 or 'application/octet-stream')
+    # The web server sends the body and its length
+    response.automatically_set_content_length = False
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.cache_control.public = True
+    response.cache_control.max_age = MEDIA_CACHE_MAX_AGE
+    response.last_modified = datetime.utcfromtimestamp(stat.st_mtime)
+    response.set_etag('{0:x}-{1:x}'.format(int(stat.st_mtime), stat.st_size))
+
+    if mg_globals.app_config['media_sendfile'] == 'x-accel-redirect':
+        response.headers['X-Accel-Redirect'] = '{0}/{1}'.format(
+            mg_globals.app_config['media_sendfile_prefix'].rstrip('/'),
+            '/'.join(urllib.quote(part.encode('utf-8'))
+                     for part in filepath))
+    else:
+        response.headers['X-Sendfile'] = local_path.encode('utf-8')
+
+    return response.make_conditional(request)